@@ -0,0 +1,77 @@
+# candados.py
+
+import sys
+import time
+import threading
+
+from histograma import HistogramaLatencias
+
+class LockInstrumentado:
+	"""threading.Lock que mide, por función que lo toma, cuánto se esperó y cuánto se retuvo.
+
+	Se usa igual que un Lock ("with lock:"). El sitio es el nombre de la
+	función que entra al bloque. Los histogramas tienen un candado propio,
+	retenido solo mientras se registra o se copia una medición, para que
+	leerlos (por ejemplo desde el hilo de persistencia) no tenga que esperar
+	a quien retiene el lock instrumentado.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._lock_sitios = threading.Lock()
+		self._sitio = None
+		self._adquirido = 0.0
+		self.sitios = {}  # sitio -> {"espera": HistogramaLatencias, "retencion": HistogramaLatencias}
+
+	def acquire(self, blocking=True, timeout=-1, sitio=None):
+		inicio = time.perf_counter()
+		if not self._lock.acquire(blocking, timeout):
+			return False
+		self._adquirido = time.perf_counter()
+		self._sitio = sitio or sys._getframe(1).f_code.co_name
+		self._registrar(self._sitio, "espera", self._adquirido - inicio)
+		return True
+
+	def release(self):
+		sitio, retencion = self._sitio, time.perf_counter() - self._adquirido
+		self._lock.release()
+		self._registrar(sitio, "retencion", retencion)
+
+	def __enter__(self):
+		self.acquire(sitio=sys._getframe(1).f_code.co_name)
+		return True
+
+	def __exit__(self, tipo, valor, traza):
+		self.release()
+
+	def locked(self):
+		return self._lock.locked()
+
+	def _registrar(self, sitio, clave, segundos):
+		with self._lock_sitios:
+			histogramas = self.sitios.get(sitio)
+			if histogramas is None:
+				histogramas = self.sitios[sitio] = {"espera": HistogramaLatencias(), "retencion": HistogramaLatencias()}
+			histogramas[clave].registrar(segundos)
+
+	def copiar(self):
+		"""Copia de {sitio: {"espera": ..., "retencion": ...}}; no toma el lock instrumentado."""
+		with self._lock_sitios:
+			return {
+				sitio: {clave: histograma.copiar() for clave, histograma in histogramas.items()}
+				for sitio, histogramas in self.sitios.items()
+			}
+
+	def resumen(self):
+		"""Percentiles de espera y retención por sitio, ordenados por tiempo total retenido."""
+		copia = self.copiar()
+		orden = sorted(copia, key=lambda sitio: copia[sitio]["retencion"].suma, reverse=True)
+		return {
+			sitio: {
+				"espera": copia[sitio]["espera"].resumen(),
+				"retencion": copia[sitio]["retencion"].resumen(),
+				"espera_total": copia[sitio]["espera"].suma,
+				"retencion_total": copia[sitio]["retencion"].suma
+			}
+			for sitio in orden
+		}
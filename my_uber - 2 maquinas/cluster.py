@@ -0,0 +1,53 @@
+# cluster.py
+
+import os
+
+# Nodos del clúster: "host" o "host:desplazamiento", separados por comas, en el mismo orden en
+# todos los nodos (el orden define el id de cada uno). Cada nodo usa los puertos de siempre más
+# su desplazamiento, así varios nodos pueden correr en la misma máquina:
+# MY_UBER_CLUSTER="127.0.0.1:0,127.0.0.1:100,127.0.0.1:200"
+VARIABLE_CLUSTER = "MY_UBER_CLUSTER"
+SERVIDORES_POR_DEFECTO = ["10.43.100.133", "10.43.101.2"]
+
+class Nodo:
+	"""Un servidor del clúster: su id (posición en la lista), host y desplazamiento de puertos."""
+
+	__slots__ = ("id", "host", "desplazamiento")
+
+	def __init__(self, id, host, desplazamiento=0):
+		self.id = id
+		self.host = host
+		self.desplazamiento = desplazamiento
+
+	def __repr__(self):
+		return f"nodo {self.id} ({self.host}:+{self.desplazamiento})"
+
+def interpretar_cluster(texto):
+	"""Lista de Nodo a partir de "host[:desplazamiento],host[:desplazamiento],..."."""
+	nodos = []
+	for parte in texto.split(","):
+		parte = parte.strip()
+		if not parte:
+			continue
+		host, _, desplazamiento = parte.partition(":")
+		nodos.append(Nodo(len(nodos), host, int(desplazamiento or 0)))
+	if not nodos:
+		raise ValueError(f"el clúster no tiene nodos: {texto!r}")
+	return nodos
+
+def nodos_configurados(texto=None):
+	"""Nodos de 'texto', de MY_UBER_CLUSTER o, si no hay ninguno, los dos servidores de siempre."""
+	return interpretar_cluster(texto or os.environ.get(VARIABLE_CLUSTER) or ",".join(SERVIDORES_POR_DEFECTO))
+
+def direccion(nodo, puerto):
+	"""Dirección tcp:// del puerto base 'puerto' en 'nodo'."""
+	return f"tcp://{nodo.host}:{puerto + nodo.desplazamiento}"
+
+def quorum(nodos):
+	"""Votos necesarios para ganar una elección: mayoría de los nodos.
+
+	Con dos nodos basta el voto propio, como el par principal/respaldo original:
+	si no, el respaldo no podría asumir cuando el principal cae. Así los dos
+	pueden ganar el mismo término; el de menor id cede al ver los latidos del otro.
+	"""
+	return 1 if len(nodos) <= 2 else len(nodos) // 2 + 1
@@ -0,0 +1,71 @@
+# consulta.py
+
+import sys
+import json
+import random
+
+import zmq
+
+import registro
+import cluster
+
+log = registro.obtener("consulta")
+
+CONSULTA_PORT = 5565  # Consultas de solo lectura, atendidas por todos los nodos
+TIMEOUT_CONSULTA_MS = 2000
+TIPOS = ("taxis_libres", "posiciones", "historial", "metricas")
+
+def consultar(context, nodos, consulta):
+	"""Envía la consulta a los nodos en orden aleatorio y devuelve la primera respuesta al día.
+
+	El orden aleatorio reparte la carga entre los respaldos y el principal; un
+	nodo cuyo estado es más viejo que "max_retraso_ms" responde
+	"desactualizado" y se pasa al siguiente.
+	"""
+	nodos = list(nodos)
+	random.shuffle(nodos)
+	for nodo in nodos:
+		socket = context.socket(zmq.REQ)
+		socket.setsockopt(zmq.RCVTIMEO, TIMEOUT_CONSULTA_MS)
+		socket.setsockopt(zmq.LINGER, 0)
+		try:
+			socket.connect(cluster.direccion(nodo, CONSULTA_PORT))
+			socket.send_json(consulta)
+			respuesta = socket.recv_json()
+			if "error" in respuesta:
+				log.info("El %s no respondió (%s, retraso %s ms).", nodo, respuesta["error"], respuesta["retraso_ms"])
+				continue
+			log.info("Respondió el %s (%s, retraso %.0f ms).", nodo, respuesta["rol"], respuesta["retraso_ms"])
+			return respuesta
+		except zmq.error.Again:
+			log.warning("El %s no respondió a tiempo.", nodo)
+		finally:
+			socket.close()
+	return None
+
+def interpretar_valor(clave, valor):
+	# Los ids de taxi son cadenas en el servidor; el resto de los valores son números
+	if clave == "taxi":
+		return valor
+	try:
+		return int(valor)
+	except ValueError:
+		return valor
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2 or sys.argv[1] not in TIPOS:
+		print("Uso: python consulta.py <taxis_libres|posiciones|historial|metricas> [usuario=<id>] [taxi=<id>] "
+			"[limite=<n>] [max_retraso_ms=<ms>]")
+		sys.exit(1)
+	consulta = {"tipo": sys.argv[1]}
+	for argumento in sys.argv[2:]:
+		clave, _, valor = argumento.partition("=")
+		consulta[clave] = interpretar_valor(clave, valor)
+
+	context = zmq.Context()
+	respuesta = consultar(context, cluster.nodos_configurados(), consulta)
+	context.term()
+	if respuesta is None:
+		log.error("Ningún nodo respondió la consulta con el retraso admitido.")
+		sys.exit(1)
+	print(json.dumps(respuesta["resultado"], indent=4, ensure_ascii=False))
@@ -0,0 +1,443 @@
+# emparejamiento.py
+
+import math
+import heapq
+import sys
+import time
+import random
+
+try:
+	import numpy as np
+except ImportError:  # El motor vectorizado es opcional
+	np = None
+
+# Tamaño (en unidades de la cuadrícula) de cada celda del índice espacial
+TAMANO_CELDA = 5
+
+class MotorEmparejamiento:
+	"""Base común: los motores implementan actualizar, eliminar, reconstruir, mas_cercano y cercanos."""
+
+	def asignar(self, x, y):
+		"""Busca el taxi más cercano y lo retira del motor. Devuelve (id_taxi, distancia)."""
+		taxi_asignado, distancia = self.mas_cercano(x, y)
+		if taxi_asignado is not None:
+			self.eliminar(taxi_asignado)
+		return taxi_asignado, distancia
+
+	def cerrar(self):
+		"""Libera los recursos del motor (los motores en memoria no tienen ninguno)."""
+
+class IndiceEspacial(MotorEmparejamiento):
+	"""Índice de taxis libres agrupados en celdas de la cuadrícula N x M.
+
+	Cada taxi se guarda en la celda (x // tamano_celda, y // tamano_celda). La
+	búsqueda del más cercano recorre anillos de celdas alrededor del usuario y
+	se detiene en cuanto ningún anillo posterior puede contener un taxi más
+	cercano, así que solo se revisan los taxis de la zona.
+	"""
+
+	def __init__(self, tamano_celda=TAMANO_CELDA):
+		if tamano_celda <= 0:
+			raise ValueError("El tamaño de celda debe ser positivo.")
+		self.tamano_celda = tamano_celda
+		self.celdas = {}      # (cx, cy) -> {id_taxi: (x, y)}
+		self.posiciones = {}  # id_taxi -> (x, y)
+		self.celda_de = {}    # id_taxi -> (cx, cy)
+		# Límites de las celdas ocupadas alguna vez (cota para los anillos)
+		self.limites = None
+
+	def __len__(self):
+		return len(self.posiciones)
+
+	def __contains__(self, id_taxi):
+		return id_taxi in self.posiciones
+
+	def _celda(self, x, y):
+		return (int(x // self.tamano_celda), int(y // self.tamano_celda))
+
+	def actualizar(self, id_taxi, posicion):
+		"""Inserta el taxi o lo mueve a su nueva posición."""
+		x, y = posicion[0], posicion[1]
+		celda = self._celda(x, y)
+		celda_anterior = self.celda_de.get(id_taxi)
+		if celda_anterior is not None and celda_anterior != celda:
+			self._quitar_de_celda(id_taxi, celda_anterior)
+		self.celdas.setdefault(celda, {})[id_taxi] = (x, y)
+		self.posiciones[id_taxi] = (x, y)
+		self.celda_de[id_taxi] = celda
+		if self.limites is None:
+			self.limites = [celda[0], celda[1], celda[0], celda[1]]
+		else:
+			self.limites[0] = min(self.limites[0], celda[0])
+			self.limites[1] = min(self.limites[1], celda[1])
+			self.limites[2] = max(self.limites[2], celda[0])
+			self.limites[3] = max(self.limites[3], celda[1])
+
+	def eliminar(self, id_taxi):
+		"""Quita el taxi del índice. No falla si el taxi no estaba."""
+		celda = self.celda_de.pop(id_taxi, None)
+		if celda is None:
+			return
+		del self.posiciones[id_taxi]
+		self._quitar_de_celda(id_taxi, celda)
+
+	def _quitar_de_celda(self, id_taxi, celda):
+		taxis_celda = self.celdas.get(celda)
+		if taxis_celda is None:
+			return
+		taxis_celda.pop(id_taxi, None)
+		if not taxis_celda:
+			del self.celdas[celda]
+
+	def reconstruir(self, taxis):
+		"""Reconstruye el índice completo a partir de un dict ID -> (x, y)."""
+		self.celdas = {}
+		self.posiciones = {}
+		self.celda_de = {}
+		self.limites = None
+		for id_taxi, posicion in taxis.items():
+			self.actualizar(id_taxi, posicion)
+
+	def _celdas_anillo(self, cx, cy, radio):
+		"""Genera las celdas a distancia de Chebyshev exactamente 'radio'."""
+		if radio == 0:
+			yield (cx, cy)
+			return
+		for dx in range(-radio, radio + 1):
+			yield (cx + dx, cy - radio)
+			yield (cx + dx, cy + radio)
+		for dy in range(-radio + 1, radio):
+			yield (cx - radio, cy + dy)
+			yield (cx + radio, cy + dy)
+
+	def mas_cercano(self, x, y):
+		"""Devuelve (id_taxi, distancia) del taxi más cercano o (None, inf)."""
+		if not self.posiciones:
+			return None, float("inf")
+		cx, cy = self._celda(x, y)
+		# Ningún anillo más allá de los límites ocupados puede tener taxis
+		radio_maximo = max(
+			cx - self.limites[0], cy - self.limites[1],
+			self.limites[2] - cx, self.limites[3] - cy, 0
+		)
+		taxi_asignado = None
+		distancia_minima = float("inf")
+		for radio in range(radio_maximo + 1):
+			for celda in self._celdas_anillo(cx, cy, radio):
+				taxis_celda = self.celdas.get(celda)
+				if not taxis_celda:
+					continue
+				for id_taxi, (tx, ty) in taxis_celda.items():
+					distancia = math.sqrt((tx - x)**2 + (ty - y)**2)
+					if distancia < distancia_minima:
+						distancia_minima = distancia
+						taxi_asignado = id_taxi
+			# Cualquier taxi del anillo siguiente está al menos a radio * tamano_celda
+			if distancia_minima <= radio * self.tamano_celda:
+				break
+		return taxi_asignado, distancia_minima
+
+	def cercanos(self, x, y, k):
+		"""Devuelve los k taxis más cercanos como [(id_taxi, distancia)] ordenados."""
+		if not self.posiciones or k <= 0:
+			return []
+		cx, cy = self._celda(x, y)
+		radio_maximo = max(
+			cx - self.limites[0], cy - self.limites[1],
+			self.limites[2] - cx, self.limites[3] - cy, 0
+		)
+		encontrados = []
+		for radio in range(radio_maximo + 1):
+			for celda in self._celdas_anillo(cx, cy, radio):
+				for id_taxi, (tx, ty) in self.celdas.get(celda, {}).items():
+					encontrados.append((math.sqrt((tx - x)**2 + (ty - y)**2), id_taxi))
+			if len(encontrados) >= k:
+				k_esimo = heapq.nsmallest(k, encontrados)[-1][0]
+				if k_esimo <= radio * self.tamano_celda:
+					break
+		return [(id_taxi, distancia) for distancia, id_taxi in heapq.nsmallest(k, encontrados)]
+
+def distancia_euclidiana(x1, y1, x2, y2):
+	return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+
+class BuscadorLineal(MotorEmparejamiento):
+	"""Recorrido lineal de todos los taxis (comportamiento original del servidor)."""
+
+	def __init__(self, funcion_distancia=distancia_euclidiana):
+		self.funcion_distancia = funcion_distancia
+		self.posiciones = {}  # id_taxi -> (x, y)
+
+	def __len__(self):
+		return len(self.posiciones)
+
+	def __contains__(self, id_taxi):
+		return id_taxi in self.posiciones
+
+	def actualizar(self, id_taxi, posicion):
+		self.posiciones[id_taxi] = (posicion[0], posicion[1])
+
+	def eliminar(self, id_taxi):
+		self.posiciones.pop(id_taxi, None)
+
+	def reconstruir(self, taxis):
+		self.posiciones = {}
+		for id_taxi, posicion in taxis.items():
+			self.actualizar(id_taxi, posicion)
+
+	def mas_cercano(self, x, y):
+		taxi_asignado = None
+		distancia_minima = float("inf")
+		for id_taxi, (tx, ty) in self.posiciones.items():
+			distancia = self.funcion_distancia(x, y, tx, ty)
+			if distancia < distancia_minima:
+				distancia_minima = distancia
+				taxi_asignado = id_taxi
+		return taxi_asignado, distancia_minima
+
+	def cercanos(self, x, y, k):
+		distancias = (
+			(self.funcion_distancia(x, y, tx, ty), id_taxi)
+			for id_taxi, (tx, ty) in self.posiciones.items()
+		)
+		return [(id_taxi, distancia) for distancia, id_taxi in heapq.nsmallest(k, distancias)]
+
+class MotorNumpy(MotorEmparejamiento):
+	"""Taxis libres guardados en arreglos contiguos de NumPy (x, y, id por slot).
+
+	Los slots ocupados son siempre [0, n): al eliminar un taxi se mueve el
+	último slot a su lugar, así que las distancias a uno o varios puntos se
+	calculan con una sola operación vectorizada sobre los arreglos.
+	"""
+
+	def __init__(self, capacidad_inicial=1024):
+		if np is None:
+			raise RuntimeError("El motor 'numpy' requiere instalar numpy (pip install numpy).")
+		self.xs = np.empty(capacidad_inicial, dtype=np.float64)
+		self.ys = np.empty(capacidad_inicial, dtype=np.float64)
+		self.ids = [None] * capacidad_inicial  # slot -> id_taxi
+		self.slot_de = {}                       # id_taxi -> slot
+		self.n = 0
+
+	def __len__(self):
+		return self.n
+
+	def __contains__(self, id_taxi):
+		return id_taxi in self.slot_de
+
+	def _crecer(self):
+		capacidad = len(self.ids) * 2
+		xs = np.empty(capacidad, dtype=np.float64)
+		ys = np.empty(capacidad, dtype=np.float64)
+		xs[:self.n] = self.xs[:self.n]
+		ys[:self.n] = self.ys[:self.n]
+		self.xs, self.ys = xs, ys
+		self.ids.extend([None] * (capacidad - len(self.ids)))
+
+	def actualizar(self, id_taxi, posicion):
+		slot = self.slot_de.get(id_taxi)
+		if slot is None:
+			if self.n == len(self.ids):
+				self._crecer()
+			slot = self.n
+			self.n += 1
+			self.slot_de[id_taxi] = slot
+			self.ids[slot] = id_taxi
+		self.xs[slot] = posicion[0]
+		self.ys[slot] = posicion[1]
+
+	def eliminar(self, id_taxi):
+		slot = self.slot_de.pop(id_taxi, None)
+		if slot is None:
+			return
+		ultimo = self.n - 1
+		if slot != ultimo:
+			# Mover el último taxi al hueco para mantener los slots contiguos
+			id_ultimo = self.ids[ultimo]
+			self.xs[slot] = self.xs[ultimo]
+			self.ys[slot] = self.ys[ultimo]
+			self.ids[slot] = id_ultimo
+			self.slot_de[id_ultimo] = slot
+		self.ids[ultimo] = None
+		self.n = ultimo
+
+	def reconstruir(self, taxis):
+		self.slot_de = {}
+		self.n = 0
+		for id_taxi, posicion in taxis.items():
+			self.actualizar(id_taxi, posicion)
+
+	def distancias(self, puntos):
+		"""Matriz (len(puntos), n) de distancias de cada punto a cada taxi libre."""
+		puntos = np.asarray(puntos, dtype=np.float64).reshape(-1, 2)
+		dx = puntos[:, 0:1] - self.xs[:self.n]
+		dy = puntos[:, 1:2] - self.ys[:self.n]
+		return np.sqrt(dx * dx + dy * dy)
+
+	def mas_cercanos(self, puntos):
+		"""Devuelve [(id_taxi, distancia)] del taxi más cercano a cada punto."""
+		if self.n == 0:
+			return [(None, float("inf"))] * len(puntos)
+		matriz = self.distancias(puntos)
+		slots = matriz.argmin(axis=1)
+		minimos = matriz[np.arange(len(slots)), slots]
+		return [(self.ids[slot], float(distancia)) for slot, distancia in zip(slots, minimos)]
+
+	def mas_cercano(self, x, y):
+		if self.n == 0:
+			return None, float("inf")
+		dx = self.xs[:self.n] - x
+		dy = self.ys[:self.n] - y
+		cuadrados = dx * dx + dy * dy
+		slot = int(cuadrados.argmin())
+		return self.ids[slot], math.sqrt(cuadrados[slot])
+
+	def cercanos(self, x, y, k):
+		if self.n == 0 or k <= 0:
+			return []
+		distancias = self.distancias([(x, y)])[0]
+		if k < self.n:
+			slots = np.argpartition(distancias, k - 1)[:k]
+		else:
+			slots = np.arange(self.n)
+		slots = slots[np.argsort(distancias[slots], kind="stable")]
+		return [(self.ids[slot], float(distancias[slot])) for slot in slots]
+
+def asignacion_optima(costos):
+	"""Resuelve la asignación de costo mínimo (método húngaro) de una matriz filas x columnas.
+
+	Devuelve una lista de pares (fila, columna). Si hay más filas que columnas
+	solo se asignan tantas filas como columnas haya.
+	"""
+	filas = len(costos)
+	if filas == 0 or len(costos[0]) == 0:
+		return []
+	columnas = len(costos[0])
+	if filas > columnas:
+		traspuesta = [[costos[i][j] for i in range(filas)] for j in range(columnas)]
+		return [(fila, columna) for columna, fila in asignacion_optima(traspuesta)]
+
+	INF = float("inf")
+	u = [0.0] * (filas + 1)
+	v = [0.0] * (columnas + 1)
+	p = [0] * (columnas + 1)       # columna -> fila asignada (1-indexado, 0 = libre)
+	camino = [0] * (columnas + 1)
+	for i in range(1, filas + 1):
+		p[0] = i
+		j0 = 0
+		minimos = [INF] * (columnas + 1)
+		usado = [False] * (columnas + 1)
+		while True:
+			usado[j0] = True
+			i0 = p[j0]
+			delta = INF
+			j1 = 0
+			fila_costos = costos[i0 - 1]
+			for j in range(1, columnas + 1):
+				if not usado[j]:
+					actual = fila_costos[j - 1] - u[i0] - v[j]
+					if actual < minimos[j]:
+						minimos[j] = actual
+						camino[j] = j0
+					if minimos[j] < delta:
+						delta = minimos[j]
+						j1 = j
+			for j in range(columnas + 1):
+				if usado[j]:
+					u[p[j]] += delta
+					v[j] -= delta
+				else:
+					minimos[j] -= delta
+			j0 = j1
+			if p[j0] == 0:
+				break
+		while True:
+			j1 = camino[j0]
+			p[j0] = p[j1]
+			j0 = j1
+			if j0 == 0:
+				break
+	return [(p[j] - 1, j - 1) for j in range(1, columnas + 1) if p[j] != 0]
+
+def asignar_lote(motor, puntos):
+	"""Asigna taxis a un lote de solicitudes minimizando la distancia total de recogida.
+
+	Solo se consideran como candidatos los len(puntos) taxis más cercanos a cada
+	solicitud: en una asignación óptima ninguna solicitud usa un taxi fuera de esa
+	lista (siempre quedaría uno de sus cercanos libre y más próximo), así que el
+	resultado es el óptimo global con una matriz mucho más pequeña que la flota.
+
+	Devuelve ([(id_taxi o None, distancia)] por punto, distancia total que habría
+	obtenido la asignación voraz en orden de llegada). No modifica el motor.
+	"""
+	k = len(puntos)
+	candidatos_por_punto = [motor.cercanos(x, y, k) for x, y in puntos]
+	ids_candidatos = []
+	columna_de = {}
+	for candidatos in candidatos_por_punto:
+		for id_taxi, _ in candidatos:
+			if id_taxi not in columna_de:
+				columna_de[id_taxi] = len(ids_candidatos)
+				ids_candidatos.append(id_taxi)
+
+	resultado = [(None, float("inf"))] * k
+	if not ids_candidatos:
+		return resultado, 0.0
+
+	# Los pares fuera de la lista de candidatos quedan con un costo prohibitivo
+	costo_prohibitivo = 1e12
+	costos = [[costo_prohibitivo] * len(ids_candidatos) for _ in range(k)]
+	for fila, candidatos in enumerate(candidatos_por_punto):
+		for id_taxi, distancia in candidatos:
+			costos[fila][columna_de[id_taxi]] = distancia
+	for fila, columna in asignacion_optima(costos):
+		if costos[fila][columna] < costo_prohibitivo:
+			resultado[fila] = (ids_candidatos[columna], costos[fila][columna])
+
+	# Referencia voraz: cada solicitud, en orden, toma su candidato libre más cercano
+	distancia_voraz = 0.0
+	tomados = set()
+	for candidatos in candidatos_por_punto:
+		for id_taxi, distancia in candidatos:
+			if id_taxi not in tomados:
+				tomados.add(id_taxi)
+				distancia_voraz += distancia
+				break
+	return resultado, distancia_voraz
+
+# Motores de emparejamiento seleccionables en servidor_central.py
+MOTORES = {
+	"lineal": BuscadorLineal,
+	"indice": IndiceEspacial,
+	"numpy": MotorNumpy,
+}
+
+def crear_motor(nombre, **opciones):
+	"""Crea el motor de emparejamiento indicado por nombre."""
+	if nombre not in MOTORES:
+		raise ValueError(f"Motor de emparejamiento desconocido: {nombre}. Opciones: {', '.join(MOTORES)}")
+	return MOTORES[nombre](**opciones)
+
+def comparar_motores(numero_taxis, consultas, N=100, M=100):
+	"""Mide el tiempo medio de mas_cercano de cada motor sobre la misma flota."""
+	taxis = {f"taxi_{i}": (random.randint(0, N), random.randint(0, M)) for i in range(numero_taxis)}
+	puntos = [(random.randint(0, N), random.randint(0, M)) for _ in range(consultas)]
+	resultados = {}
+	for nombre in MOTORES:
+		try:
+			motor = crear_motor(nombre)
+		except RuntimeError as e:
+			print(f"Motor {nombre} omitido: {e}")
+			continue
+		motor.reconstruir(taxis)
+		inicio = time.perf_counter()
+		for x, y in puntos:
+			motor.mas_cercano(x, y)
+		resultados[nombre] = (time.perf_counter() - inicio) / consultas
+		print(f"Motor {nombre}: {resultados[nombre] * 1e6:.1f} µs por búsqueda ({numero_taxis} taxis)")
+	return resultados
+
+if __name__ == "__main__":
+	if len(sys.argv) != 3:
+		print("Uso: python emparejamiento.py <numero_taxis> <consultas>")
+		sys.exit(1)
+	comparar_motores(int(sys.argv[1]), int(sys.argv[2]))
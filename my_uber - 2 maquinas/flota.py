@@ -0,0 +1,51 @@
+# flota.py
+
+import threading
+
+class UtilizacionFlota:
+	"""Tiempo ocupado y libre de cada taxi, según lo último que informó con su posición.
+
+	Los taxis envían contadores acumulados, así que basta guardar el último de
+	cada uno; los totales de la flota se mantienen al día restando el valor
+	anterior. Tiene su propio candado para que el hilo de persistencia pueda
+	leerla sin tomar el lock global del servidor.
+	"""
+
+	def __init__(self):
+		self.por_taxi = {}  # id_taxi -> (tiempo_ocupado, tiempo_libre)
+		self.ocupado_total = 0.0
+		self.libre_total = 0.0
+		self.lock = threading.Lock()
+
+	def actualizar(self, id_taxi, tiempo_ocupado, tiempo_libre):
+		with self.lock:
+			anterior_ocupado, anterior_libre = self.por_taxi.get(id_taxi, (0.0, 0.0))
+			self.por_taxi[id_taxi] = (tiempo_ocupado, tiempo_libre)
+			self.ocupado_total += tiempo_ocupado - anterior_ocupado
+			self.libre_total += tiempo_libre - anterior_libre
+
+	def totales(self):
+		with self.lock:
+			return len(self.por_taxi), self.ocupado_total, self.libre_total
+
+	def resumen(self):
+		"""Totales, utilización media y distribución por deciles de la utilización de cada taxi."""
+		with self.lock:
+			tiempos = list(self.por_taxi.values())
+			ocupado_total, libre_total = self.ocupado_total, self.libre_total
+		utilizaciones = [ocupado / (ocupado + libre) for ocupado, libre in tiempos if ocupado + libre > 0]
+		distribucion = {f"{decil * 10}-{decil * 10 + 10}%": 0 for decil in range(10)}
+		for utilizacion in utilizaciones:
+			decil = min(int(utilizacion * 10), 9)
+			distribucion[f"{decil * 10}-{decil * 10 + 10}%"] += 1
+		return {
+			"taxis_reportando": len(tiempos),
+			"tiempo_ocupado_total": ocupado_total,
+			"tiempo_libre_total": libre_total,
+			# Ponderada por tiempo: fracción del tiempo de toda la flota que estuvo ocupada
+			"utilizacion_flota": ocupado_total / (ocupado_total + libre_total) if ocupado_total + libre_total > 0 else 0,
+			"utilizacion_media_por_taxi": sum(utilizaciones) / len(utilizaciones) if utilizaciones else 0,
+			"utilizacion_min": min(utilizaciones) if utilizaciones else 0,
+			"utilizacion_max": max(utilizaciones) if utilizaciones else 0,
+			"distribucion": distribucion
+		}
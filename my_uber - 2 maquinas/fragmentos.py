@@ -0,0 +1,317 @@
+# fragmentos.py
+
+import math
+import sys
+import itertools
+import time
+import signal
+import random
+import threading
+import multiprocessing
+
+from emparejamiento import MotorEmparejamiento, crear_motor
+
+def dividir_regiones(cantidad):
+	"""Factoriza 'cantidad' en (filas, columnas) lo más cuadrado posible."""
+	for filas in range(int(math.sqrt(cantidad)), 0, -1):
+		if cantidad % filas == 0:
+			return filas, cantidad // filas
+	return 1, cantidad
+
+def trabajador_fragmento(conexion, nombre_motor):
+	"""Proceso dueño de una región: mantiene su propio motor con los taxis libres de la región."""
+	signal.signal(signal.SIGINT, signal.SIG_IGN)  # El proceso principal se encarga del Ctrl+C
+	motor = crear_motor(nombre_motor)
+	versiones = {}  # id_taxi -> número de la actualización que registró su posición
+	while True:
+		try:
+			comando = conexion.recv()
+		except EOFError:
+			break
+		tipo = comando[0]
+		if tipo == "posicion":
+			motor.actualizar(comando[1], comando[2])
+			versiones[comando[1]] = comando[3]
+		elif tipo == "eliminar":
+			motor.eliminar(comando[1])
+			versiones.pop(comando[1], None)
+		elif tipo == "reconstruir":
+			motor.reconstruir(comando[1])
+			versiones = comando[2]
+		elif tipo == "consultar":
+			conexion.send(motor.mas_cercano(comando[1], comando[2]))
+		elif tipo == "cercanos":
+			conexion.send(motor.cercanos(comando[1], comando[2], comando[3]))
+		elif tipo == "asignar":
+			# Retira el más cercano de la región solo si está a no más de comando[3], la
+			# distancia a la región vecina más próxima: así seguro es el más cercano de todos
+			id_taxi, distancia = motor.mas_cercano(comando[1], comando[2])
+			if id_taxi is not None and distancia <= comando[3]:
+				motor.eliminar(id_taxi)
+				conexion.send((id_taxi, distancia, versiones.pop(id_taxi, None)))
+			else:
+				conexion.send((id_taxi, distancia, None))
+		elif tipo == "reclamar":
+			# Retira el taxi solo si sigue libre en esta región; None si ya no estaba
+			motor.eliminar(comando[1])
+			conexion.send(versiones.pop(comando[1], None))
+		elif tipo == "contar":
+			conexion.send(len(motor))
+		elif tipo == "salir":
+			break
+	conexion.close()
+
+class DespachadorFragmentado(MotorEmparejamiento):
+	"""Reparte la cuadrícula N x M en regiones, cada una atendida por un proceso propio.
+
+	Las posiciones se envían solo al proceso dueño de la región del taxi. Una
+	búsqueda consulta primero la región del usuario y luego las vecinas en orden
+	de cercanía, deteniéndose cuando ninguna región restante puede tener un taxi
+	más cercano. Cada región tiene su propio candado, así que varios hilos del
+	servidor pueden buscar y reclamar taxis en regiones distintas al mismo
+	tiempo, sin el lock global del servidor.
+
+	Cada ubicación guarda, junto con la región, el número de la actualización
+	que la registró, y la región devuelve ese número al reclamar: la ubicación
+	solo se borra si ninguna posición llegó en paralelo, para no perder de
+	vista un taxi que volvió a la región.
+
+	Cada consulta a una región es una ida y vuelta por un Pipe (unos 50-100 µs),
+	más que una búsqueda completa en el índice espacial. En el caso común
+	asignar hace una sola: la región del usuario reclama su taxi más cercano si
+	ninguna otra puede tener uno más próximo. Aun así, con el motor "indice" un
+	solo motor bajo el lock global es más rápido; los fragmentos convienen con
+	motores cuyo costo crece con la flota, como "lineal" (ver medir_throughput).
+	"""
+
+	def __init__(self, cantidad, N, M, nombre_motor="indice"):
+		if cantidad < 1:
+			raise ValueError("Se necesita al menos un fragmento.")
+		self.N = N
+		self.M = M
+		self.filas, self.columnas = dividir_regiones(cantidad)
+		self.conexiones = []
+		self.procesos = []
+		self.candados = []
+		for indice in range(cantidad):
+			extremo_local, extremo_remoto = multiprocessing.Pipe()
+			proceso = multiprocessing.Process(
+				target=trabajador_fragmento,
+				args=(extremo_remoto, nombre_motor),
+				name=f"fragmento_{indice}",
+				daemon=True
+			)
+			proceso.start()
+			extremo_remoto.close()
+			self.conexiones.append(extremo_local)
+			self.procesos.append(proceso)
+			self.candados.append(threading.Lock())
+		self.fragmento_de = {}  # id_taxi -> (región donde está registrado, número de actualización)
+		self.actualizaciones = itertools.count()
+		self.lock_ubicaciones = threading.Lock()
+
+	def __len__(self):
+		return len(self.fragmento_de)
+
+	def __contains__(self, id_taxi):
+		return id_taxi in self.fragmento_de
+
+	def region(self, x, y):
+		"""Índice de la región que contiene (x, y). Las coordenadas fuera de la cuadrícula van al borde."""
+		columna = min(max(int(x * self.columnas / (self.N + 1)), 0), self.columnas - 1)
+		fila = min(max(int(y * self.filas / (self.M + 1)), 0), self.filas - 1)
+		return fila * self.columnas + columna
+
+	def distancia_a_region(self, indice, x, y):
+		"""Cota inferior de la distancia de (x, y) a cualquier taxi de la región."""
+		fila, columna = divmod(indice, self.columnas)
+		ancho = (self.N + 1) / self.columnas
+		alto = (self.M + 1) / self.filas
+		# Las regiones del borde se extienden hasta el infinito
+		x0 = columna * ancho if columna > 0 else -math.inf
+		x1 = (columna + 1) * ancho if columna < self.columnas - 1 else math.inf
+		y0 = fila * alto if fila > 0 else -math.inf
+		y1 = (fila + 1) * alto if fila < self.filas - 1 else math.inf
+		dx = max(x0 - x, 0, x - x1)
+		dy = max(y0 - y, 0, y - y1)
+		return math.sqrt(dx * dx + dy * dy)
+
+	def _regiones_por_cercania(self, x, y):
+		regiones = [(self.distancia_a_region(indice, x, y), indice) for indice in range(len(self.conexiones))]
+		regiones.sort()
+		return regiones
+
+	def _enviar(self, indice, comando):
+		with self.candados[indice]:
+			self.conexiones[indice].send(comando)
+
+	def _consultar(self, indice, comando):
+		with self.candados[indice]:
+			self.conexiones[indice].send(comando)
+			return self.conexiones[indice].recv()
+
+	def actualizar(self, id_taxi, posicion):
+		nueva = self.region(posicion[0], posicion[1])
+		with self.lock_ubicaciones:
+			anterior = self.fragmento_de.get(id_taxi)
+			if anterior is not None and anterior[0] != nueva:
+				self._enviar(anterior[0], ("eliminar", id_taxi))
+			version = next(self.actualizaciones)
+			self.fragmento_de[id_taxi] = (nueva, version)
+			self._enviar(nueva, ("posicion", id_taxi, (posicion[0], posicion[1]), version))
+
+	def eliminar(self, id_taxi):
+		with self.lock_ubicaciones:
+			ubicacion = self.fragmento_de.pop(id_taxi, None)
+			if ubicacion is not None:
+				self._enviar(ubicacion[0], ("eliminar", id_taxi))
+
+	def reconstruir(self, taxis):
+		por_region = [{} for _ in self.conexiones]
+		versiones_por_region = [{} for _ in self.conexiones]
+		with self.lock_ubicaciones:
+			self.fragmento_de = {}
+			for id_taxi, posicion in taxis.items():
+				indice = self.region(posicion[0], posicion[1])
+				version = next(self.actualizaciones)
+				por_region[indice][id_taxi] = (posicion[0], posicion[1])
+				versiones_por_region[indice][id_taxi] = version
+				self.fragmento_de[id_taxi] = (indice, version)
+			for indice, taxis_region in enumerate(por_region):
+				self._enviar(indice, ("reconstruir", taxis_region, versiones_por_region[indice]))
+
+	def _buscar(self, x, y, conocido=(None, math.inf, None)):
+		"""Devuelve (id_taxi, distancia, región) del taxi libre más cercano.
+
+		'conocido' es el resultado ya consultado de una región, que no se vuelve a consultar.
+		"""
+		mejor = conocido
+		for distancia_region, indice in self._regiones_por_cercania(x, y):
+			if distancia_region >= mejor[1]:
+				break  # Ninguna región restante puede mejorar el resultado
+			if indice == conocido[2]:
+				continue
+			id_taxi, distancia = self._consultar(indice, ("consultar", x, y))
+			if id_taxi is not None and distancia < mejor[1]:
+				mejor = (id_taxi, distancia, indice)
+		return mejor
+
+	def mas_cercano(self, x, y):
+		id_taxi, distancia, _ = self._buscar(x, y)
+		return id_taxi, distancia
+
+	def asignar(self, x, y):
+		while True:
+			regiones = self._regiones_por_cercania(x, y)
+			propia = regiones[0][1]
+			cota = regiones[1][0] if len(regiones) > 1 else math.inf
+			id_taxi, distancia, version = self._consultar(propia, ("asignar", x, y, cota))
+			if version is None:
+				# Puede haber uno más cercano en otra región: búsqueda completa y reclamo aparte
+				id_taxi, distancia, indice = self._buscar(x, y, (id_taxi, distancia, propia))
+				if id_taxi is None:
+					return None, math.inf
+				version = self._consultar(indice, ("reclamar", id_taxi))
+				if version is None:
+					continue  # Otro hilo lo asignó o el taxi cambió de región: buscar de nuevo
+			with self.lock_ubicaciones:
+				# Si llegó otra posición del taxi mientras se reclamaba, su ubicación es la nueva
+				ubicacion = self.fragmento_de.get(id_taxi)
+				if ubicacion is not None and ubicacion[1] == version:
+					del self.fragmento_de[id_taxi]
+			return id_taxi, distancia
+
+	def cercanos(self, x, y, k):
+		encontrados = []
+		for distancia_region, indice in self._regiones_por_cercania(x, y):
+			if len(encontrados) >= k and encontrados[k - 1][1] <= distancia_region:
+				break
+			encontrados.extend(self._consultar(indice, ("cercanos", x, y, k)))
+			encontrados.sort(key=lambda candidato: candidato[1])
+		return encontrados[:k]
+
+	def taxis_por_fragmento(self):
+		return [self._consultar(indice, ("contar",)) for indice in range(len(self.conexiones))]
+
+	def cerrar(self):
+		for indice in range(len(self.conexiones)):
+			try:
+				self._enviar(indice, ("salir",))
+			except (BrokenPipeError, OSError):
+				pass
+		for proceso in self.procesos:
+			proceso.join(timeout=2)
+
+def medir_referencia(numero_taxis, solicitudes, hilos, nombre_motor, N=100, M=100):
+	"""Solicitudes por segundo con un solo motor, sin fragmentos, protegido por un lock global."""
+	motor = crear_motor(nombre_motor)
+	motor.reconstruir({f"taxi_{i}": (random.randint(0, N), random.randint(0, M)) for i in range(numero_taxis)})
+	lock_global = threading.Lock()
+
+	def cliente(repeticiones):
+		for _ in range(repeticiones):
+			with lock_global:
+				id_taxi, _ = motor.asignar(random.randint(0, N), random.randint(0, M))
+				if id_taxi is not None:
+					motor.actualizar(id_taxi, (random.randint(0, N), random.randint(0, M)))
+
+	clientes = [threading.Thread(target=cliente, args=(solicitudes // hilos,)) for _ in range(hilos)]
+	inicio = time.perf_counter()
+	for hilo in clientes:
+		hilo.start()
+	for hilo in clientes:
+		hilo.join()
+	return (solicitudes // hilos) * hilos / (time.perf_counter() - inicio)
+
+def medir_throughput(cantidad, numero_taxis, solicitudes, hilos, nombre_motor, N=100, M=100):
+	"""Solicitudes por segundo que atiende el despachador con 'cantidad' fragmentos y 'hilos' clientes.
+
+	Cada cliente sigue la ruta del servidor: busca y reclama el taxi en los
+	fragmentos sin el lock global y solo lo toma para retirar el taxi de la
+	flota registrada; la posición con la que el taxi vuelve a quedar libre se
+	envía a su región antes de tomarlo, como en recibir_posiciones.
+	"""
+	despachador = DespachadorFragmentado(cantidad, N, M, nombre_motor)
+	taxis = {f"taxi_{i}": (random.randint(0, N), random.randint(0, M)) for i in range(numero_taxis)}
+	despachador.reconstruir(taxis)
+	despachador.taxis_por_fragmento()  # Espera a que todos los fragmentos terminen de cargar
+	lock_global = threading.Lock()
+
+	def cliente(repeticiones):
+		for _ in range(repeticiones):
+			id_taxi, _ = despachador.asignar(random.randint(0, N), random.randint(0, M))
+			if id_taxi is not None:
+				with lock_global:
+					taxis.pop(id_taxi, None)
+				# El taxi vuelve a quedar libre para mantener constante el tamaño de la flota
+				posicion = (random.randint(0, N), random.randint(0, M))
+				despachador.actualizar(id_taxi, posicion)
+				with lock_global:
+					taxis[id_taxi] = posicion
+
+	clientes = [threading.Thread(target=cliente, args=(solicitudes // hilos,)) for _ in range(hilos)]
+	inicio = time.perf_counter()
+	for hilo in clientes:
+		hilo.start()
+	for hilo in clientes:
+		hilo.join()
+	duracion = time.perf_counter() - inicio
+	despachador.cerrar()
+	return (solicitudes // hilos) * hilos / duracion
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (4, 5):
+		print("Uso: python fragmentos.py <max_fragmentos> <numero_taxis> <solicitudes> [motor]")
+		sys.exit(1)
+	max_fragmentos = int(sys.argv[1])
+	numero_taxis = int(sys.argv[2])
+	solicitudes = int(sys.argv[3])
+	# El mismo motor que usa el servidor por defecto; con "lineal" los fragmentos sí escalan
+	nombre_motor = sys.argv[4] if len(sys.argv) == 5 else "indice"
+	throughput = medir_referencia(numero_taxis, solicitudes, hilos=2, nombre_motor=nombre_motor)
+	print(f"Sin fragmentos: {throughput:.0f} solicitudes/s ({numero_taxis} taxis, motor {nombre_motor})")
+	cantidad = 1
+	while cantidad <= max_fragmentos:
+		throughput = medir_throughput(cantidad, numero_taxis, solicitudes, hilos=cantidad * 2, nombre_motor=nombre_motor)
+		print(f"{cantidad} fragmento(s): {throughput:.0f} solicitudes/s ({numero_taxis} taxis, motor {nombre_motor})")
+		cantidad *= 2
@@ -0,0 +1,152 @@
+# histograma.py
+
+import math
+
+class HistogramaLatencias:
+	"""Histograma de latencias con cubetas logarítmicas (estilo HDR) y memoria fija.
+
+	Cada cubeta cubre un rango de valores cuyo ancho es 'precision' veces su
+	límite inferior, así que cualquier percentil se obtiene con ese error
+	relativo como máximo. El número de cubetas depende solo de
+	[minimo, maximo] y de la precisión, no de cuántos valores se registren.
+	"""
+
+	def __init__(self, minimo=1e-6, maximo=3600.0, precision=0.01):
+		if minimo <= 0 or maximo <= minimo or precision <= 0:
+			raise ValueError("Parámetros de histograma inválidos.")
+		self.minimo = minimo
+		self.maximo = maximo
+		self.precision = precision
+		self._log_base = math.log1p(precision)
+		self.ultima_cubeta = self._cubeta(maximo)
+		self.cubetas = {}  # índice -> cantidad (solo las cubetas con valores)
+		self.conteo = 0
+		self.suma = 0.0
+		self.valor_min = None
+		self.valor_max = None
+
+	def _cubeta(self, valor):
+		if valor <= self.minimo:
+			return 0
+		return int(math.log(valor / self.minimo) / self._log_base) + 1
+
+	def _valor_cubeta(self, indice):
+		"""Valor representativo (punto medio geométrico) de la cubeta."""
+		if indice == 0:
+			return self.minimo
+		return self.minimo * math.exp((indice - 0.5) * self._log_base)
+
+	def registrar(self, valor):
+		indice = min(self._cubeta(valor), self.ultima_cubeta)
+		self.cubetas[indice] = self.cubetas.get(indice, 0) + 1
+		self.conteo += 1
+		self.suma += valor
+		if self.valor_min is None or valor < self.valor_min:
+			self.valor_min = valor
+		if self.valor_max is None or valor > self.valor_max:
+			self.valor_max = valor
+
+	def compatible(self, otro):
+		return (self.minimo, self.maximo, self.precision) == (otro.minimo, otro.maximo, otro.precision)
+
+	def fusionar(self, otro):
+		"""Suma al histograma los valores de otro (p. ej. de otro proceso) con los mismos parámetros."""
+		if not self.compatible(otro):
+			raise ValueError("Solo se pueden fusionar histogramas con el mismo mínimo, máximo y precisión.")
+		for indice, cantidad in otro.cubetas.items():
+			self.cubetas[indice] = self.cubetas.get(indice, 0) + cantidad
+		self.conteo += otro.conteo
+		self.suma += otro.suma
+		if otro.valor_min is not None and (self.valor_min is None or otro.valor_min < self.valor_min):
+			self.valor_min = otro.valor_min
+		if otro.valor_max is not None and (self.valor_max is None or otro.valor_max > self.valor_max):
+			self.valor_max = otro.valor_max
+		return self
+
+	def copiar(self):
+		return type(self)(self.minimo, self.maximo, self.precision).fusionar(self)
+
+	def media(self):
+		return self.suma / self.conteo if self.conteo else 0
+
+	def percentiles(self, lista):
+		"""Valores por debajo de los cuales está cada p% de los registros (p entre 0 y 100), en una sola pasada."""
+		if not self.conteo:
+			return [0 for _ in lista]
+		objetivos = sorted((max(1, math.ceil(p / 100 * self.conteo)), posicion) for posicion, p in enumerate(lista))
+		valores = [self.valor_max] * len(lista)
+		acumulado = 0
+		siguiente = 0
+		for indice in sorted(self.cubetas):
+			acumulado += self.cubetas[indice]
+			while siguiente < len(objetivos) and acumulado >= objetivos[siguiente][0]:
+				valor = min(max(self._valor_cubeta(indice), self.valor_min), self.valor_max)
+				valores[objetivos[siguiente][1]] = valor
+				siguiente += 1
+			if siguiente == len(objetivos):
+				break
+		return valores
+
+	def acumulados(self, limites):
+		"""Cantidad de registros menores o iguales a cada límite (ordenados de menor a mayor)."""
+		indices = [self._cubeta(limite) for limite in limites]
+		cuentas = [0] * len(limites)
+		for indice, cantidad in self.cubetas.items():
+			for posicion, indice_limite in enumerate(indices):
+				if indice <= indice_limite:
+					cuentas[posicion] += cantidad
+		return cuentas
+
+	def percentil(self, p):
+		return self.percentiles([p])[0]
+
+	def resumen(self):
+		p50, p90, p99, p999 = self.percentiles([50, 90, 99, 99.9])
+		return {
+			"conteo": self.conteo,
+			"media": self.media(),
+			"min": self.valor_min or 0,
+			"max": self.valor_max or 0,
+			"p50": p50,
+			"p90": p90,
+			"p99": p99,
+			"p999": p999
+		}
+
+	def __repr__(self):
+		resumen = self.resumen()
+		return f"HistogramaLatencias(conteo={resumen['conteo']}, p50={resumen['p50']:.4f}s, p99={resumen['p99']:.4f}s, max={resumen['max']:.4f}s)"
+
+	def a_dict(self):
+		"""Forma compacta para JSON: solo las cubetas con valores."""
+		return {
+			"minimo": self.minimo,
+			"maximo": self.maximo,
+			"precision": self.precision,
+			"conteo": self.conteo,
+			"suma": self.suma,
+			"min": self.valor_min,
+			"max": self.valor_max,
+			"cubetas": {str(indice): cantidad for indice, cantidad in sorted(self.cubetas.items())},
+			"resumen": self.resumen()
+		}
+
+	@classmethod
+	def desde_dict(cls, datos):
+		histograma = cls(datos["minimo"], datos["maximo"], datos["precision"])
+		histograma.cubetas = {int(indice): cantidad for indice, cantidad in datos["cubetas"].items()}
+		histograma.conteo = datos["conteo"]
+		histograma.suma = datos["suma"]
+		histograma.valor_min = datos["min"]
+		histograma.valor_max = datos["max"]
+		return histograma
+
+	@classmethod
+	def cargar(cls, datos):
+		"""Reconstruye el histograma desde a_dict() o desde una lista de tiempos del formato anterior."""
+		if isinstance(datos, dict):
+			return cls.desde_dict(datos)
+		histograma = cls()
+		for valor in datos or []:
+			histograma.registrar(valor)
+		return histograma
@@ -0,0 +1,99 @@
+# metricas_http.py
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import registro
+
+log = registro.obtener("metricas_http")
+
+# Límites (en segundos) de las cubetas que se publican para los histogramas de latencia
+LIMITES_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _etiquetas(etiquetas):
+	if not etiquetas:
+		return ""
+	pares = ",".join(f'{clave}="{valor}"' for clave, valor in etiquetas.items())
+	return "{" + pares + "}"
+
+def _numero(valor):
+	if valor == float("inf"):
+		return "+Inf"
+	return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def formatear(familias):
+	"""Texto en formato de exposición de Prometheus.
+
+	'familias' es una lista de (nombre, tipo, ayuda, muestras) y cada muestra
+	es (sufijo, etiquetas, valor): ("_total", {"resultado": "exitoso"}, 10).
+	"""
+	lineas = []
+	for nombre, tipo, ayuda, muestras in familias:
+		lineas.append(f"# HELP {nombre} {ayuda}")
+		lineas.append(f"# TYPE {nombre} {tipo}")
+		for sufijo, etiquetas, valor in muestras:
+			lineas.append(f"{nombre}{sufijo}{_etiquetas(etiquetas)} {_numero(valor)}")
+	return "\n".join(lineas) + "\n"
+
+def muestras_histograma(histograma, limites=LIMITES_LATENCIA, etiquetas=None):
+	"""Muestras _bucket/_sum/_count de un HistogramaLatencias."""
+	etiquetas = etiquetas or {}
+	muestras = []
+	for limite, cuenta in zip(limites, histograma.acumulados(limites)):
+		muestras.append(("_bucket", dict(etiquetas, le=_numero(limite)), cuenta))
+	muestras.append(("_bucket", dict(etiquetas, le="+Inf"), histograma.conteo))
+	muestras.append(("_sum", etiquetas, histograma.suma))
+	muestras.append(("_count", etiquetas, histograma.conteo))
+	return muestras
+
+class ServidorMetricas:
+	"""Servidor HTTP mínimo que responde GET /metrics con lo que devuelva 'recolectar'.
+
+	Corre en un hilo propio y solo escucha en localhost; 'recolectar' se llama
+	en cada consulta, así que el costo lo paga quien consulta, no el servidor.
+	"""
+
+	def __init__(self, puerto, recolectar, direccion="127.0.0.1"):
+		self.puerto = puerto
+		self.direccion = direccion
+		self.recolectar = recolectar
+		self.servidor = None
+		self.hilo = None
+
+	def _manejador(self):
+		recolectar = self.recolectar
+
+		class Manejador(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split("?")[0] not in ("/", "/metrics"):
+					self.send_error(404)
+					return
+				try:
+					cuerpo = formatear(recolectar()).encode("utf-8")
+				except Exception as e:
+					log.error("Error al recolectar métricas: %s", e)
+					self.send_error(500)
+					return
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+				self.send_header("Content-Length", str(len(cuerpo)))
+				self.end_headers()
+				self.wfile.write(cuerpo)
+
+			def log_message(self, formato, *args):
+				log.debug("%s - " + formato, self.address_string(), *args)
+
+		return Manejador
+
+	def iniciar(self):
+		self.servidor = ThreadingHTTPServer((self.direccion, self.puerto), self._manejador())
+		self.servidor.daemon_threads = True
+		self.hilo = threading.Thread(target=self.servidor.serve_forever, name="metricas_http", daemon=True)
+		self.hilo.start()
+		log.info("Métricas disponibles en http://%s:%s/metrics", self.direccion, self.puerto)
+
+	def detener(self):
+		if self.servidor is not None:
+			self.servidor.shutdown()
+			self.servidor.server_close()
+			self.servidor = None
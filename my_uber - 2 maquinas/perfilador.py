@@ -0,0 +1,88 @@
+# perfilador.py
+
+import os
+import sys
+import time
+import signal
+import threading
+from collections import Counter
+
+import registro
+
+log = registro.obtener("perfilador")
+
+class PerfiladorMuestreo:
+	"""Perfilador por muestreo de las pilas de todos los hilos del proceso.
+
+	Mientras está activo, un hilo propio lee sys._current_frames() cada
+	'intervalo' segundos y cuenta cada pila. Al terminar escribe las pilas en
+	formato colapsado ("hilo;archivo:funcion;... cuenta"), listo para
+	flamegraph.pl o speedscope. Cuando no está activo no hay ningún hilo ni
+	gancho instalado, así que no cuesta nada.
+	"""
+
+	def __init__(self, intervalo=0.005, directorio="."):
+		self.intervalo = intervalo
+		self.directorio = directorio
+		self.hilo = None
+		self.lock = threading.Lock()
+
+	def activo(self):
+		return self.hilo is not None and self.hilo.is_alive()
+
+	def iniciar(self, duracion):
+		"""Empieza a muestrear durante 'duracion' segundos. Devuelve False si ya había un perfil en curso."""
+		with self.lock:
+			if self.activo():
+				return False
+			self.hilo = threading.Thread(target=self._muestrear, args=(duracion,), name="perfilador", daemon=True)
+			self.hilo.start()
+			return True
+
+	def _muestrear(self, duracion):
+		log.info("Perfilando todos los hilos durante %s segundos (una muestra cada %s s)...", duracion, self.intervalo)
+		propio = threading.get_ident()
+		pilas = Counter()
+		muestras = 0
+		fin = time.time() + duracion
+		while time.time() < fin:
+			nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+			for ident, marco in sys._current_frames().items():
+				if ident == propio:
+					continue
+				pilas[self._colapsar(nombres.get(ident, str(ident)), marco)] += 1
+			muestras += 1
+			time.sleep(self.intervalo)
+		ruta = os.path.join(self.directorio, f"perfil_{time.strftime('%Y%m%d_%H%M%S')}.folded")
+		try:
+			with open(ruta, "w") as archivo:
+				for pila, cuenta in pilas.most_common():
+					archivo.write(f"{pila} {cuenta}\n")
+			log.info("Perfil guardado en %s (%s muestras, %s pilas distintas).", ruta, muestras, len(pilas))
+		except IOError as e:
+			log.error("Error al guardar el perfil en %s: %s", ruta, e)
+
+	@staticmethod
+	def _colapsar(nombre_hilo, marco):
+		funciones = []
+		while marco is not None:
+			codigo = marco.f_code
+			funciones.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+			marco = marco.f_back
+		funciones.append(nombre_hilo.replace(" ", "_"))
+		return ";".join(reversed(funciones))
+
+def instalar_senal(perfilador, duracion, senal=None):
+	"""Inicia 'perfilador' por 'duracion' segundos cada vez que el proceso recibe la señal (SIGUSR1 por defecto)."""
+	senal = senal if senal is not None else getattr(signal, "SIGUSR1", None)
+	if senal is None:
+		log.warning("Esta plataforma no tiene SIGUSR1; el perfilador por señal no está disponible.")
+		return False
+
+	def manejador(numero, marco):
+		if not perfilador.iniciar(duracion):
+			log.warning("Ya hay un perfil en curso; se ignora la señal.")
+
+	signal.signal(senal, manejador)
+	log.info("Perfilador listo: kill -%s %s perfila %s segundos.", signal.Signals(senal).name, os.getpid(), duracion)
+	return True
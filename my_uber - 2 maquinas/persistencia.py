@@ -0,0 +1,336 @@
+# persistencia.py
+
+import os
+import re
+import json
+import time
+import queue
+import threading
+
+import registro
+
+log = registro.obtener("persistencia")
+
+# Modos de durabilidad:
+#   "diferida": la solicitud responde en cuanto encola; el hilo escribe cada 'intervalo' segundos.
+#   "estricta": el hilo escribe y hace fsync de inmediato y quien encola puede esperar a que termine.
+DURABILIDADES = ("diferida", "estricta")
+
+def escribir_json(ruta, datos, sincronizar=False):
+	"""Escribe 'datos' en un archivo temporal y lo reemplaza atómicamente sobre 'ruta'."""
+	temporal = f"{ruta}.tmp"
+	with open(temporal, "w") as archivo:
+		json.dump(datos, archivo, indent=4)
+		if sincronizar:
+			archivo.flush()
+			os.fsync(archivo.fileno())
+	os.replace(temporal, ruta)
+
+class HiloPersistencia:
+	"""Etapa de persistencia alimentada por una cola acotada.
+
+	Los hilos del servidor encolan (tipo, datos) y siguen de inmediato. El hilo
+	de persistencia agrupa todo lo encolado durante un volcado y llama a cada
+	escritor una sola vez con la lista de datos de su tipo, en orden de llegada,
+	así que el escritor decide si escribe solo el último (estado, métricas) o
+	todos (registros de historial).
+	"""
+
+	def __init__(self, escritores, intervalo=1.0, durabilidad="diferida", capacidad=10000, espera_maxima=2.0):
+		if durabilidad not in DURABILIDADES:
+			raise ValueError(f"Durabilidad desconocida: {durabilidad}. Opciones: {', '.join(DURABILIDADES)}")
+		self.escritores = escritores  # tipo -> función(lista_datos, sincronizar)
+		self.intervalo = intervalo
+		self.durabilidad = durabilidad
+		self.capacidad = capacidad
+		self.espera_maxima = espera_maxima  # Segundos que encolar espera con la cola llena antes de fallar
+		self.cola = queue.Queue(maxsize=capacidad)
+		self.lock_volcado = threading.Lock()  # Un solo volcado a la vez (hilo o detener)
+		self.hilo = None
+		self.estadisticas = {
+			"volcados": 0,
+			"elementos_escritos": 0,
+			"profundidad_max": 0,
+			"ultima_duracion": 0.0,
+			"errores": 0,
+			"rechazados": 0
+		}
+
+	def encolar(self, tipo, datos=None):
+		"""Encola una escritura. Devuelve un Event que se activa cuando quedó en disco.
+
+		Si la cola está llena, espera: el almacenamiento se quedó atrás y se frena a los productores.
+		Quien encola suele tener tomado el lock global, así que la espera es de a lo sumo
+		'espera_maxima' segundos; después (o de inmediato si el hilo ya no corre) lanza RuntimeError.
+		"""
+		if self.hilo is not None and not self.hilo.is_alive():
+			self.estadisticas["rechazados"] += 1
+			raise RuntimeError(f"El hilo de persistencia no está corriendo: no se puede persistir '{tipo}'.")
+		evento = threading.Event()
+		try:
+			self.cola.put((tipo, datos, evento), timeout=self.espera_maxima)
+		except queue.Full:
+			self.estadisticas["rechazados"] += 1
+			log.error("Cola de persistencia llena durante %ss: se rechaza '%s'.", self.espera_maxima, tipo)
+			raise RuntimeError(f"Cola de persistencia llena: no se puede persistir '{tipo}'.")
+		profundidad = self.cola.qsize()
+		if profundidad > self.estadisticas["profundidad_max"]:
+			self.estadisticas["profundidad_max"] = profundidad
+		return evento
+
+	def esperar(self, evento, timeout=None):
+		"""En modo estricto espera a que la escritura llegue a disco; en diferido no bloquea."""
+		if self.durabilidad == "estricta" and evento is not None:
+			evento.wait(timeout)
+
+	def iniciar(self):
+		self.hilo = threading.Thread(target=self._ejecutar, name="persistencia", daemon=True)
+		self.hilo.start()
+		log.info("Hilo de persistencia iniciado (durabilidad %s, intervalo %ss, cola de %s).", self.durabilidad, self.intervalo, self.capacidad)
+
+	def _ejecutar(self):
+		while True:
+			try:
+				if self._ciclo():
+					break
+			except Exception as e:
+				# Si el hilo terminara, la cola acotada se llenaría con el lock global tomado
+				self.estadisticas["errores"] += 1
+				log.error("Error en el hilo de persistencia: %s", e)
+
+	def _ciclo(self):
+		"""Un volcado: espera la primera escritura, agrupa las siguientes y las escribe. True al detener."""
+		pendientes = [self.cola.get()]  # Bloquea hasta la primera escritura
+		if self.durabilidad == "diferida" and pendientes[0][0] is not None:
+			# La primera escritura abre la ventana; todo lo que llegue en ella se agrupa
+			limite = time.time() + self.intervalo
+			while True:
+				restante = limite - time.time()
+				if restante <= 0:
+					break
+				try:
+					pendientes.append(self.cola.get(timeout=restante))
+				except queue.Empty:
+					break
+				if pendientes[-1][0] is None:
+					break
+		pendientes += self._vaciar_cola()
+		# Un elemento de tipo None es la señal de detener()
+		detener = any(tipo is None for tipo, _, _ in pendientes)
+		self._volcar([elemento for elemento in pendientes if elemento[0] is not None])
+		return detener
+
+	def _vaciar_cola(self):
+		elementos = []
+		while True:
+			try:
+				elementos.append(self.cola.get_nowait())
+			except queue.Empty:
+				return elementos
+
+	def _volcar(self, elementos):
+		if not elementos:
+			return
+		with self.lock_volcado:
+			inicio = time.time()
+			por_tipo = {}
+			for tipo, datos, _ in elementos:
+				por_tipo.setdefault(tipo, []).append(datos)
+			sincronizar = self.durabilidad == "estricta"
+			for tipo, lista_datos in por_tipo.items():
+				try:
+					self.escritores[tipo](lista_datos, sincronizar)
+				except Exception as e:
+					# También errores de serialización: los demás tipos se escriben igual
+					self.estadisticas["errores"] += 1
+					log.error("Error al persistir '%s': %s", tipo, e)
+			self.estadisticas["volcados"] += 1
+			self.estadisticas["elementos_escritos"] += len(elementos)
+			self.estadisticas["ultima_duracion"] = time.time() - inicio
+		for _, _, evento in elementos:
+			evento.set()
+		profundidad = self.cola.qsize()
+		if profundidad > self.capacidad * 0.8:
+			log.warning("La cola de persistencia tiene %s/%s elementos; el almacenamiento se está quedando atrás.", profundidad, self.capacidad)
+
+	def detener(self, timeout=5):
+		"""Escribe todo lo que quede pendiente y termina el hilo (se llama al cerrar el servidor)."""
+		if self.hilo is None or not self.hilo.is_alive():
+			self._volcar(self._vaciar_cola())
+			return
+		self.cola.put((None, None, None))
+		self.hilo.join(timeout)
+
+	def resumen(self):
+		resumen = dict(self.estadisticas)
+		resumen["profundidad_cola"] = self.cola.qsize()
+		resumen["capacidad"] = self.capacidad
+		resumen["durabilidad"] = self.durabilidad
+		return resumen
+
+class Coalescedor:
+	"""Agrupa actualizaciones por clave y conserva solo la última de cada una hasta el próximo volcado.
+
+	No es seguro entre hilos por sí solo: se usa con el lock del estado tomado.
+	"""
+
+	def __init__(self, intervalo=1.0, maximo_pendientes=1000):
+		self.intervalo = intervalo
+		self.maximo_pendientes = maximo_pendientes
+		self.pendientes = {}
+		self.actualizaciones = 0  # Actualizaciones recibidas desde el último volcado
+		self.ultimo_volcado = time.time()
+		self.estadisticas = {
+			"volcados": 0,
+			"actualizaciones_totales": 0,
+			"registros_escritos": 0,
+			"absorbidas_ultimo_volcado": 0
+		}
+
+	def marcar(self, clave, valor):
+		"""Registra la actualización. Devuelve True si ya hay que volcar por cantidad."""
+		self.pendientes[clave] = valor
+		self.actualizaciones += 1
+		return len(self.pendientes) >= self.maximo_pendientes
+
+	def descartar(self, clave):
+		self.pendientes.pop(clave, None)
+
+	def vencido(self):
+		return bool(self.pendientes) and time.time() - self.ultimo_volcado >= self.intervalo
+
+	def extraer(self):
+		"""Devuelve las actualizaciones pendientes (la última por clave) y reinicia la cuenta."""
+		pendientes = self.pendientes
+		self.pendientes = {}
+		self.estadisticas["volcados"] += 1
+		self.estadisticas["actualizaciones_totales"] += self.actualizaciones
+		self.estadisticas["registros_escritos"] += len(pendientes)
+		self.estadisticas["absorbidas_ultimo_volcado"] = self.actualizaciones
+		self.actualizaciones = 0
+		self.ultimo_volcado = time.time()
+		return pendientes
+
+	def resumen(self):
+		resumen = dict(self.estadisticas)
+		resumen["pendientes"] = len(self.pendientes)
+		resumen["absorbidas_por_volcado"] = (
+			self.estadisticas["actualizaciones_totales"] / self.estadisticas["volcados"]
+			if self.estadisticas["volcados"] else 0
+		)
+		return resumen
+
+class BitacoraSegmentada:
+	"""Registro append-only de líneas JSON dividido en segmentos numerados.
+
+	Los registros se escriben al final del segmento activo
+	('<prefijo>.000001.jsonl', '<prefijo>.000002.jsonl', ...) con un buffer de
+	escritura; el fsync se hace cada 'intervalo_fsync' segundos (o en cada
+	escritura si se pide sincronizar) y al superar 'tamano_segmento' bytes se
+	pasa al siguiente segmento. Al reabrir el último segmento se descarta una
+	línea incompleta final, para que el primer registro nuevo no quede pegado
+	a ella.
+	"""
+
+	def __init__(self, prefijo, tamano_segmento=8 * 1024 * 1024, intervalo_fsync=5.0):
+		self.prefijo = prefijo
+		self.tamano_segmento = tamano_segmento
+		self.intervalo_fsync = intervalo_fsync
+		self.archivo = None
+		self.numero = None
+		self.ultimo_fsync = time.time()
+		self.patron = re.compile(re.escape(os.path.basename(prefijo)) + r"\.(\d{6})\.jsonl$")
+
+	def ruta_segmento(self, numero):
+		return f"{self.prefijo}.{numero:06d}.jsonl"
+
+	def segmentos(self):
+		"""Lista ordenada de (número, ruta) de los segmentos existentes."""
+		directorio = os.path.dirname(self.prefijo) or "."
+		encontrados = []
+		for nombre in os.listdir(directorio):
+			coincidencia = self.patron.match(nombre)
+			if coincidencia:
+				encontrados.append((int(coincidencia.group(1)), os.path.join(directorio, nombre)))
+		encontrados.sort()
+		return encontrados
+
+	def _abrir(self):
+		if self.archivo is None:
+			existentes = self.segmentos()
+			self.numero = existentes[-1][0] if existentes else 1
+			self._recortar_linea_incompleta(self.ruta_segmento(self.numero))
+			self.archivo = open(self.ruta_segmento(self.numero), "a", buffering=64 * 1024)
+
+	def _recortar_linea_incompleta(self, ruta):
+		"""Trunca el segmento después de su último salto de línea (una caída pudo cortar la última escritura)."""
+		try:
+			archivo = open(ruta, "r+b")
+		except FileNotFoundError:
+			return
+		with archivo:
+			tamano = posicion = archivo.seek(0, os.SEEK_END)
+			while posicion > 0:
+				inicio = max(posicion - 64 * 1024, 0)
+				archivo.seek(inicio)
+				bloque = archivo.read(posicion - inicio)
+				salto = bloque.rfind(b"\n")
+				if salto != -1:
+					posicion = inicio + salto + 1
+					break
+				posicion = inicio
+			if posicion < tamano:
+				log.warning("Se descartan %s bytes de una línea incompleta al final de %s.", tamano - posicion, ruta)
+				archivo.truncate(posicion)
+
+	def agregar(self, registros, sincronizar=False):
+		"""Agrega los registros al final del segmento activo."""
+		self._abrir()
+		self.archivo.write("".join(json.dumps(elemento) + "\n" for elemento in registros))
+		self.archivo.flush()
+		if sincronizar or time.time() - self.ultimo_fsync >= self.intervalo_fsync:
+			os.fsync(self.archivo.fileno())
+			self.ultimo_fsync = time.time()
+		if self.archivo.tell() >= self.tamano_segmento:
+			self.rotar()
+
+	def rotar(self):
+		"""Cierra el segmento activo y empieza uno nuevo. Devuelve el número del nuevo segmento."""
+		self._abrir()
+		self.archivo.flush()
+		os.fsync(self.archivo.fileno())
+		self.archivo.close()
+		self.numero += 1
+		self.archivo = open(self.ruta_segmento(self.numero), "a", buffering=64 * 1024)
+		self.ultimo_fsync = time.time()
+		return self.numero
+
+	def leer(self, desde=None):
+		"""Recorre los registros de todos los segmentos (o desde el número 'desde') sin cargarlos juntos."""
+		for numero, ruta in self.segmentos():
+			if desde is not None and numero < desde:
+				continue
+			with open(ruta, "r") as archivo:
+				for linea in archivo:
+					linea = linea.strip()
+					if not linea:
+						continue
+					try:
+						yield json.loads(linea)
+					except json.JSONDecodeError:
+						# Una línea incompleta al final indica una caída a mitad de escritura; quien
+						# reaplica con números de secuencia detecta el hueco si la línea era de otro lugar
+						log.warning("Línea inválida ignorada en %s.", ruta)
+
+	def eliminar_anteriores(self, numero):
+		"""Borra los segmentos con número menor que 'numero' (ya cubiertos por una instantánea)."""
+		for numero_segmento, ruta in self.segmentos():
+			if numero_segmento < numero:
+				os.remove(ruta)
+
+	def cerrar(self):
+		if self.archivo is not None:
+			self.archivo.flush()
+			os.fsync(self.archivo.fileno())
+			self.archivo.close()
+			self.archivo = None
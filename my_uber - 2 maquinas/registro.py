@@ -0,0 +1,104 @@
+# registro.py
+
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+# Niveles por módulo: "INFO" para todos, o "WARNING,servidor_central=DEBUG,taxi=INFO"
+VARIABLE_NIVELES = "MY_UBER_LOG"
+NIVEL_POR_DEFECTO = "INFO"
+FORMATO = "%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s"
+INTERVALO_FLUSH = 0.5  # Segundos máximos que una línea puede quedar en el buffer
+
+_oyente = None
+
+class ManejadorBuffer(logging.StreamHandler):
+	"""StreamHandler que no hace flush en cada línea: a lo sumo cada 'intervalo' segundos,
+	salvo advertencias y errores, que se escriben de inmediato.
+
+	El temporizador se arma y se cancela siempre con self.lock tomado (es un
+	RLock: emit lo tiene tomado cuando llama a flush), así un flush del temporizador
+	no se cruza con un emit o un flush de otro hilo."""
+
+	def __init__(self, flujo=None, intervalo=INTERVALO_FLUSH):
+		super().__init__(flujo)
+		self.intervalo = intervalo
+		self.ultimo_flush = time.time()
+		self.temporizador = None  # Flush pendiente para las líneas que queden en el buffer
+
+	def emit(self, registro):
+		try:
+			with self.lock:
+				self.stream.write(self.format(registro) + self.terminator)
+				if registro.levelno >= logging.WARNING or time.time() - self.ultimo_flush >= self.intervalo:
+					self.flush()
+				elif self.temporizador is None:
+					# Sin más líneas detrás, esta no debe quedar en el buffer indefinidamente
+					self.temporizador = threading.Timer(self.intervalo, self.flush)
+					self.temporizador.daemon = True
+					self.temporizador.start()
+		except Exception:
+			self.handleError(registro)
+
+	def flush(self):
+		with self.lock:
+			super().flush()
+			self.ultimo_flush = time.time()
+			if self.temporizador is not None:
+				self.temporizador.cancel()
+				self.temporizador = None
+
+def interpretar_niveles(texto):
+	"""Devuelve (nivel_global, {modulo: nivel}) a partir de 'INFO,servidor_central=DEBUG'."""
+	nivel_global = NIVEL_POR_DEFECTO
+	por_modulo = {}
+	for parte in texto.split(","):
+		parte = parte.strip()
+		if not parte:
+			continue
+		if "=" in parte:
+			modulo, nivel = parte.split("=", 1)
+			por_modulo[modulo.strip()] = nivel.strip().upper()
+		else:
+			nivel_global = parte.upper()
+	return nivel_global, por_modulo
+
+def configurar(niveles=None):
+	"""Instala el registro compartido: cada hilo encola su mensaje ya armado y un hilo aparte lo escribe.
+
+	Se llama una vez por proceso (obtener() lo hace solo si hace falta).
+	"""
+	global _oyente
+	if _oyente is not None:
+		return
+	nivel_global, por_modulo = interpretar_niveles(niveles if niveles is not None else os.environ.get(VARIABLE_NIVELES, ""))
+	manejador = ManejadorBuffer(sys.stdout)
+	manejador.setFormatter(logging.Formatter(FORMATO))
+	cola = queue.SimpleQueue()
+	_oyente = logging.handlers.QueueListener(cola, manejador)
+	raiz = logging.getLogger()
+	raiz.handlers = [logging.handlers.QueueHandler(cola)]
+	raiz.setLevel(nivel_global)
+	for modulo, nivel in por_modulo.items():
+		logging.getLogger(modulo).setLevel(nivel)
+	_oyente.start()
+	atexit.register(cerrar)
+
+def obtener(nombre):
+	"""Logger del módulo 'nombre'. Los mensajes usan formato diferido: log.debug("Taxi %s", id_taxi)."""
+	configurar()
+	return logging.getLogger(nombre)
+
+def cerrar():
+	"""Escribe lo que quede en la cola y en el buffer (al terminar el proceso)."""
+	global _oyente
+	if _oyente is not None:
+		_oyente.stop()
+		for manejador in _oyente.handlers:
+			manejador.flush()
+		_oyente = None
@@ -10,6 +10,9 @@ import matplotlib.pyplot as plt
 from threading import Thread
 import psutil  # Para monitorear métricas del sistema
 
+from persistencia import BitacoraSegmentada
+from histograma import HistogramaLatencias
+
 def run_server(simulation_dir):
 	"""
 	Ejecuta el servidor central en el directorio especificado.
@@ -91,13 +94,8 @@ def collect_metrics(simulation_dir):
 	else:
 		metrics["server"] = {}
 	
-	# Taxi metrics
-	taxi_metrics_file = os.path.join(simulation_dir, "metricas_taxi.json")
-	if os.path.exists(taxi_metrics_file):
-		with open(taxi_metrics_file, "r") as f:
-			metrics["taxi"] = json.load(f)
-	else:
-		metrics["taxi"] = {}
+	# Taxi metrics: utilización de toda la flota, agregada por el servidor
+	metrics["taxi"] = metrics["server"].get("utilizacion", {})
 	
 	# User metrics
 	user_metrics_file = os.path.join(simulation_dir, "estadisticas_usuario.json")
@@ -107,13 +105,9 @@ def collect_metrics(simulation_dir):
 	else:
 		metrics["user"] = {}
 	
-	# Historial
-	historial_file = os.path.join(simulation_dir, "historial_servidor.json")
-	if os.path.exists(historial_file):
-		with open(historial_file, "r") as f:
-			metrics["historial"] = json.load(f)
-	else:
-		metrics["historial"] = []
+	# Historial (segmentos historial_servidor.NNNNNN.jsonl)
+	bitacora = BitacoraSegmentada(os.path.join(simulation_dir, "historial_servidor"))
+	metrics["historial"] = list(bitacora.leer())
 	
 	# System metrics
 	system_metrics_file = os.path.join(simulation_dir, "system_metrics.json")
@@ -168,12 +162,9 @@ def generar_graficas(resultados):
 		for r in resultados:
 			if r["numero_taxis"] == numero_taxis:
 				usuarios.append(r["numero_usuarios"])
-				tiempos = r["metrics"]["user"].get("tiempos_respuesta", [])
-				if tiempos:
-					promedio = sum(tiempos) / len(tiempos)
-				else:
-					promedio = 0
-				tiempo_respuesta.append(promedio)
+				# Acepta tanto el histograma como la lista de tiempos de versiones anteriores
+				tiempos = HistogramaLatencias.cargar(r["metrics"]["user"].get("tiempos_respuesta"))
+				tiempo_respuesta.append(tiempos.media())
 		plt.plot(usuarios, tiempo_respuesta, marker='o', label=f"{numero_taxis} taxis")
 	plt.xlabel("Número de Usuarios")
 	plt.ylabel("Tiempo de Respuesta Promedio (s)")
@@ -7,6 +7,24 @@ import json
 import math
 import os
 import socket
+import argparse
+import queue
+import itertools
+from collections import deque
+
+from emparejamiento import MOTORES, BuscadorLineal, crear_motor, asignar_lote
+from fragmentos import DespachadorFragmentado
+from histograma import HistogramaLatencias
+from persistencia import DURABILIDADES, BitacoraSegmentada, Coalescedor, HiloPersistencia, escribir_json
+import registro
+import cluster
+from metricas_http import ServidorMetricas, muestras_histograma
+from trazas import RegistroTramos, Traza
+from perfilador import PerfiladorMuestreo, instalar_senal
+from candados import LockInstrumentado
+from flota import UtilizacionFlota
+
+log = registro.obtener("servidor_central")
 
 # Configuración de ZeroMQ
 
@@ -25,15 +43,19 @@ def get_local_ip():
 
 SERVER_IP = get_local_ip()
 SERVER_PORT = 5557
-SERVERS = ["10.43.100.133", "10.43.101.2"]
+NODOS = cluster.nodos_configurados()  # Nodos del clúster (--cluster o MY_UBER_CLUSTER)
+nodo_propio = None  # Este servidor dentro de NODOS; se fija al arrancar
 
 # Puerto para recepción de posiciones de taxis
 TAXI_POSITION_PORT = 5555
 
 # Otros puertos
 DISCOVERY_PORT = 5560  # Puerto para negociación inicial
-ESTADO_SYNC_PORT = 5561  # Puerto para sincronización de estado
+ESTADO_SYNC_PORT = 5561  # Puerto para sincronización de estado (PUB de cambios)
 HEALTH_CHECK_PORT = 5562  # Puerto para health-check
+SEGUIDORES_PORT = 5563  # Puerto ROUTER donde los respaldos confirman cambios y piden ponerse al día
+ANUNCIO_PORT = 5564  # Puerto PUB donde el servidor que asume como principal se anuncia a los taxis
+CONSULTA_PORT = 5565  # Puerto REP de consultas de solo lectura; lo atienden todos los nodos
 USER_REQUEST_PORT = 5557  # Puerto para solicitudes de usuarios
 # TAXI_ASSIGN_PORT = 5556  # Puerto para asignaciones de taxis (Eliminado)
 
@@ -41,471 +63,1804 @@ USER_REQUEST_PORT = 5557  # Puerto para solicitudes de usuarios
 taxis_registrados = {}  # ID -> (x, y)
 solicitudes_usuarios = []  # Solicitudes pendientes (Eliminado)
 ROL = None  # Rol del servidor (principal o respaldo)
-lock = threading.Lock()  # Lock para acceso concurrente al estado
+lider = None  # Nodo que este servidor sigue (él mismo si es el principal)
+termino = 0  # Término de la elección más reciente conocida; cada líder tiene el suyo
+votos_emitidos = {}  # término -> id del nodo al que se votó
+ultimo_voto = None  # perf_counter del último voto concedido: reinicia la espera de latidos
+lock_eleccion = threading.Lock()  # Protege termino, lider, votos_emitidos y ultimo_voto
+TIMEOUT_VOTO_MS = 200
+lock = LockInstrumentado()  # Lock para acceso concurrente al estado; mide espera y retención por función
+
+# Motor de emparejamiento: "lineal" (recorrido original), "indice" (celdas) o "numpy" (vectorizado)
+MOTOR_EMPAREJAMIENTO = "indice"
+motor_taxis = None  # Espejo de taxis_registrados en el motor elegido
+
+# Fragmentación geográfica: con más de un fragmento cada región de la cuadrícula
+# la atiende un proceso propio con su parte de los taxis registrados. Las búsquedas,
+# reclamos y posiciones van a esos procesos sin el lock global; taxis_registrados
+# queda como copia para el WAL, la replicación y las consultas. Cada consulta a una
+# región cuesta una ida y vuelta por un Pipe: con el motor "indice" un solo motor es
+# más rápido, y los fragmentos solo convienen con "lineal" (python fragmentos.py)
+FRAGMENTOS = 1
+CUADRICULA_N = 100  # Tamaño de la cuadrícula usado para dividir las regiones
+CUADRICULA_M = 100
 
-print("=== INICIO DEL SERVIDOR ===", flush=True)
-print(f"Rol actual del servidor: {ROL}", flush=True)
-print(f"Taxis registrados: {taxis_registrados}", flush=True)
-print(f"Solicitudes de usuarios: {solicitudes_usuarios}", flush=True)
+# Modo de despacho: "voraz" (taxi más cercano por solicitud) o "lotes" (asignación óptima por ventana)
+MODO_DESPACHO = "voraz"
+VENTANA_LOTE_MS = 100  # Duración de la ventana de agrupación en modo "lotes"
+# La asignación óptima crece con el cubo del lote y se resuelve con el lock tomado: con 50
+# solicitudes son unos 30-55 ms, con 200 ya 300-600 ms. Un lote lleno cierra la ventana antes
+MAX_SOLICITUDES_LOTE = 50
 
-# Archivo para guardar el estado
+# Frente de solicitudes: "router" (ROUTER + cola interna) o "broker" (zmq.proxy ROUTER/DEALER)
+FRENTE_SOLICITUDES = "router"
+HILOS_SOLICITUDES = 8  # Hilos trabajadores que atienden solicitudes en paralelo
+RESPUESTAS_SOLICITUDES = "inproc://respuestas_solicitudes"
+cola_solicitudes = queue.Queue()  # (identidad, mensaje) pendientes de atender
+TRABAJADORES_BROKER = "inproc://trabajadores_broker"
+CAPTURA_BROKER = "inproc://captura_broker"
+estadisticas_trabajadores = {}  # índice -> contadores de cada trabajador del broker
+mensajes_broker = {"solicitudes": 0, "respuestas": 0}  # Contados desde la captura del proxy
+# Un nodo que no es el principal responde esto de inmediato y el usuario prueba el siguiente nodo
+RESPUESTA_NO_PRINCIPAL = json.dumps({"status": "no_principal", "mensaje": "Este servidor no es el principal."}).encode()
+
+log.info("=== INICIO DEL SERVIDOR ===")
+log.info("Rol actual del servidor: %s", ROL)
+log.debug("Taxis registrados: %s", taxis_registrados)
+log.debug("Solicitudes de usuarios: %s", solicitudes_usuarios)
+
+# Archivo para guardar el estado: una instantánea periódica más un registro de cambios (WAL)
 ESTADO_ARCHIVO = "estado_servidor.json"
+WAL_PREFIJO = "estado_servidor.wal"  # Segmentos estado_servidor.wal.000001.jsonl, ...
+TAMANO_SEGMENTO_WAL = 4 * 1024 * 1024
+INTERVALO_FSYNC_WAL = 1.0  # Segundos entre fsync del WAL en modo diferido
+INTERVALO_INSTANTANEA = 30  # Segundos máximos entre instantáneas
+CAMBIOS_POR_INSTANTANEA = 10000  # Cambios en el WAL que fuerzan una instantánea antes de tiempo
+bitacora_estado = BitacoraSegmentada(WAL_PREFIJO, TAMANO_SEGMENTO_WAL, INTERVALO_FSYNC_WAL)
+secuencia_wal = 0  # Número de secuencia del último cambio registrado
+termino_wal = 0  # Término del líder que registró ese cambio (dos historias con la misma secuencia se distinguen por él)
+cambios_desde_instantanea = 0
+ultima_instantanea = time.time()
+
+# Las posiciones de taxis se agrupan antes de ir al WAL: solo la última de cada taxi por volcado
+INTERVALO_VOLCADO_POSICIONES = 1.0  # Segundos máximos que una posición espera en memoria
+MAX_POSICIONES_PENDIENTES = 1000  # Taxis pendientes que fuerzan un volcado antes de tiempo
+coalescedor_posiciones = Coalescedor(INTERVALO_VOLCADO_POSICIONES, MAX_POSICIONES_PENDIENTES)
+
+# Persistencia: las escrituras a disco se hacen en un hilo aparte, fuera del lock
+INTERVALO_PERSISTENCIA = 1.0  # Segundos máximos entre volcados en modo diferido
+DURABILIDAD = "diferida"      # "diferida" o "estricta" (fsync antes de responder)
+TAMANO_COLA_PERSISTENCIA = 10000
+persistencia = None
+
+# Métricas en vivo: HTTP en localhost con formato de Prometheus (0 lo desactiva)
+PUERTO_METRICAS = 9100
+servidor_metricas = None
+
+# Tiempo ocupado/libre que cada taxi adjunta a su posición: "id:(x,y):(ocupado,libre)"
+utilizacion_flota = UtilizacionFlota()
+
+# Tramos por etapa (recibir, decodificar, espera_lock, ...) de solicitudes y posiciones
+ARCHIVO_TRAZAS = None  # Si se indica, cada traza se agrega como una línea JSON
+tramos = RegistroTramos()
+trazas_pendientes = {}  # identidad ROUTER -> Traza de la solicitud que espera su respuesta
+
+# Perfilador por muestreo: kill -USR1 <pid> perfila todos los hilos durante DURACION_PERFIL segundos
+DURACION_PERFIL = 10
+INTERVALO_MUESTREO_PERFIL = 0.005
+
+# Replicación por flujo de cambios: cada cambio del WAL se publica a los respaldos con su
+# secuencia. Los respaldos confirman lo aplicado por SEGUIDORES_PORT y, al conectarse o ante
+# un hueco, piden ahí los cambios desde su última secuencia (o el estado completo si ya no están).
+cola_replicacion = queue.Queue()  # Cambios registrados pendientes de publicar (solo en el principal)
+RETENCION_REPLICACION = 100000  # Cambios publicados que se retienen para poner al día a un respaldo
+cambios_retenidos = deque(maxlen=RETENCION_REPLICACION)
+envios_publicados = deque(maxlen=RETENCION_REPLICACION)  # (última secuencia, marca de tiempo) de cada envío
+seguidores = {}  # identidad del respaldo -> {"seq": última confirmada, "confirmado": marca de tiempo}
+lock_replicacion = threading.Lock()  # Protege lo anterior; nunca se toma junto con el lock global
+INTERVALO_LATIDO_REPLICACION = 0.5  # Sin cambios, el principal publica su secuencia con esta frecuencia
+TIMEOUT_PUESTA_AL_DIA_MS = 5000
+SEGUIDOR_INACTIVO = 10  # Segundos sin confirmaciones tras los que un respaldo deja de contar en el retraso
+hilo_replicacion = None  # Respaldo: hilo que aplica el flujo de cambios
+fin_seguimiento = threading.Event()  # Al promoverse: aplicar lo recibido del principal y dejar de seguirlo
+
+# Consultas de solo lectura (conteo de taxis libres, posiciones, historial, métricas) en todos los
+# nodos; un respaldo solo responde si su estado no es más viejo que lo que admite la consulta
+MAX_RETRASO_LECTURA_MS = 2000  # Antigüedad admitida si la consulta no fija "max_retraso_ms"
+metricas_consultas = {"respondidas": 0, "desactualizadas": 0}
+
+# Anuncio a los taxis: todo servidor publica en ANUNCIO_PORT desde que arranca, así los taxis
+# ya están suscritos cuando alguno asume como principal. Se repite por si un taxi se reconecta.
+socket_anuncios = None
+lock_anuncios = threading.Lock()  # Anuncian tanto el nodo que asume como el que cede
+REPETICIONES_ANUNCIO = 3
+INTERVALO_ANUNCIO = 0.5
+
+# Detección de fallas: el principal publica un latido cada INTERVALO_LATIDO segundos y cada
+# seguidor convoca una elección tras LATIDOS_PERDIDOS intervalos sin recibir ninguno
+INTERVALO_LATIDO = 0.1
+LATIDOS_PERDIDOS = 3
+GRACIA_PRIMER_LATIDO = 1.0  # Margen extra para el primer latido mientras se establece la conexión
+
+# Respaldo en caliente: los hilos del principal arrancan con el servidor, abren sus puertos y
+# esperan a es_principal; el índice, la cola del historial y los contadores se mantienen al día
+# con el flujo de replicación. Asumir es marcar el rol y activar es_principal; ceder ante otro
+# líder es desactivarlo, y esos hilos vuelven a esperar.
+PUERTOS_PRINCIPAL = (TAXI_POSITION_PORT, USER_REQUEST_PORT, ESTADO_SYNC_PORT, HEALTH_CHECK_PORT, SEGUIDORES_PORT)
+es_principal = threading.Event()
+puertos_no_disponibles = []  # Puertos del principal ocupados al arrancar: este nodo no se postula
+ESPERA_REPLICACION_MS = 10  # Cota de lo que tarda el hilo de replicación en notar que se asume
+promocion = {
+	"latidos_recibidos": 0,
+	"ultimo_latido": None,
+	"retraso_latido_ms": None,  # Reloj del respaldo menos el del principal al enviar el último latido
+	"failover_ms": None,        # Desde el último latido recibido hasta terminar de asumir como principal
+	"deteccion_ms": None,
+	"promocion_ms": None,
+	"etapas_ms": {},
+	"promovido": None,
+	"renuncias": 0              # Veces que este nodo cedió ante otro líder y volvió a ser seguidor
+}
+replicacion = {
+	"secuencia_enviada": 0,     # Principal: secuencia del último cambio publicado
+	"ultimo_envio": time.time(),
+	"cambios_enviados": 0,
+	"secuencia_recibida": 0,    # Respaldo: secuencia del último cambio aplicado
+	"enviado_recibido": None,   # Respaldo: marca de tiempo del principal en ese cambio
+	"secuencia_principal": 0,   # Respaldo: última secuencia anunciada por el principal
+	"cambios_aplicados": 0,
+	"puestas_al_dia": 0,        # Respaldo: veces que se puso al día con cambios retenidos
+	"resincronizaciones": 0     # Respaldo: veces que recibió el estado completo
+}
 
 # Crear un único contexto de ZeroMQ global
 context = zmq.Context()
 
 # Definición de cargar_estado
 def cargar_estado():
-	global taxis_registrados, solicitudes_usuarios
-	print("Cargando estado previo...", flush=True)
+	"""Carga la última instantánea y reaplica los cambios del WAL posteriores a ella."""
+	global taxis_registrados, solicitudes_usuarios, secuencia_wal, termino_wal, termino
+	log.info("Cargando estado previo...")
+	estado = {}
 	try:
 		with open(ESTADO_ARCHIVO, "r") as archivo:
 			estado = json.load(archivo)
-		taxis_registrados = estado.get("taxis", {})
-		solicitudes_usuarios = estado.get("solicitudes", [])
-		print("Estado previo cargado exitosamente.", flush=True)
-		print(f"Taxis registrados después de cargar: {taxis_registrados}", flush=True)
-		print(f"Solicitudes de usuarios después de cargar: {solicitudes_usuarios}", flush=True)
+		log.info("Instantánea de estado cargada.")
 	except FileNotFoundError:
-		print("No se encontró estado previo. Iniciando desde cero.", flush=True)
+		log.info("No se encontró instantánea previa.")
 	except json.JSONDecodeError as e:
-		print(f"Error al decodificar el archivo de estado: {e}. Iniciando desde cero.", flush=True)
+		log.warning("Error al decodificar el archivo de estado: %s. Se usará solo el WAL.", e)
 	except Exception as e:
-		print(f"Error inesperado al cargar el estado: {e}. Iniciando desde cero.", flush=True)
+		log.error("Error inesperado al cargar el estado: %s. Se usará solo el WAL.", e)
+	taxis_registrados = estado.get("taxis", {})
+	solicitudes_usuarios = estado.get("solicitudes", [])
+	secuencia_wal = estado.get("seq", 0)
+	termino_wal = estado.get("termino", 0)
 
-def guardar_estado():
-	print("Guardando estado actual...", flush=True)
+	reaplicados = 0
 	try:
-		estado = {
-			"taxis": taxis_registrados,
-			"solicitudes": solicitudes_usuarios
-		}
-		with open(ESTADO_ARCHIVO, "w") as archivo:
-			json.dump(estado, archivo, indent=4)
-		print("Estado guardado en estado_servidor.json exitosamente.", flush=True)
-	except IOError as e:
-		print(f"Error al guardar el estado: {e}", flush=True)
+		for cambio in bitacora_estado.leer(desde=estado.get("segmento_wal")):
+			if cambio["seq"] <= secuencia_wal:
+				continue  # Ya incluido en la instantánea
+			if cambio["seq"] != secuencia_wal + 1:
+				# Falta un cambio (línea ilegible): los siguientes no se pueden aplicar encima.
+				# La instantánea deja el disco igual a lo reconstruido y borra los cambios huérfanos
+				log.error("Hueco en el WAL: después del cambio %s sigue el %s. Se detiene la reaplicación.", secuencia_wal, cambio["seq"])
+				with lock:
+					tomar_instantanea()
+				break
+			aplicar_cambio(cambio)
+			secuencia_wal = cambio["seq"]
+			termino_wal = cambio.get("termino", termino_wal)
+			reaplicados += 1
+	except (IOError, KeyError) as e:
+		log.error("Error al reaplicar el WAL: %s. Se conserva el estado reconstruido hasta el cambio %s.", e, secuencia_wal)
+	motor_taxis.reconstruir(taxis_registrados)
+	termino = termino_wal  # Ningún término anterior a los cambios que ya tiene puede volver a ganar
+	log.info("Estado previo cargado exitosamente (%s cambios reaplicados desde el WAL, secuencia %s).", reaplicados, secuencia_wal)
+	log.debug("Taxis registrados después de cargar: %s", taxis_registrados)
+	log.debug("Solicitudes de usuarios después de cargar: %s", solicitudes_usuarios)
+
+def aplicar_cambio(cambio):
+	"""Aplica un cambio del WAL al estado en memoria (sin tocar el motor de emparejamiento)."""
+	if cambio["op"] == "posicion":
+		taxis_registrados[cambio["id"]] = tuple(cambio["pos"])
+	elif cambio["op"] == "posiciones":
+		for id_taxi, posicion in cambio["taxis"].items():
+			taxis_registrados[id_taxi] = tuple(posicion)
+	elif cambio["op"] == "eliminar":
+		taxis_registrados.pop(cambio["id"], None)
+	elif cambio["op"] == "solicitud":
+		solicitudes_usuarios.append(cambio["solicitud"])
+
+def registrar_cambio(op, **datos):
+	"""Encola un cambio de estado en el WAL (se llama con el lock tomado, en el mismo orden que el cambio)."""
+	global secuencia_wal, cambios_desde_instantanea, termino_wal
+	cambio = {"seq": secuencia_wal + 1, "termino": termino, "op": op}
+	cambio.update(datos)
+	# Si la persistencia lo rechaza (RuntimeError), el cambio no consume secuencia ni se replica
+	escritura = persistencia.encolar("wal", cambio)
+	if op == "eliminar":
+		# Una posición pendiente del taxi quedaría escrita después de su eliminación
+		coalescedor_posiciones.descartar(datos["id"])
+	secuencia_wal += 1
+	cambios_desde_instantanea += 1
+	termino_wal = termino
+	if ROL == "principal":
+		cola_replicacion.put(cambio)
+	return escritura
+
+def devolver_taxi(id_taxi):
+	"""Vuelve a dejar libre en el motor un taxi reclamado cuya eliminación no llegó al WAL (con el lock tomado)."""
+	posicion = taxis_registrados.get(id_taxi)
+	if posicion is not None:
+		motor_taxis.actualizar(id_taxi, posicion)
+
+def aplicar_cambio_replicado(cambio):
+	"""Aplica en el respaldo un cambio recibido del principal: estado, motor y WAL propio (con el lock tomado)."""
+	global secuencia_wal, cambios_desde_instantanea, termino_wal
+	# Primero al WAL, como registrar_cambio: si la persistencia lo rechaza, el cambio no se
+	# aplicó y recibir_estado_respaldo lo vuelve a pedir
+	persistencia.encolar("wal", cambio)
+	aplicar_cambio(cambio)
+	if cambio["op"] == "historial":
+		# También al historial propio; los contadores quedan al día para las consultas
+		agregar_historial(cambio["registro"])
+		metricas["servicios_exitosos" if cambio["registro"]["estado"] == "exitoso" else "servicios_rechazados"] += 1
+	elif cambio["op"] == "posiciones":
+		for id_taxi, posicion in cambio["taxis"].items():
+			motor_taxis.actualizar(id_taxi, tuple(posicion))
+	elif cambio["op"] == "posicion":
+		motor_taxis.actualizar(cambio["id"], tuple(cambio["pos"]))
+	elif cambio["op"] == "eliminar":
+		motor_taxis.eliminar(cambio["id"])
+	# La misma secuencia que en el principal: si este respaldo asume, su WAL continúa la numeración
+	secuencia_wal = cambio["seq"]
+	termino_wal = cambio.get("termino", 0)
+	cambios_desde_instantanea += 1
+
+def volcar_posiciones():
+	"""Escribe en el WAL, como un solo cambio, la última posición de cada taxi pendiente (con el lock tomado)."""
+	pendientes = coalescedor_posiciones.extraer()
+	if pendientes:
+		registrar_cambio("posiciones", taxis=pendientes)
+		log.debug("Volcado de posiciones: %s actualizaciones absorbidas en %s taxis.", coalescedor_posiciones.estadisticas['absorbidas_ultimo_volcado'], len(pendientes))
+
+def volcar_posiciones_periodicamente():
+	"""Vuelca las posiciones pendientes como máximo una vez cada INTERVALO_VOLCADO_POSICIONES segundos."""
+	while True:
+		try:
+			time.sleep(INTERVALO_VOLCADO_POSICIONES)
+			es_principal.wait()
+			with lock:
+				if coalescedor_posiciones.vencido():
+					volcar_posiciones()
+		except Exception as e:
+			log.error("Error en volcar_posiciones_periodicamente: %s", e)
+			break
+
+def tomar_instantanea():
+	"""Encola una instantánea del estado (se llama con el lock tomado)."""
+	global cambios_desde_instantanea, ultima_instantanea
+	instantanea = {
+		"taxis": dict(taxis_registrados),
+		"solicitudes": list(solicitudes_usuarios),
+		"seq": secuencia_wal,
+		"termino": termino_wal
+	}
+	cambios_desde_instantanea = 0
+	ultima_instantanea = time.time()
+	return persistencia.encolar("wal", {"instantanea": instantanea})
+
+def escribir_wal(elementos, sincronizar):
+	"""Escritor del hilo de persistencia para el WAL y las instantáneas, en orden de llegada.
+
+	Antes de cada instantánea se cierra el segmento activo del WAL: la instantánea
+	apunta al segmento nuevo y los anteriores, ya cubiertos por ella, se borran.
+	"""
+	cambios = []
+	for elemento in elementos:
+		if "instantanea" not in elemento:
+			cambios.append(elemento)
+			continue
+		if cambios:
+			bitacora_estado.agregar(cambios, sincronizar)
+			cambios = []
+		instantanea = elemento["instantanea"]
+		instantanea["segmento_wal"] = bitacora_estado.rotar()
+		log.debug("Guardando instantánea del estado...")
+		escribir_json(ESTADO_ARCHIVO, instantanea, sincronizar=True)
+		bitacora_estado.eliminar_anteriores(instantanea["segmento_wal"])
+		log.info("Instantánea guardada en estado_servidor.json (secuencia %s).", instantanea['seq'])
+	if cambios:
+		bitacora_estado.agregar(cambios, sincronizar)
 
 # Función para calcular la distancia euclidiana entre dos puntos
 def calcular_distancia(x1, y1, x2, y2):
 	distancia = math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-	print(f"Calculando distancia entre ({x1}, {y1}) y ({x2}, {y2}): {distancia}", flush=True)
+	log.debug("Calculando distancia entre (%s, %s) y (%s, %s): %s", x1, y1, x2, y2, distancia)
 	return distancia
 
-# Funciones de Negociación y Roles
-def iniciar_negociacion():
-	print("Iniciando negociación de roles...", flush=True)
-	global ROL, primary_server_ip
-	ROL = "principal"  # Default to principal
-	primary_server_ip = None
-	socket = context.socket(zmq.REQ)
-	socket.setsockopt(zmq.RCVTIMEO, 2000)  # 2-second timeout
-	
-	# Intentar conectarse a otros servidores para verificar si hay un principal
-	for server in SERVERS:
-		if server == SERVER_IP:
-			continue  # No intentar conectarse a sí mismo
-		discovery_address = f"tcp://{server}:{DISCOVERY_PORT}"
-		try:
-			print(f"Intentando conectarse a {discovery_address} para verificar principal...", flush=True)
-			socket.connect(discovery_address)
-			print("Enviando solicitud de principal...", flush=True)
-			socket.send_string("¿Hay un principal?")
-			print("Solicitud enviada. Esperando respuesta...", flush=True)
-			respuesta = socket.recv_string()
-			print(f"Respuesta recibida de {server}: {respuesta}", flush=True)
-			if respuesta.strip().lower() == "sí":
-				ROL = "respaldo"
-				print("Asignado rol: RESPALDO", flush=True)
-				break  # No es necesario verificar más servidores
-			socket.disconnect(discovery_address)
-		except zmq.error.Again:
-			print(f"No se pudo conectar a {discovery_address}. Continuando con la verificación...", flush=True)
-			socket.disconnect(discovery_address)
-		except Exception as e:
-			print(f"Error al conectarse a {discovery_address}: {e}", flush=True)
-			socket.disconnect(discovery_address)
-	
-	if ROL == "principal":
-		print("No se encontró un servidor principal existente. Asignado rol: PRINCIPAL", flush=True)
-	elif ROL == "respaldo":
-		print("Asignado rol: RESPALDO", flush=True)
+def iniciar_motor(nombre):
+	"""Crea el motor de emparejamiento y lo sincroniza con los taxis registrados."""
+	global motor_taxis
+	if FRAGMENTOS > 1:
+		motor = DespachadorFragmentado(FRAGMENTOS, CUADRICULA_N, CUADRICULA_M, nombre)
+		log.info("Cuadrícula %sx%s dividida en %sx%s regiones (%s procesos).", CUADRICULA_N, CUADRICULA_M, motor.filas, motor.columnas, FRAGMENTOS)
+		if nombre != "lineal":
+			log.warning("Con el motor %s, la comunicación con las regiones cuesta más que la búsqueda: "
+				"sin --fragmentos se atienden más solicitudes por segundo.", nombre)
+	elif nombre == "lineal":
+		# El recorrido original usa calcular_distancia para cada taxi
+		motor = BuscadorLineal(calcular_distancia)
 	else:
-		print("Rol no asignado correctamente. Verifica la negociación de roles.", flush=True)
-	
-	# Cerrar el socket de negociación
-	socket.close()
-	print("Cerrando socket de negociación.", flush=True)
+		motor = crear_motor(nombre)
+	motor.reconstruir(taxis_registrados)
+	motor_taxis = motor
+	log.info("Motor de emparejamiento en uso: %s", nombre)
+
+# Funciones de Clúster y Elección de Líder
+def puerto_local(puerto):
+	"""Puerto base 'puerto' desplazado según este nodo (varios nodos pueden compartir máquina)."""
+	return puerto + nodo_propio.desplazamiento
+
+def ubicar_nodo_propio(id_nodo=None):
+	"""Nodo de NODOS que corresponde a este servidor: el de 'id_nodo' o el primero con la IP local."""
+	if id_nodo is not None:
+		return NODOS[id_nodo]
+	for nodo in NODOS:
+		if nodo.host == SERVER_IP:
+			return nodo
+	return None
 
+def atender_cluster():
+	"""Responde en DISCOVERY_PORT si este nodo es el principal y las solicitudes de voto de los candidatos.
 
-def publicar_presencia():
-	"""El principal anuncia su presencia periódicamente."""
-	print("Iniciando publicación de presencia como principal...", flush=True)
+	Corre en todos los nodos, cualquiera sea su rol: un seguidor contesta "No"
+	de inmediato en lugar de dejar que el que pregunta espere un timeout.
+	"""
 	socket = context.socket(zmq.REP)
-	socket.bind(f"tcp://*:{DISCOVERY_PORT}")
-	print(f"Servidor principal escuchando en tcp://*:{DISCOVERY_PORT}", flush=True)
+	socket.bind(f"tcp://*:{puerto_local(DISCOVERY_PORT)}")
+	log.info("Atendiendo al clúster en tcp://*:%s", puerto_local(DISCOVERY_PORT))
 
 	while True:
 		try:
-			print("Esperando solicitudes de presencia...", flush=True)
 			mensaje = socket.recv_string()
-			print(f"Mensaje recibido en publicación de presencia: {mensaje}", flush=True)
+			log.debug("Mensaje recibido del clúster: %s", mensaje)
 			if mensaje == "¿Hay un principal?":
-				print("Confirmando presencia como principal.", flush=True)
-				socket.send_string("Sí")
+				socket.send_string("Sí" if ROL == "principal" else "No")
+			elif mensaje.startswith("{"):
+				socket.send_json(conceder_voto(json.loads(mensaje)))
 			else:
-				print("Mensaje desconocido recibido en publicación de presencia.", flush=True)
+				log.warning("Mensaje desconocido recibido del clúster.")
 				socket.send_string("Desconocido")
 		except Exception as e:
-			print(f"Error en publicar_presencia: {e}", flush=True)
+			log.error("Error en atender_cluster: %s", e)
+			break
+
+def conceder_voto(pedido):
+	"""Vota por el candidato si el término es nuevo, no votó por otro y el candidato tiene todos sus cambios.
+
+	Un nodo que recibe latidos de un líder no vota: un candidato aislado no
+	puede destituir a un líder que el resto del clúster todavía ve.
+	"""
+	global termino, ultimo_voto
+	with lock_eleccion:
+		ultimo = promocion["ultimo_latido"]
+		con_lider = ultimo is not None and time.time() - ultimo < INTERVALO_LATIDO * LATIDOS_PERDIDOS
+		if pedido["termino"] > termino and ROL != "principal" and not con_lider:
+			termino = pedido["termino"]
+		concedido = (
+			ROL != "principal"
+			and not con_lider
+			and pedido["termino"] == termino
+			and votos_emitidos.get(termino, pedido["candidato"]) == pedido["candidato"]
+			and (pedido["termino_wal"], pedido["seq"]) >= (termino_wal, secuencia_wal)
+		)
+		if concedido:
+			votos_emitidos[termino] = pedido["candidato"]
+			ultimo_voto = time.perf_counter()
+	log.info("Voto %s al nodo %s en el término %s.", "concedido" if concedido else "negado", pedido["candidato"], pedido["termino"])
+	return {"termino": termino, "concedido": concedido}
+
+def convocar_eleccion():
+	"""Se postula como líder en el término siguiente; devuelve True si obtuvo el quórum de votos.
+
+	El término propio solo avanza si gana: un candidato que pierde sigue
+	aceptando los latidos del líder que sí fue elegido en ese término.
+	"""
+	global termino
+	with lock_eleccion:
+		mi_termino = termino + 1
+		votos_emitidos[mi_termino] = nodo_propio.id
+	pedido = json.dumps({
+		"termino": mi_termino,
+		"candidato": nodo_propio.id,
+		"termino_wal": termino_wal,
+		"seq": secuencia_wal
+	})
+	log.info("Postulándose como líder en el término %s (secuencia %s).", mi_termino, secuencia_wal)
+
+	# Pedir el voto a todos a la vez y esperar a lo sumo TIMEOUT_VOTO_MS
+	poller = zmq.Poller()
+	pendientes = {}
+	for nodo in NODOS:
+		if nodo is nodo_propio:
+			continue
+		socket = context.socket(zmq.REQ)
+		socket.setsockopt(zmq.LINGER, 0)
+		socket.connect(cluster.direccion(nodo, DISCOVERY_PORT))
+		socket.send_string(pedido)
+		poller.register(socket, zmq.POLLIN)
+		pendientes[socket] = nodo
+	votos = 1
+	necesarios = cluster.quorum(NODOS)
+	limite = time.perf_counter() + TIMEOUT_VOTO_MS / 1000
+	# Con el quórum alcanzado no se espera a los demás (uno caído haría esperar el timeout entero)
+	while pendientes and votos < necesarios:
+		restante = limite - time.perf_counter()
+		if restante <= 0:
+			break
+		for socket, _ in poller.poll(restante * 1000):
+			respuesta = socket.recv_json()
+			poller.unregister(socket)
+			pendientes.pop(socket)
+			socket.close()
+			if respuesta["concedido"]:
+				votos += 1
+			elif respuesta["termino"] > mi_termino:
+				with lock_eleccion:
+					termino = max(termino, respuesta["termino"])
+	for socket in pendientes:
+		socket.close()
+
+	with lock_eleccion:
+		# Si mientras tanto otro nodo llegó a este término, la elección ya no vale
+		ganada = votos >= necesarios and termino < mi_termino
+		if ganada:
+			termino = mi_termino
+	log.info("Elección del término %s %s: %s de %s votos necesarios.", mi_termino, "ganada" if ganada else "perdida", votos, necesarios)
+	return ganada
+
+def seguir_latido(latido):
+	"""Adopta al emisor del latido como líder si su término no es viejo. Devuelve False si se ignora."""
+	global termino, lider
+	with lock_eleccion:
+		if latido["termino"] < termino:
+			return False
+		termino = latido["termino"]
+		if lider is None or lider.id != latido["lider"]:
+			lider = NODOS[latido["lider"]]
+			log.info("Siguiendo al líder %s (término %s).", lider, termino)
+	return True
+
+def cede_ante(latido):
+	"""True si el emisor del latido gana el liderazgo: término mayor o, con el mismo término, id mayor.
+
+	Con dos nodos basta el voto propio y los dos pueden ganar el mismo término;
+	el desempate por id es el mismo en ambos, así que exactamente uno cede.
+	"""
+	return (latido["termino"], latido["lider"]) > (termino, nodo_propio.id)
+
+def renunciar(latido):
+	"""El principal cede ante el líder de 'latido' y vuelve a ser seguidor, sin detener el proceso.
+
+	Los hilos del principal dejan de atender al desactivarse es_principal. La
+	replicación vuelve a seguir al nuevo líder, que le envía su estado completo
+	si lo que este nodo registró como líder no está en su historia.
+	"""
+	global ROL, lider, termino, hilo_replicacion
+	log.warning("El nodo %s es líder en el término %s (este nodo lo era en el %s). Cediendo: este nodo pasa a seguidor.",
+		latido["lider"], latido["termino"], termino)
+	with lock:
+		es_principal.clear()
+		ROL = "respaldo"
+		coalescedor_posiciones.extraer()  # Posiciones que ya registra el nuevo líder
+	with lock_eleccion:
+		termino = max(termino, latido["termino"])
+		lider = NODOS[latido["lider"]]
+	with lock_replicacion:
+		# Lo publicado como líder no sirve para poner al día a otro seguidor
+		cambios_retenidos.clear()
+		envios_publicados.clear()
+		seguidores.clear()
+	while True:
+		try:
+			cola_replicacion.get_nowait()
+		except queue.Empty:
+			break
+	promocion["renuncias"] += 1
+	fin_seguimiento.clear()
+	hilo_replicacion = threading.Thread(target=recibir_estado_respaldo, daemon=True)
+	hilo_replicacion.start()
+	# Los taxis que seguían a este nodo adoptan al nuevo líder sin esperar a que falle un envío
+	threading.Thread(target=anunciar_principal, daemon=True).start()
+
+def iniciar_anuncios():
+	"""Abre el PUB de anuncios. Si el puerto está ocupado (otro servidor en la misma máquina) se reintenta al asumir."""
+	global socket_anuncios
+	socket = context.socket(zmq.PUB)
+	try:
+		socket.bind(f"tcp://*:{puerto_local(ANUNCIO_PORT)}")
+	except zmq.error.ZMQError as e:
+		log.warning("No se pudo abrir el puerto de anuncios %s: %s", puerto_local(ANUNCIO_PORT), e)
+		socket.close()
+		return
+	socket_anuncios = socket
+	log.info("Anuncios de cambio de principal en tcp://*:%s", puerto_local(ANUNCIO_PORT))
+
+def anunciar_principal():
+	"""Avisa a los taxis quién es el líder, para que lo adopten sin redescubrirlo.
+
+	Lo llama el nodo que asume y también el que cede ante otro líder. Cada
+	repetición anuncia al líder vigente en ese momento.
+	"""
+	try:
+		with lock_anuncios:
+			if socket_anuncios is None:
+				iniciar_anuncios()
+				if socket_anuncios is None:
+					return
+				time.sleep(INTERVALO_ANUNCIO)  # Dar tiempo a que los taxis se reconecten
+		for _ in range(REPETICIONES_ANUNCIO):
+			with lock_eleccion:
+				# Término e id identifican el anuncio: los taxis ignoran sus repeticiones y los de un líder anterior
+				anuncio = {"principal": lider.host, "nodo": lider.id, "termino": termino}
+			with lock_anuncios:
+				socket_anuncios.send_json(anuncio)
+			time.sleep(INTERVALO_ANUNCIO)
+		log.info("Principal %s anunciado a los taxis.", NODOS[anuncio["nodo"]])
+	except Exception as e:
+		log.error("Error en anunciar_principal: %s", e)
+
+# Funciones de Consultas de Solo Lectura
+def retraso_lectura():
+	"""Segundos de antigüedad del estado de este nodo: 0 en el principal, None si nunca se sincronizó.
+
+	En un respaldo es el tiempo desde el último instante en que, según el
+	principal, tenía aplicados todos sus cambios (cada lote o latido de
+	replicación lo renueva). Sin principal al que seguir, solo crece.
+	"""
+	if ROL == "principal":
+		return 0.0
+	enviado = replicacion["enviado_recibido"]
+	return time.time() - enviado if enviado is not None else None
+
+def resolver_consulta(consulta):
+	"""Resultado de una consulta de solo lectura sobre el estado local, o None si no se conoce."""
+	tipo = consulta.get("tipo")
+	if tipo == "taxis_libres":
+		with lock:
+			return len(taxis_registrados)
+	if tipo == "posiciones":
+		with lock:
+			if "taxi" in consulta:
+				return {consulta["taxi"]: taxis_registrados.get(consulta["taxi"])}
+			return dict(taxis_registrados)
+	if tipo == "historial":
+		limite = consulta.get("limite", 50)
+		encontrados = []
+		with lock:
+			# Del más reciente al más antiguo, solo entre los que están en memoria
+			for entrada in reversed(historial):
+				if len(encontrados) >= limite:
+					break
+				if "usuario" in consulta and entrada["usuario_id"] != consulta["usuario"]:
+					continue
+				if "taxi" in consulta and entrada["taxi_id"] != consulta["taxi"]:
+					continue
+				encontrados.append(entrada)
+		return encontrados
+	if tipo == "metricas":
+		with lock:
+			return {
+				"servicios_exitosos": metricas["servicios_exitosos"],
+				"servicios_rechazados": metricas["servicios_rechazados"],
+				"taxis_libres": len(taxis_registrados),
+				"registros_historial": registros_historial,
+				"secuencia": secuencia_wal
+			}
+	return None
+
+def atender_consultas():
+	"""Responde consultas de solo lectura con el estado local, en cualquier rol.
+
+	Cada consulta puede fijar "max_retraso_ms"; si el estado de este nodo es
+	más viejo, responde "desactualizado" y el cliente pregunta a otro nodo.
+	Así los tableros y análisis no pasan por el ciclo de solicitudes del
+	principal.
+	"""
+	socket = context.socket(zmq.REP)
+	socket.bind(f"tcp://*:{puerto_local(CONSULTA_PORT)}")
+	log.info("Atendiendo consultas de solo lectura en tcp://*:%s", puerto_local(CONSULTA_PORT))
+
+	while True:
+		try:
+			mensaje = socket.recv()
+		except Exception as e:
+			log.error("Error en atender_consultas: %s", e)
+			break
+		retraso = retraso_lectura()
+		respuesta = {"nodo": nodo_propio.id, "rol": ROL, "retraso_ms": round(retraso * 1000, 1) if retraso is not None else None}
+		try:
+			# Una consulta mal formada recibe un error; el hilo sigue atendiendo las demás
+			consulta = json.loads(mensaje)
+			log.debug("Consulta recibida: %s", consulta)
+			if not isinstance(consulta, dict):
+				raise ValueError("la consulta debe ser un objeto JSON")
+			if respuesta["retraso_ms"] is None or respuesta["retraso_ms"] > consulta.get("max_retraso_ms", MAX_RETRASO_LECTURA_MS):
+				respuesta["error"] = "desactualizado"
+				metricas_consultas["desactualizadas"] += 1
+			else:
+				resultado = resolver_consulta(consulta)
+				if resultado is None:
+					respuesta["error"] = "consulta desconocida"
+				else:
+					respuesta["resultado"] = resultado
+					metricas_consultas["respondidas"] += 1
+			datos = json.dumps(respuesta).encode()
+		except Exception as e:
+			log.warning("Consulta inválida: %s", e)
+			respuesta.pop("resultado", None)
+			respuesta["error"] = f"consulta inválida: {e}"
+			datos = json.dumps(respuesta).encode()
+		try:
+			socket.send(datos)
+		except Exception as e:
+			log.error("Error en atender_consultas: %s", e)
 			break
 
 # Funciones de Sincronización de Estado
 def sincronizar_estado_principal():
-	"""El principal envía el estado a los respaldos."""
-	print("Iniciando sincronización de estado como principal...", flush=True)
-	socket = context.socket(zmq.PUSH)
-	estado_sync_address = f"tcp://*:{ESTADO_SYNC_PORT}"
+	"""El principal publica a los respaldos cada cambio registrado, en orden y con su secuencia.
+
+	Los cambios que se acumulan mientras se envía salen juntos en el siguiente
+	mensaje y quedan retenidos para poner al día a un respaldo que se reconecte.
+	Sin cambios, se publica un latido con la secuencia publicada para que un
+	respaldo que perdió el último cambio lo note igual.
+	"""
+	log.info("Iniciando sincronización de estado como principal...")
+	socket = context.socket(zmq.PUB)
+	socket.setsockopt(zmq.SNDHWM, 100000)
+	estado_sync_address = f"tcp://*:{puerto_local(ESTADO_SYNC_PORT)}"
 	socket.bind(estado_sync_address)
-	print(f"Servidor principal enviando estado a {estado_sync_address}", flush=True)
+	log.info("Servidor principal publicando cambios en %s", estado_sync_address)
 
 	while True:
 		try:
-			estado = {"taxis": taxis_registrados, "solicitudes": solicitudes_usuarios}
-			print(f"Enviando estado sincronizado: {estado}", flush=True)
-			socket.send_json(estado)
-			time.sleep(2)  # Enviar cada 2 segundos
+			es_principal.wait()
+			try:
+				cambios = [cola_replicacion.get(timeout=INTERVALO_LATIDO_REPLICACION)]
+			except queue.Empty:
+				socket.send_json({"tipo": "latido", "seq": replicacion["secuencia_enviada"], "enviado": time.time()})
+				continue
+			while True:
+				try:
+					cambios.append(cola_replicacion.get_nowait())
+				except queue.Empty:
+					break
+			enviado = time.time()
+			# Retenidos antes de publicarlos: una puesta al día pedida justo después ya los incluye
+			with lock_replicacion:
+				cambios_retenidos.extend(cambios)
+				envios_publicados.append((cambios[-1]["seq"], enviado))
+				replicacion["secuencia_enviada"] = cambios[-1]["seq"]
+				replicacion["ultimo_envio"] = enviado
+				replicacion["cambios_enviados"] += len(cambios)
+			socket.send_json({"tipo": "cambios", "cambios": cambios, "enviado": enviado})
+			log.debug("Publicados %s cambios (hasta la secuencia %s).", len(cambios), cambios[-1]["seq"])
 		except Exception as e:
-			print(f"Error al sincronizar estado: {e}", flush=True)
+			log.error("Error al sincronizar estado: %s", e)
 			break
 
-def recibir_estado_respaldo():
-	"""El respaldo escucha y guarda el estado del principal."""
-	print("Iniciando recepción de estado como respaldo...", flush=True)
-	socket = context.socket(zmq.PULL)
-	
-	# Conectarse únicamente al principal
-	principal_ip = "10.43.100.133"  # Actualiza esto según tu configuración
-	estado_sync_address = f"tcp://{principal_ip}:{ESTADO_SYNC_PORT}"
-	try:
-		socket.connect(estado_sync_address)
-		print(f"Servidor respaldo conectado a {estado_sync_address} para recibir estado.", flush=True)
-	except zmq.error.ZMQError as e:
-		print(f"Error al conectar a {estado_sync_address} para recibir estado: {e}", flush=True)
-	
-	global taxis_registrados, solicitudes_usuarios
+def cambios_desde(secuencia, termino_seguidor):
+	"""Cambios retenidos posteriores a 'secuencia', o None si hace falta el estado completo.
+
+	Hace falta si ya no están todos o si el cambio 'secuencia' del respaldo es
+	de otro término que el retenido: su historia se separó de la del líder.
+	"""
+	with lock_replicacion:
+		if not cambios_retenidos:
+			return None
+		primera = cambios_retenidos[0]["seq"]
+		if not primera <= secuencia <= cambios_retenidos[-1]["seq"]:
+			return None
+		if cambios_retenidos[secuencia - primera].get("termino", 0) != termino_seguidor:
+			return None
+		return list(itertools.islice(cambios_retenidos, secuencia - primera + 1, None))
+
+def servir_seguidores():
+	"""Atiende a los respaldos: registra sus confirmaciones y los pone al día desde la secuencia que pidan."""
+	socket = context.socket(zmq.ROUTER)
+	socket.setsockopt(zmq.ROUTER_HANDOVER, 1)  # Un respaldo que recrea su socket conserva su identidad
+	socket.bind(f"tcp://*:{puerto_local(SEGUIDORES_PORT)}")
+	log.info("Atendiendo respaldos en tcp://*:%s", puerto_local(SEGUIDORES_PORT))
+	es_principal.wait()
 	while True:
 		try:
-			print("Esperando estado sincronizado desde el principal...", flush=True)
-			estado = socket.recv_json()
-			print(f"Estado recibido para sincronizar: {estado}", flush=True)
-			with lock:
-				taxis_registrados = estado.get("taxis", {})
-				solicitudes_usuarios = estado.get("solicitudes", [])
-				print(f"Taxis registrados actualizados: {taxis_registrados}", flush=True)
-				print(f"Solicitudes de usuarios actualizadas: {solicitudes_usuarios}", flush=True)
+			identidad, datos = socket.recv_multipart()
+			if not es_principal.is_set():
+				continue  # Cedió ante otro líder: el respaldo ya sigue al nuevo
+			mensaje = json.loads(datos)
+			seguidor = identidad.decode(errors="replace")
+			if mensaje["tipo"] == "confirmacion":
+				with lock_replicacion:
+					seguidores[seguidor] = {"seq": mensaje["seq"], "confirmado": time.time()}
+				continue
+			# "desde": el respaldo pide todo lo posterior a su última secuencia aplicada
+			cambios = cambios_desde(mensaje["seq"], mensaje["termino"])
+			if cambios is not None:
+				respuesta = {"tipo": "cambios", "cambios": cambios, "enviado": time.time()}
+				log.info("Respaldo %s puesto al día con %s cambios retenidos desde la secuencia %s.", seguidor, len(cambios), mensaje["seq"])
+			else:
+				with lock:
+					respuesta = {
+						"tipo": "estado",
+						"taxis": dict(taxis_registrados),
+						"solicitudes": list(solicitudes_usuarios),
+						"seq": secuencia_wal,
+						"termino": termino_wal,
+						"historial": list(historial),
+						"servicios": [metricas["servicios_exitosos"], metricas["servicios_rechazados"]],
+						"enviado": time.time()
+					}
+				log.info("Estado completo enviado al respaldo %s (secuencia %s, %s taxis).", seguidor, respuesta["seq"], len(respuesta["taxis"]))
+			socket.send_multipart([identidad, json.dumps(respuesta).encode()])
 		except Exception as e:
-			print(f"Error al recibir estado de respaldo: {e}", flush=True)
+			log.error("Error en servir_seguidores: %s", e)
 			break
 
+def retraso_seguidores(ahora):
+	"""{seguidor: (cambios, segundos)} sin confirmar por cada respaldo; olvida a los que no confirman hace SEGUIDOR_INACTIVO."""
+	resultado = {}
+	with lock_replicacion:
+		publicada = replicacion["secuencia_enviada"]
+		for seguidor, estado in list(seguidores.items()):
+			if ahora - estado["confirmado"] > SEGUIDOR_INACTIVO:
+				del seguidores[seguidor]
+				continue
+			segundos = 0
+			# Antigüedad del envío más viejo que el respaldo aún no confirma
+			for secuencia, enviado in reversed(envios_publicados):
+				if secuencia <= estado["seq"]:
+					break
+				segundos = ahora - enviado
+			resultado[seguidor] = (max(publicada - estado["seq"], 0), segundos)
+	return resultado
+
+def instalar_estado_replicado(estado):
+	"""Reemplaza el estado del respaldo por el estado completo del principal. Devuelve su secuencia."""
+	global taxis_registrados, solicitudes_usuarios, secuencia_wal, termino_wal
+	with lock:
+		if ROL != "respaldo":
+			return secuencia_wal
+		taxis_registrados = {id_taxi: tuple(posicion) for id_taxi, posicion in estado["taxis"].items()}
+		solicitudes_usuarios = estado["solicitudes"]
+		secuencia_wal = estado["seq"]
+		termino_wal = estado["termino"]
+		motor_taxis.reconstruir(taxis_registrados)
+		# Solo en memoria: la cola del historial para las consultas y para asumir sin recargarla
+		historial.clear()
+		historial.extend(estado.get("historial", []))
+		metricas["servicios_exitosos"], metricas["servicios_rechazados"] = estado.get("servicios", (0, 0))
+		replicacion["secuencia_recibida"] = estado["seq"]
+		replicacion["enviado_recibido"] = estado["enviado"]
+		replicacion["resincronizaciones"] += 1
+		tomar_instantanea()  # El WAL local continúa desde este estado
+	log.info("Estado completo recibido del principal (secuencia %s, %s taxis).", estado["seq"], len(estado["taxis"]))
+	return estado["seq"]
+
+def aplicar_cambios_replicados(cambios, ultima):
+	"""Aplica en orden los cambios posteriores a 'ultima'. Devuelve (última aplicada, False si quedó un hueco)."""
+	with lock:
+		if ROL != "respaldo":
+			return ultima, True  # Ya promovido: sus propios cambios continúan la secuencia
+		for cambio in cambios:
+			if cambio["seq"] <= ultima:
+				continue  # Ya aplicado (por el estado completo o una puesta al día)
+			if cambio["seq"] != ultima + 1:
+				log.warning("Hueco en la replicación: llegó el cambio %s y se esperaba el %s.", cambio["seq"], ultima + 1)
+				return ultima, False
+			aplicar_cambio_replicado(cambio)
+			ultima = cambio["seq"]
+			replicacion["cambios_aplicados"] += 1
+		replicacion["secuencia_recibida"] = ultima
+	return ultima, True
+
+def crear_socket_seguidor(direccion):
+	socket = context.socket(zmq.DEALER)
+	socket.setsockopt(zmq.IDENTITY, f"nodo{nodo_propio.id}".encode())
+	socket.setsockopt(zmq.LINGER, 0)
+	socket.connect(direccion)
+	return socket
+
+def recibir_estado_respaldo():
+	"""El respaldo aplica el flujo de cambios del principal, confirma lo aplicado y se pone al día si falta algo.
+
+	Al conectarse a un líder (al arrancar o cuando se elige otro) pide los
+	cambios posteriores a su propia secuencia (la del estado y WAL cargados de
+	disco); el líder responde con sus cambios retenidos o, si ya no los tiene o
+	el último cambio propio es de otra historia, con el estado completo. Lo que
+	llega por el flujo mientras espera esa respuesta se aplica después. Si algo
+	falla (un mensaje mal formado, la persistencia que rechaza un cambio), se
+	reconecta y pide de nuevo lo posterior al último cambio aplicado.
+	"""
+	log.info("Iniciando recepción de estado como respaldo...")
+	socket = principal = None
+	poller = zmq.Poller()
+	seguido = None       # Líder al que están conectados los sockets
+
+	ultima = secuencia_wal
+	faltan = True        # Hay que pedir al principal lo posterior a 'ultima'
+	esperando = None     # Momento en que se pidió, mientras no llega la respuesta
+	en_espera = []       # Mensajes del flujo recibidos mientras tanto
+	while True:
+		try:
+			if seguido is None or lider is not seguido:
+				if fin_seguimiento.is_set():
+					log.info("Replicación detenida en la secuencia %s: este servidor asume como principal.", ultima)
+					break
+				if lider is None:
+					time.sleep(0.05)  # Todavía no se conoce al líder
+					continue
+				if socket is not None:
+					for anterior in (socket, principal):
+						poller.unregister(anterior)
+						anterior.close()
+				seguido = lider
+				socket = context.socket(zmq.SUB)
+				socket.setsockopt(zmq.RCVHWM, 100000)
+				socket.setsockopt_string(zmq.SUBSCRIBE, "")
+				socket.connect(cluster.direccion(seguido, ESTADO_SYNC_PORT))
+				principal = crear_socket_seguidor(cluster.direccion(seguido, SEGUIDORES_PORT))
+				poller.register(socket, zmq.POLLIN)
+				poller.register(principal, zmq.POLLIN)
+				faltan, esperando, en_espera = True, None, []
+				log.info("Servidor respaldo conectado a %s para recibir cambios.", seguido)
+			if esperando is not None and time.time() - esperando > TIMEOUT_PUESTA_AL_DIA_MS / 1000:
+				log.warning("El principal no respondió la puesta al día en %s ms. Reintentando...", TIMEOUT_PUESTA_AL_DIA_MS)
+				poller.unregister(principal)
+				principal.close()
+				principal = crear_socket_seguidor(cluster.direccion(seguido, SEGUIDORES_PORT))
+				poller.register(principal, zmq.POLLIN)
+				esperando, faltan = None, True
+			if faltan and esperando is None:
+				principal.send_json({"tipo": "desde", "seq": ultima, "termino": termino_wal})
+				esperando, faltan = time.time(), False
+
+			eventos = dict(poller.poll(0 if fin_seguimiento.is_set() else ESPERA_REPLICACION_MS))
+			if fin_seguimiento.is_set() and not eventos:
+				log.info("Replicación detenida en la secuencia %s: este servidor asume como principal.", ultima)
+				break
+			mensajes = []
+			if principal in eventos:
+				respuesta = principal.recv_json()
+				if respuesta["tipo"] == "estado":
+					ultima = instalar_estado_replicado(respuesta)
+				else:
+					ultima, _ = aplicar_cambios_replicados(respuesta["cambios"], ultima)
+					replicacion["puestas_al_dia"] += 1
+					log.info("Puesto al día con %s cambios retenidos (secuencia %s).", len(respuesta["cambios"]), ultima)
+				esperando = None
+				mensajes, en_espera = en_espera, []
+			if socket in eventos:
+				mensajes.append(socket.recv_json())
+
+			for mensaje in mensajes:
+				if faltan or esperando is not None:
+					en_espera.append(mensaje)
+					continue
+				if mensaje["tipo"] == "latido":
+					replicacion["secuencia_principal"] = mensaje["seq"]
+					if mensaje["seq"] > ultima:
+						log.warning("Faltan cambios hasta la secuencia %s (última aplicada %s).", mensaje["seq"], ultima)
+						faltan = True
+						continue
+					if mensaje["seq"] == ultima:
+						replicacion["enviado_recibido"] = mensaje["enviado"]  # Al día en ese instante
+				else:
+					replicacion["secuencia_principal"] = mensaje["cambios"][-1]["seq"]
+					ultima, completo = aplicar_cambios_replicados(mensaje["cambios"], ultima)
+					if not completo:
+						faltan = True
+						continue
+					replicacion["enviado_recibido"] = mensaje["enviado"]
+				principal.send_json({"tipo": "confirmacion", "seq": ultima})
+			log.debug("Cambios aplicados hasta la secuencia %s.", ultima)
+		except Exception as e:
+			# secuencia_wal avanza con cada cambio aplicado, aunque el error corte el lote a la mitad
+			ultima = max(ultima, secuencia_wal)
+			log.error("Error al recibir estado de respaldo: %s. Se vuelve a sincronizar desde la secuencia %s.", e, ultima)
+			seguido = None  # Sockets nuevos y una nueva puesta al día con el líder
+			time.sleep(INTERVALO_LATIDO)  # Sin reintentos seguidos si el error se repite
 
 
 # Funciones de Health-Check
-def health_check_respaldo():
-	print("Iniciando health-check como respaldo...", flush=True)
-	socket = context.socket(zmq.REQ)
-	socket.setsockopt(zmq.RCVTIMEO, 2000)  # Timeout de 2 segundos
-	
-	# Conectarse al HEALTH_CHECK_PORT de todos los servidores conocidos excepto a sí mismo
-	for server in SERVERS:
-		if server == SERVER_IP:
+def vigilar_lider():
+	"""Escucha los latidos del líder; si faltan LATIDOS_PERDIDOS seguidos, convoca una elección.
+
+	Los latidos llegan por SUB: no hay un estado de petición-respuesta que un
+	mensaje perdido pueda trabar, y un latido perdido solo acerca el plazo.
+	Después de asumir, sigue escuchando por si otro nodo le gana el liderazgo
+	(ver cede_ante); en ese caso cede y vuelve a vigilar como seguidor. Un
+	error en una vuelta se registra y la vigilancia continúa.
+	"""
+	log.info("Iniciando health-check como respaldo...")
+	socket = context.socket(zmq.SUB)
+	socket.setsockopt_string(zmq.SUBSCRIBE, "")
+
+	# Conectarse al HEALTH_CHECK_PORT de todos los nodos excepto a sí mismo
+	for nodo in NODOS:
+		if nodo is nodo_propio:
 			continue  # No intentar conectarse a sí mismo
-		health_check_address = f"tcp://{server}:{HEALTH_CHECK_PORT}"
+		health_check_address = cluster.direccion(nodo, HEALTH_CHECK_PORT)
 		try:
 			socket.connect(health_check_address)
-			print(f"Servidor respaldo conectado a {health_check_address} para health-check.", flush=True)
+			log.info("Servidor respaldo conectado a %s para health-check.", health_check_address)
 		except zmq.error.ZMQError as e:
-			print(f"Error al conectar a {health_check_address} para health-check: {e}", flush=True)
-	
+			log.error("Error al conectar a %s para health-check: %s", health_check_address, e)
+
+	plazo = INTERVALO_LATIDO * LATIDOS_PERDIDOS
+	# Cada nodo espera un plazo más que el anterior para no postularse todos a la vez (el de mayor id primero)
+	escalon = plazo * (len(NODOS) - 1 - nodo_propio.id)
+	ultimo = time.perf_counter()
+	espera_desde = ultimo + GRACIA_PRIMER_LATIDO  # Mientras se establece la conexión
 	while True:
 		try:
-			print("Enviando 'ping' al servidor principal...", flush=True)
-			socket.send_string("ping")
-			print("Esperando respuesta 'pong' del principal...", flush=True)
-			respuesta = socket.recv_string()
-			print(f"Respuesta de health-check recibida: {respuesta}", flush=True)
-			if respuesta.strip().lower() != "pong":
-				print("Respuesta inesperada del servidor principal.", flush=True)
-				raise Exception("Respuesta inesperada en health-check.")
+			if ultimo_voto is not None:
+				# Quien acaba de votar le da al candidato tiempo de asumir y mandar su primer latido
+				espera_desde = max(espera_desde, ultimo_voto + GRACIA_PRIMER_LATIDO)
+			restante = espera_desde + plazo + escalon - time.perf_counter()
+			if ROL == "principal" or (restante > 0 and socket.poll(restante * 1000)):
+				if ROL == "principal":
+					if socket.poll(1000):
+						latido = socket.recv_json()
+						if cede_ante(latido):
+							renunciar(latido)
+							ultimo = espera_desde = time.perf_counter()
+					continue
+				latido = socket.recv_json()
+				if not seguir_latido(latido):
+					continue
+				ultimo = espera_desde = time.perf_counter()
+				promocion["latidos_recibidos"] += 1
+				promocion["ultimo_latido"] = time.time()
+				promocion["retraso_latido_ms"] = (promocion["ultimo_latido"] - latido["enviado"]) * 1000
+				continue
+			if ultimo_voto is not None and ultimo_voto + GRACIA_PRIMER_LATIDO > espera_desde:
+				continue  # Votó mientras esperaba: recalcular el plazo
+			if puertos_no_disponibles:
+				espera_desde = time.perf_counter()  # Sin sus puertos no puede asumir: solo sigue al que se elija
+				continue
+			log.warning("Sin latidos del líder en %.0f ms (%s latidos). Convocando elección...", (plazo + escalon) * 1000, LATIDOS_PERDIDOS)
+			traza = Traza("promocion")
+			traza.inicio = traza.marca = ultimo
+			traza.tramo("deteccion")
+			if convocar_eleccion():
+				traza.tramo("eleccion")
+				promover_a_principal(traza)
 			else:
-				print("Health-check exitoso. El principal está activo.", flush=True)
-		except zmq.error.Again as e:
-			print(f"Timeout o error en health-check: {e}", flush=True)
-			print("El servidor principal ha fallado. Asumiendo control como principal.", flush=True)
-			# Actualizar el rol antes de iniciar funciones principales
-			global ROL
-			ROL = "principal"
-			print(f"Nuevo rol asignado: {ROL}", flush=True)
-			iniciar_como_principal()
-			break
+				espera_desde = time.perf_counter()  # Esperar otro plazo a que el ganador se anuncie
 		except Exception as e:
-			print(f"Error en health_check_respaldo: {e}", flush=True)
-			print("Asumiendo rol principal debido a un error en health-check.", flush=True)
-			ROL = "principal"
-			print(f"Nuevo rol asignado: {ROL}", flush=True)
-			iniciar_como_principal()
-			break
-		time.sleep(2)
+			# Un latido mal formado o una elección fallida no terminan la vigilancia. El plazo no se
+			# reinicia: mensajes inválidos seguidos no deben ocultar la caída del líder
+			log.error("Error en vigilar_lider: %s", e)
+			time.sleep(INTERVALO_LATIDO)
 
+def promover_a_principal(traza):
+	"""Asume el rol principal y completa 'traza', que parte del último latido recibido."""
+	global ROL, lider
+	# Aplicar lo que el principal alcanzó a publicar antes de caer
+	fin_seguimiento.set()
+	if hilo_replicacion is not None:
+		hilo_replicacion.join(timeout=1.0)
+	traza.tramo("drenar_replicacion")
+	with lock:
+		ROL = "principal"
+		lider = nodo_propio
+	log.info("Nuevo rol asignado: %s (término %s)", ROL, termino)
+	iniciar_como_principal(traza)
+	if promocion["ultimo_latido"] is None:
+		log.info("Elegido líder al arrancar, sin un líder previo (%.1f ms).", traza.total() * 1000)
+		return
+	tramos.registrar(traza)
+	etapas = {etapa: duracion * 1000 for etapa, duracion in traza.tramos}
+	promocion["etapas_ms"] = etapas
+	promocion["deteccion_ms"] = etapas["deteccion"]
+	promocion["promocion_ms"] = (traza.total() - etapas["deteccion"] / 1000) * 1000
+	promocion["failover_ms"] = traza.total() * 1000
+	promocion["promovido"] = time.time()
+	log.info("Failover en %.1f ms desde el último latido: detección %.1f ms, promoción %.1f ms (%s).",
+		promocion["failover_ms"], promocion["deteccion_ms"], promocion["promocion_ms"],
+		", ".join(f"{etapa} {duracion:.1f} ms" for etapa, duracion in etapas.items()))
 
-def responder_health_check():
-	"""El principal responde al health-check del respaldo."""
-	print("Iniciando respuesta a health-check como principal...", flush=True)
-	socket = context.socket(zmq.REP)
-	socket.bind(f"tcp://*:{HEALTH_CHECK_PORT}")
-	print(f"Servidor principal escuchando health-check en tcp://*:{HEALTH_CHECK_PORT}", flush=True)
 
+def publicar_latidos():
+	"""El principal publica un latido, con su término, cada INTERVALO_LATIDO segundos."""
+	log.info("Iniciando latidos como principal...")
+	socket = context.socket(zmq.PUB)
+	socket.setsockopt(zmq.SNDHWM, 10)  # Un latido viejo no sirve de nada
+	socket.bind(f"tcp://*:{puerto_local(HEALTH_CHECK_PORT)}")
+	log.info("Servidor principal publicando latidos en tcp://*:%s cada %s ms", puerto_local(HEALTH_CHECK_PORT), INTERVALO_LATIDO * 1000)
+
+	numero = 0
+	siguiente = time.perf_counter()
 	while True:
 		try:
-			print("Esperando 'ping' para health-check...", flush=True)
-			mensaje = socket.recv_string()
-			print(f"Mensaje de health-check recibido: {mensaje}", flush=True)
-			if mensaje.strip().lower() == "ping":
-				print("Enviando respuesta 'pong' al health-check.", flush=True)
-				socket.send_string("pong")
-			else:
-				print("Mensaje desconocido en health-check. Enviando 'pong' de todas formas.", flush=True)
-				socket.send_string("pong")
+			if not es_principal.is_set():
+				es_principal.wait()  # Al arrancar o tras ceder ante otro líder
+				siguiente = time.perf_counter()
+			numero += 1
+			socket.send_json({"n": numero, "enviado": time.time(), "termino": termino, "lider": nodo_propio.id})
+			# Intervalo fijo aunque el envío se demore, para que el plazo del respaldo sea predecible
+			siguiente += INTERVALO_LATIDO
+			time.sleep(max(siguiente - time.perf_counter(), 0))
 		except Exception as e:
-			print(f"Error en responder_health_check: {e}", flush=True)
+			log.error("Error en publicar_latidos: %s", e)
 			break
 
 # Funciones de Manejo de Posiciones y Solicitudes
 def recibir_posiciones():
 	"""Recibe las posiciones actualizadas de los taxis."""
-	print("Iniciando recepción de posiciones de taxis...", flush=True)
+	log.info("Iniciando recepción de posiciones de taxis...")
 	socket = context.socket(zmq.PULL)  # Cambiado de SUB a PULL
-	socket.bind(f"tcp://*:{TAXI_POSITION_PORT}")
-	print(f"Escuchando posiciones de taxis en tcp://*:{TAXI_POSITION_PORT}", flush=True)
+	socket.bind(f"tcp://*:{puerto_local(TAXI_POSITION_PORT)}")
+	log.info("Escuchando posiciones de taxis en tcp://*:%s", puerto_local(TAXI_POSITION_PORT))
+	es_principal.wait()
 
 	while True:
 		try:
-			print("Esperando mensaje de posición de taxi...", flush=True)
+			log.debug("Esperando mensaje de posición de taxi...")
+			socket.poll()  # La traza empieza cuando hay un mensaje listo, no mientras se espera
+			traza = Traza("posicion")
 			mensaje = socket.recv_string()
-			print(f"Mensaje de posición recibido: {mensaje}", flush=True)
-			id_taxi, posicion = mensaje.split(":")
-			posicion = tuple(map(int, posicion.strip("()").split(",")))
-			print(f"Taxi ID: {id_taxi}, Nueva posición: {posicion}", flush=True)
+			traza.tramo("recibir")
+			if not es_principal.is_set():
+				continue  # Cedió ante otro líder: el taxi pasará al nuevo con su anuncio
+			log.debug("Mensaje de posición recibido: %s", mensaje)
+			# Los taxis anteriores envían solo "id:(x,y)"; los actuales agregan ":(ocupado,libre)"
+			partes = mensaje.split(":")
+			if len(partes) not in (2, 3):
+				raise ValueError(f"formato inesperado: {mensaje!r}")
+			id_taxi = partes[0]
+			posicion = tuple(map(int, partes[1].strip("()").split(",")))
+			if len(partes) == 3:
+				tiempo_ocupado, tiempo_libre = map(float, partes[2].strip("()").split(","))
+				utilizacion_flota.actualizar(id_taxi, tiempo_ocupado, tiempo_libre)
+			traza.tramo("decodificar")
+			log.debug("Taxi ID: %s, Nueva posición: %s", id_taxi, posicion)
+			if FRAGMENTOS > 1:
+				# Los procesos de las regiones tienen sus propios candados: el envío no toma el lock global
+				motor_taxis.actualizar(id_taxi, posicion)
+				traza.tramo("indice")
 
 			with lock:
+				traza.tramo("espera_lock")
 				taxis_registrados[id_taxi] = posicion
-				print(f"Taxis registrados actualizados: {taxis_registrados}", flush=True)
-				guardar_estado()
+				if FRAGMENTOS == 1:
+					motor_taxis.actualizar(id_taxi, posicion)
+					traza.tramo("indice")
+				log.debug("Taxis registrados actualizados: %s", taxis_registrados)
+				# Solo se marca como pendiente: el WAL recibe la última posición en el próximo volcado
+				if coalescedor_posiciones.marcar(id_taxi, posicion):
+					volcar_posiciones()
+			traza.tramo("persistencia")
+			tramos.registrar(traza)
 
-			print(f"Posición actualizada - Taxi {id_taxi}: {posicion}", flush=True)
+			log.debug("Posición actualizada - Taxi %s: %s", id_taxi, posicion)
 		except ValueError as ve:
-			print(f"Error al procesar el mensaje de posición: {ve}", flush=True)
+			log.warning("Error al procesar el mensaje de posición: %s", ve)
+		except RuntimeError as re:
+			# La persistencia rechazó el volcado: la próxima posición lo intenta de nuevo
+			log.error("Error al persistir posiciones: %s", re)
 		except Exception as e:
-			print(f"Error en recibir_posiciones: {e}", flush=True)
+			log.error("Error en recibir_posiciones: %s", e)
 			break
 
+def procesar_solicitud(mensaje, traza=None):
+	"""Decodifica una solicitud de usuario, le asigna el taxi más cercano y devuelve la respuesta.
+
+	Si se pasa una traza, se le agregan los tramos decodificar, espera_lock,
+	emparejamiento y persistencia; quien llama registra el resto y la traza.
+	"""
+	traza = traza or Traza("solicitud")
+	try:
+		log.debug("Mensaje de solicitud recibido: %s", mensaje)
+		solicitud = json.loads(mensaje)
+		log.debug("Solicitud procesada: %s", solicitud)
+
+		id_usuario = solicitud["id_usuario"]
+		x_usuario, y_usuario = solicitud["x"], solicitud["y"]
+
+		log.debug("Solicitud recibida - Usuario %s: (%s, %s)", id_usuario, x_usuario, y_usuario)
+
+		# Inicia el cronómetro para medir el tiempo de respuesta
+		tiempo_inicio = time.time()
+		traza.tramo("decodificar")
+
+		# Con fragmentos, la búsqueda y el reclamo van a los procesos de las regiones, que tienen sus
+		# propios candados: el lock global solo cubre el registro del resultado
+		fragmentado = FRAGMENTOS > 1
+		if fragmentado:
+			taxi_asignado, distancia_minima = motor_taxis.asignar(x_usuario, y_usuario)
+			traza.tramo("emparejamiento")
+
+		with lock:
+			traza.tramo("espera_lock")
+			if not fragmentado and not taxis_registrados:
+				log.debug("No hay taxis disponibles para asignar al Usuario %s.", id_usuario)
+				# No hay taxis disponibles
+				respuesta = {"status": "rechazado", "mensaje": "No hay taxis disponibles."}
+				guardar_historial(id_usuario, None, "rechazado", x_usuario, y_usuario)
+				# Actualizar métricas
+				metricas["servicios_rechazados"] += 1
+				registrar_despacho(tiempo_inicio)
+				log.debug("Incrementando servicios rechazados: %s", metricas['servicios_rechazados'])
+				tiempo_respuesta = time.time() - tiempo_inicio
+				metricas["tiempos_respuesta"].registrar(tiempo_respuesta)
+				escritura = guardar_metricas()
+				log.debug("Métricas actualizadas: %s", metricas)
+			else:
+				if not fragmentado:
+					log.debug("Buscando el taxi más cercano disponible para Usuario %s...", id_usuario)
+					# Buscar el taxi más cercano con el motor de emparejamiento configurado
+					taxi_asignado, distancia_minima = motor_taxis.asignar(x_usuario, y_usuario)
+					traza.tramo("emparejamiento")
+
+				if taxi_asignado:
+					# Asignar taxi
+					log.debug("Asignando Taxi %s al Usuario %s. Distancia: %s", taxi_asignado, id_usuario, distancia_minima)
+					respuesta = {"status": "asignado", "taxi_id": taxi_asignado}
+					# La eliminación va primero al WAL: si la persistencia la rechaza, el motor ya
+					# reclamó el taxi y hay que devolverlo antes de responder con el error interno
+					try:
+						registrar_cambio("eliminar", id=taxi_asignado)
+					except RuntimeError:
+						devolver_taxi(taxi_asignado)
+						raise
+					# Con fragmentos, una posición del taxi pudo llegar mientras se reclamaba
+					taxis_registrados.pop(taxi_asignado, None)
+					log.debug("Taxi %s eliminado de taxis_registrados. Taxis restantes: %s", taxi_asignado, taxis_registrados)
+					guardar_historial(id_usuario, taxi_asignado, "exitoso", x_usuario, y_usuario)
+					# Actualizar métricas
+					metricas["servicios_exitosos"] += 1
+					registrar_despacho(tiempo_inicio, distancia_minima)
+					log.debug("Incrementando servicios exitosos: %s", metricas['servicios_exitosos'])
+					tiempo_respuesta = time.time() - tiempo_inicio
+					metricas["tiempos_respuesta"].registrar(tiempo_respuesta)
+					escritura = guardar_metricas()
+					log.debug("Métricas actualizadas: %s", metricas)
+				else:
+					# No se pudo asignar taxi (Este bloque puede no ser necesario)
+					log.debug("No se pudo asignar ningún taxi para el Usuario %s.", id_usuario)
+					respuesta = {"status": "rechazado", "mensaje": "No hay taxis disponibles."}
+					guardar_historial(id_usuario, None, "rechazado", x_usuario, y_usuario)
+					# Actualizar métricas
+					metricas["servicios_rechazados"] += 1
+					registrar_despacho(tiempo_inicio)
+					log.debug("Incrementando servicios rechazados: %s", metricas['servicios_rechazados'])
+					tiempo_respuesta = time.time() - tiempo_inicio
+					metricas["tiempos_respuesta"].registrar(tiempo_respuesta)
+					escritura = guardar_metricas()
+					log.debug("Métricas actualizadas: %s", metricas)
+
+		# En modo estricto no se responde hasta que el registro esté en disco
+		persistencia.esperar(escritura)
+		traza.tramo("persistencia")
+		log.debug("Enviando respuesta al Usuario %s: %s", id_usuario, respuesta)
+		return respuesta
+	except json.JSONDecodeError as je:
+		log.warning("Error al decodificar la solicitud JSON: %s", je)
+		return {"status": "error", "mensaje": "Solicitud JSON inválida."}
+	except Exception as e:
+		log.error("Error en procesar_solicitud: %s", e)
+		return {"status": "error", "mensaje": "Error interno del servidor."}
+
+def trabajador_solicitudes(indice):
+	"""Atiende solicitudes de la cola y devuelve las respuestas al frente ROUTER."""
+	socket = context.socket(zmq.PUSH)
+	socket.connect(RESPUESTAS_SOLICITUDES)
+	log.info("Trabajador de solicitudes %s listo.", indice)
+	while True:
+		identidad, mensaje = cola_solicitudes.get()
+		if not es_principal.is_set():
+			# Encolada antes de ceder ante otro líder: el usuario prueba el siguiente nodo
+			socket.send_multipart([identidad, RESPUESTA_NO_PRINCIPAL])
+			continue
+		try:
+			traza = trazas_pendientes.get(identidad)
+			traza.tramo("cola")
+			respuesta = procesar_solicitud(mensaje.decode("utf-8", errors="replace"), traza)
+			datos = json.dumps(respuesta).encode()
+			traza.tramo("codificar")
+		except Exception as e:
+			# El trabajador sigue atendiendo: si terminara, el grupo se achicaría sin aviso
+			log.error("Error en trabajador_solicitudes %s: %s", indice, e)
+			datos = json.dumps({"status": "error", "mensaje": "Error interno del servidor."}).encode()
+		socket.send_multipart([identidad, datos])
+
 def recibir_solicitudes():
-	"""Recibe solicitudes de usuarios y asigna taxis."""
-	print("Iniciando recepción de solicitudes de usuarios...", flush=True)
-	socket = context.socket(zmq.REP)
-	socket.bind(f"tcp://*:{USER_REQUEST_PORT}")
-	print(f"Escuchando solicitudes de usuarios en tcp://*:{USER_REQUEST_PORT}", flush=True)
+	"""Recibe solicitudes de usuarios en un ROUTER y las reparte entre los hilos trabajadores.
+
+	El ROUTER permite tener muchas solicitudes REQ pendientes a la vez: cada una se
+	encola con la identidad del usuario y la respuesta vuelve por esa identidad en
+	cuanto un trabajador la termina, sin esperar a las demás.
+
+	En un respaldo el ROUTER ya está abierto, pero cada solicitud se rechaza al
+	llegar: si quedara retenida hasta asumir, se despacharía para un usuario que
+	ya se cansó de esperar y probó otro nodo.
+	"""
+	log.info("Iniciando recepción de solicitudes de usuarios...")
+	socket = context.socket(zmq.ROUTER)
+	socket.bind(f"tcp://*:{puerto_local(USER_REQUEST_PORT)}")
+	log.info("Escuchando solicitudes de usuarios en tcp://*:%s", puerto_local(USER_REQUEST_PORT))
 
+	# Los sockets de ZeroMQ no se comparten entre hilos: las respuestas regresan por inproc
+	respuestas = context.socket(zmq.PULL)
+	respuestas.bind(RESPUESTAS_SOLICITUDES)
+	for indice in range(HILOS_SOLICITUDES):
+		threading.Thread(target=trabajador_solicitudes, args=(indice,), daemon=True).start()
+	log.info("%s hilos trabajadores atendiendo solicitudes.", HILOS_SOLICITUDES)
+
+	poller = zmq.Poller()
+	poller.register(socket, zmq.POLLIN)
+	poller.register(respuestas, zmq.POLLIN)
+	while True:
+		try:
+			eventos = dict(poller.poll())
+			if socket in eventos:
+				traza = Traza("solicitud")
+				identidad, _, mensaje = socket.recv_multipart()
+				traza.tramo("recibir")
+				if not es_principal.is_set():
+					socket.send_multipart([identidad, b"", RESPUESTA_NO_PRINCIPAL])
+					continue
+				trazas_pendientes[identidad] = traza
+				cola_solicitudes.put((identidad, mensaje))
+			if respuestas in eventos:
+				identidad, respuesta = respuestas.recv_multipart()
+				socket.send_multipart([identidad, b"", respuesta])
+				# "enviar" incluye el paso por inproc desde el trabajador
+				traza = trazas_pendientes.pop(identidad)
+				traza.tramo("enviar")
+				tramos.registrar(traza)
+		except ValueError as ve:
+			log.warning("Mensaje con formato inesperado en el frente de solicitudes: %s", ve)
+		except Exception as e:
+			log.error("Error en recibir_solicitudes: %s", e)
+
+def trabajador_broker(indice):
+	"""Trabajador del broker: socket REP conectado al backend DEALER del proxy."""
+	socket = context.socket(zmq.REP)
+	socket.connect(TRABAJADORES_BROKER)
+	estadisticas = {"atendidas": 0, "en_curso": 0, "tiempo_servicio_total": 0.0, "tiempo_servicio_max": 0.0}
+	estadisticas_trabajadores[indice] = estadisticas
+	log.info("Trabajador %s del broker conectado a %s", indice, TRABAJADORES_BROKER)
 	while True:
 		try:
-			print("Esperando solicitud de usuario...", flush=True)
 			mensaje = socket.recv_string()
-			print(f"Mensaje de solicitud recibido: {mensaje}", flush=True)
-			solicitud = json.loads(mensaje)
-			print(f"Solicitud procesada: {solicitud}", flush=True)
+			if not es_principal.is_set():
+				# El proxy sigue corriendo después de ceder ante otro líder: se rechaza aquí
+				socket.send(RESPUESTA_NO_PRINCIPAL)
+				continue
+			estadisticas["en_curso"] = 1
+			inicio = time.time()
+			# Detrás del proxy no se ve la recepción: la traza empieza en el trabajador
+			traza = Traza("solicitud")
+			respuesta = procesar_solicitud(mensaje, traza)
+			datos = json.dumps(respuesta)
+			traza.tramo("codificar")
+			socket.send_string(datos)
+			traza.tramo("enviar")
+			tramos.registrar(traza)
+			tiempo_servicio = time.time() - inicio
+			estadisticas["atendidas"] += 1
+			estadisticas["tiempo_servicio_total"] += tiempo_servicio
+			estadisticas["tiempo_servicio_max"] = max(estadisticas["tiempo_servicio_max"], tiempo_servicio)
+			estadisticas["en_curso"] = 0
+		except Exception as e:
+			log.error("Error en trabajador_broker %s: %s", indice, e)
+			break
 
-			id_usuario = solicitud["id_usuario"]
-			x_usuario, y_usuario = solicitud["x"], solicitud["y"]
+def contar_mensajes_broker():
+	"""Lee la captura del proxy para saber cuántas solicitudes entraron y cuántas respuestas salieron."""
+	socket = context.socket(zmq.PULL)
+	socket.connect(CAPTURA_BROKER)
+	while True:
+		try:
+			partes = socket.recv_multipart()
+			# Todas las respuestas de procesar_solicitud empiezan con la clave "status"
+			if partes[-1].startswith(b'{"status"'):
+				mensajes_broker["respuestas"] += 1
+			else:
+				mensajes_broker["solicitudes"] += 1
+		except Exception as e:
+			log.error("Error en contar_mensajes_broker: %s", e)
+			break
 
-			print(f"Solicitud recibida - Usuario {id_usuario}: ({x_usuario}, {y_usuario})", flush=True)
+def estadisticas_broker():
+	"""Profundidad de cola y tiempos de servicio del broker y de cada trabajador."""
+	trabajadores = {}
+	en_curso = 0
+	for indice, estadisticas in sorted(estadisticas_trabajadores.items()):
+		atendidas = estadisticas["atendidas"]
+		en_curso += estadisticas["en_curso"]
+		trabajadores[str(indice)] = {
+			"atendidas": atendidas,
+			"en_curso": estadisticas["en_curso"],
+			"tiempo_servicio_medio": estadisticas["tiempo_servicio_total"] / atendidas if atendidas else 0,
+			"tiempo_servicio_max": estadisticas["tiempo_servicio_max"]
+		}
+	# Lo que entró al proxy y no ha salido ni está en manos de un trabajador sigue en cola.
+	# Detrás del DEALER no se ve en qué trabajador espera cada solicitud, solo el total.
+	en_cola = max(mensajes_broker["solicitudes"] - mensajes_broker["respuestas"] - en_curso, 0)
+	return {"en_cola": en_cola, "en_curso": en_curso, "trabajadores": trabajadores}
 
-			# Inicia el cronómetro para medir el tiempo de respuesta
-			tiempo_inicio = time.time()
+def broker_solicitudes():
+	"""Broker ROUTER/DEALER: zmq.proxy reparte las solicitudes entre HILOS_SOLICITUDES trabajadores."""
+	log.info("Iniciando broker de solicitudes de usuarios...")
+	frontend = context.socket(zmq.ROUTER)
+	frontend.bind(f"tcp://*:{puerto_local(USER_REQUEST_PORT)}")
+	backend = context.socket(zmq.DEALER)
+	backend.bind(TRABAJADORES_BROKER)
+	captura = context.socket(zmq.PUSH)
+	captura.bind(CAPTURA_BROKER)
+	log.info("Broker escuchando solicitudes en tcp://*:%s con %s trabajadores", puerto_local(USER_REQUEST_PORT), HILOS_SOLICITUDES)
 
-			with lock:
-				if not taxis_registrados:
-					print(f"No hay taxis disponibles para asignar al Usuario {id_usuario}.", flush=True)
-					# No hay taxis disponibles
+	threading.Thread(target=contar_mensajes_broker, daemon=True).start()
+	for indice in range(HILOS_SOLICITUDES):
+		threading.Thread(target=trabajador_broker, args=(indice,), daemon=True).start()
+	try:
+		# Mientras no sea el principal, rechaza cada solicitud en lugar de retenerla (ver recibir_solicitudes)
+		while True:
+			if not frontend.poll(100):
+				if es_principal.is_set():
+					break
+				continue
+			partes = frontend.recv_multipart()
+			if es_principal.is_set():
+				# Llegó justo al asumir: va a los trabajadores como si la hubiera leído el proxy
+				backend.send_multipart(partes)
+				captura.send_multipart(partes)
+				break
+			frontend.send_multipart([partes[0], b"", RESPUESTA_NO_PRINCIPAL])
+		zmq.proxy(frontend, backend, captura)
+	except Exception as e:
+		log.error("Error en broker_solicitudes: %s", e)
+
+def agregar_a_lote(socket, lote, identidad, mensaje):
+	"""Decodifica una solicitud recibida por el ROUTER y la agrega al lote en curso."""
+	try:
+		solicitud = json.loads(mensaje)
+		lote.append((identidad, solicitud["id_usuario"], solicitud["x"], solicitud["y"], time.time()))
+		log.debug("Solicitud agregada al lote - Usuario %s: (%s, %s)", solicitud['id_usuario'], solicitud['x'], solicitud['y'])
+	except (json.JSONDecodeError, KeyError, TypeError) as e:
+		log.warning("Error al decodificar la solicitud JSON: %s", e)
+		respuesta = {"status": "error", "mensaje": "Solicitud JSON inválida."}
+		socket.send_multipart([identidad, b"", json.dumps(respuesta).encode()])
+
+def despachar_lote(socket, lote):
+	"""Resuelve la asignación óptima del lote y responde a todos sus usuarios.
+
+	Si algo falla a mitad del lote, los usuarios ya resueltos conservan su
+	respuesta (su taxi quedó en el WAL) y el resto recibe el error interno.
+	"""
+	respuestas = []
+	asignadas = 0
+	distancia_lote = distancia_voraz = 0.0
+	try:
+		with lock:
+			puntos = [(x_usuario, y_usuario) for _, _, x_usuario, y_usuario, _ in lote]
+			asignaciones, distancia_voraz = asignar_lote(motor_taxis, puntos)
+			for (identidad, id_usuario, x_usuario, y_usuario, tiempo_llegada), (taxi_asignado, distancia) in zip(lote, asignaciones):
+				if taxi_asignado is not None:
+					log.debug("Asignando Taxi %s al Usuario %s. Distancia: %s", taxi_asignado, id_usuario, distancia)
+					respuesta = {"status": "asignado", "taxi_id": taxi_asignado}
+					# asignar_lote no modifica el motor: si el WAL rechaza la eliminación, el taxi sigue libre
+					registrar_cambio("eliminar", id=taxi_asignado)
+					# Con fragmentos, la región recibe la posición antes que taxis_registrados
+					taxis_registrados.pop(taxi_asignado, None)
+					motor_taxis.eliminar(taxi_asignado)
+					guardar_historial(id_usuario, taxi_asignado, "exitoso", x_usuario, y_usuario)
+					metricas["servicios_exitosos"] += 1
+					registrar_despacho(tiempo_llegada, distancia)
+					distancia_lote += distancia
+					asignadas += 1
+				else:
+					log.debug("No hay taxis disponibles para asignar al Usuario %s.", id_usuario)
 					respuesta = {"status": "rechazado", "mensaje": "No hay taxis disponibles."}
 					guardar_historial(id_usuario, None, "rechazado", x_usuario, y_usuario)
-					# Actualizar métricas
 					metricas["servicios_rechazados"] += 1
-					print(f"Incrementando servicios rechazados: {metricas['servicios_rechazados']}", flush=True)
-					tiempo_respuesta = time.time() - tiempo_inicio
-					metricas["tiempos_respuesta"].append(tiempo_respuesta)
-					guardar_metricas()
-					print(f"Métricas actualizadas: {metricas}", flush=True)
-				else:
-					print(f"Buscando el taxi más cercano disponible para Usuario {id_usuario}...", flush=True)
-					# Buscar el taxi más cercano
-					taxi_asignado = None
-					distancia_minima = float("inf")
-					lista_taxis = []
-
-					for id_taxi, posicion in taxis_registrados.items():
-						distancia = calcular_distancia(x_usuario, y_usuario, posicion[0], posicion[1])
-						lista_taxis.append((id_taxi, distancia))
-						print(f"Evaluando Taxi {id_taxi} en posición {posicion}: distancia calculada {distancia}", flush=True)
-						if distancia < distancia_minima:
-							distancia_minima = distancia
-							taxi_asignado = id_taxi
-
-					if taxi_asignado:
-						# Asignar taxi
-						print(f"Asignando Taxi {taxi_asignado} al Usuario {id_usuario}. Distancia: {distancia_minima}", flush=True)
-						respuesta = {"status": "asignado", "taxi_id": taxi_asignado}
-						del taxis_registrados[taxi_asignado]
-						print(f"Taxi {taxi_asignado} eliminado de taxis_registrados. Taxis restantes: {taxis_registrados}", flush=True)
-						guardar_estado()
-						guardar_historial(id_usuario, taxi_asignado, "exitoso", x_usuario, y_usuario)
-						# Actualizar métricas
-						metricas["servicios_exitosos"] += 1
-						print(f"Incrementando servicios exitosos: {metricas['servicios_exitosos']}", flush=True)
-						tiempo_respuesta = time.time() - tiempo_inicio
-						metricas["tiempos_respuesta"].append(tiempo_respuesta)
-						guardar_metricas()
-						print(f"Métricas actualizadas: {metricas}", flush=True)
-					else:
-						# No se pudo asignar taxi (Este bloque puede no ser necesario)
-						print(f"No se pudo asignar ningún taxi para el Usuario {id_usuario}.", flush=True)
-						respuesta = {"status": "rechazado", "mensaje": "No hay taxis disponibles."}
-						guardar_historial(id_usuario, None, "rechazado", x_usuario, y_usuario)
-						# Actualizar métricas
-						metricas["servicios_rechazados"] += 1
-						print(f"Incrementando servicios rechazados: {metricas['servicios_rechazados']}", flush=True)
-						tiempo_respuesta = time.time() - tiempo_inicio
-						metricas["tiempos_respuesta"].append(tiempo_respuesta)
-						guardar_metricas()
-						print(f"Métricas actualizadas: {metricas}", flush=True)
-
-			# Enviar respuesta al cliente
-			print(f"Enviando respuesta al Usuario {id_usuario}: {respuesta}", flush=True)
-			socket.send_json(respuesta)
-		except json.JSONDecodeError as je:
-			print(f"Error al decodificar la solicitud JSON: {je}", flush=True)
-			respuesta = {"status": "error", "mensaje": "Solicitud JSON inválida."}
-			socket.send_json(respuesta)
+					registrar_despacho(tiempo_llegada)
+				# El tiempo de respuesta incluye la espera dentro de la ventana del lote
+				metricas["tiempos_respuesta"].registrar(time.time() - tiempo_llegada)
+				respuestas.append((identidad, respuesta))
+			metricas["distancia_recogida_voraz_total"] += distancia_voraz
+			metricas["asignaciones_en_lotes"] += asignadas
+			metricas["lotes_procesados"] += 1
+			escritura = guardar_metricas()
+
+		persistencia.esperar(escritura)
+	except Exception as e:
+		log.error("Error en despachar_lote: %s", e)
+		error = {"status": "error", "mensaje": "Error interno del servidor."}
+		respuestas += [(identidad, error) for identidad, *_ in lote[len(respuestas):]]
+	for identidad, respuesta in respuestas:
+		socket.send_multipart([identidad, b"", json.dumps(respuesta).encode()])
+	log.debug("Lote de %s solicitudes despachado: %s asignadas, distancia total %.2f (voraz: %.2f)", len(lote), asignadas, distancia_lote, distancia_voraz)
+
+def recibir_solicitudes_por_lotes():
+	"""Agrupa las solicitudes que llegan durante VENTANA_LOTE_MS (hasta MAX_SOLICITUDES_LOTE) y las asigna en conjunto."""
+	log.info("Iniciando recepción de solicitudes por lotes (ventana de %s ms)...", VENTANA_LOTE_MS)
+	socket = context.socket(zmq.ROUTER)  # ROUTER para tener varias solicitudes REQ pendientes a la vez
+	socket.bind(f"tcp://*:{puerto_local(USER_REQUEST_PORT)}")
+	log.info("Escuchando solicitudes de usuarios en tcp://*:%s", puerto_local(USER_REQUEST_PORT))
+	poller = zmq.Poller()
+	poller.register(socket, zmq.POLLIN)
+
+	while True:
+		try:
+			lote = []
+			# La primera solicitud abre la ventana del lote
+			identidad, _, mensaje = socket.recv_multipart()
+			if not es_principal.is_set():
+				# Rechazada al llegar, no retenida hasta asumir (ver recibir_solicitudes)
+				socket.send_multipart([identidad, b"", RESPUESTA_NO_PRINCIPAL])
+				continue
+			agregar_a_lote(socket, lote, identidad, mensaje)
+			fin_ventana = time.time() + VENTANA_LOTE_MS / 1000
+			while len(lote) < MAX_SOLICITUDES_LOTE:
+				restante = fin_ventana - time.time()
+				if restante <= 0 or not poller.poll(restante * 1000):
+					break
+				identidad, _, mensaje = socket.recv_multipart()
+				agregar_a_lote(socket, lote, identidad, mensaje)
+			if lote and not es_principal.is_set():
+				# Cedió ante otro líder durante la ventana
+				for identidad, *_ in lote:
+					socket.send_multipart([identidad, b"", RESPUESTA_NO_PRINCIPAL])
+			elif lote:
+				despachar_lote(socket, lote)
 		except Exception as e:
-			print(f"Error en recibir_solicitudes: {e}", flush=True)
-			respuesta = {"status": "error", "mensaje": "Error interno del servidor."}
-			socket.send_json(respuesta)
+			log.error("Error en recibir_solicitudes_por_lotes: %s", e)
 
-HISTORIAL_ARCHIVO = "historial_servidor.json"
-historial = []
+# Historial append-only en líneas JSON: historial_servidor.000001.jsonl, historial_servidor.000002.jsonl, ...
+HISTORIAL_PREFIJO = "historial_servidor"
+HISTORIAL_ARCHIVO_ANTERIOR = "historial_servidor.json"  # Formato anterior (un solo arreglo JSON)
+TAMANO_SEGMENTO_HISTORIAL = 8 * 1024 * 1024  # Bytes por segmento antes de rotar
+INTERVALO_FSYNC_HISTORIAL = 5.0  # Segundos entre fsync en modo diferido
+HISTORIAL_EN_MEMORIA = 1000  # Registros recientes que se conservan en memoria
+historial = deque(maxlen=HISTORIAL_EN_MEMORIA)
+registros_historial = 0  # Total de registros del historial, incluidos los que solo están en disco
+bitacora_historial = BitacoraSegmentada(HISTORIAL_PREFIJO, TAMANO_SEGMENTO_HISTORIAL, INTERVALO_FSYNC_HISTORIAL)
 
 def guardar_historial(usuario_id, taxi_id, estado, x_usuario, y_usuario):
-	"""Guarda una entrada de historial en el archivo JSON."""
-	print(f"Guardando historial para Usuario {usuario_id}, Taxi {taxi_id}, Estado: {estado}", flush=True)
-	registro = {
+	"""Agrega una entrada al historial, la encola para agregarla al final del archivo y la replica."""
+	log.debug("Guardando historial para Usuario %s, Taxi %s, Estado: %s", usuario_id, taxi_id, estado)
+	entrada = {
 		"usuario_id": usuario_id,
 		"taxi_id": taxi_id,
 		"estado": estado,
 		"posicion_usuario": (x_usuario, y_usuario),
 		"timestamp": time.time()
 	}
-	historial.append(registro)
-	try:
-		with open(HISTORIAL_ARCHIVO, "w") as archivo:
-			json.dump(historial, archivo, indent=4)
-		print(f"Historial actualizado con registro: {registro}", flush=True)
-	except IOError as e:
-		print(f"Error al guardar historial: {e}", flush=True)
+	# En el WAL solo para replicarlo: los respaldos responden consultas de historial (al reaplicar se ignora)
+	registrar_cambio("historial", registro=entrada)
+	return agregar_historial(entrada)
+
+def agregar_historial(entrada):
+	"""Agrega un registro al historial en memoria y lo encola para el archivo (con el lock tomado)."""
+	global registros_historial
+	historial.append(entrada)
+	registros_historial += 1
+	return persistencia.encolar("historial", entrada)
+
+def escribir_historial(registros, sincronizar):
+	"""Escritor del hilo de persistencia: agrega los registros nuevos al segmento activo."""
+	bitacora_historial.agregar(registros, sincronizar)
+	log.debug("Historial actualizado con %s registros nuevos.", len(registros))
 
 def cargar_historial():
-	"""Carga el historial del archivo JSON si existe."""
-	global historial
-	print("Cargando historial de asignaciones...", flush=True)
-	if os.path.exists(HISTORIAL_ARCHIVO):
-		try:
-			with open(HISTORIAL_ARCHIVO, "r") as archivo:
-				historial = json.load(archivo)
-			print("Historial cargado desde historial_servidor.json", flush=True)
-			print(f"Historial actual: {historial}", flush=True)
-		except (IOError, json.JSONDecodeError) as e:
-			print(f"Error al cargar historial: {e}. Iniciando historial vacío.", flush=True)
-			historial = []
+	"""Recorre los segmentos del historial y conserva en memoria solo los más recientes."""
+	global registros_historial
+	log.info("Cargando historial de asignaciones...")
+	historial.clear()
+	registros_historial = 0
+	try:
+		if not bitacora_historial.segmentos() and os.path.exists(HISTORIAL_ARCHIVO_ANTERIOR):
+			# Migración única desde el formato anterior
+			with open(HISTORIAL_ARCHIVO_ANTERIOR, "r") as archivo:
+				anteriores = json.load(archivo)
+			bitacora_historial.agregar(anteriores, sincronizar=True)
+			log.info("%s registros migrados desde %s.", len(anteriores), HISTORIAL_ARCHIVO_ANTERIOR)
+		for entrada in bitacora_historial.leer():
+			historial.append(entrada)
+			registros_historial += 1
+	except (IOError, json.JSONDecodeError) as e:
+		log.error("Error al cargar historial: %s. Se conservan los %s registros leídos.", e, registros_historial)
+	if registros_historial:
+		log.info("Historial cargado: %s registros en %s segmento(s).", registros_historial, len(bitacora_historial.segmentos()))
 	else:
-		print("No existe historial previo. Iniciando historial vacío.", flush=True)
+		log.info("No existe historial previo. Iniciando historial vacío.")
 
 METRICAS_ARCHIVO = "metricas_servidor.json"
-metricas = {
-	"tiempos_respuesta": [],
-	"servicios_exitosos": 0,
-	"servicios_rechazados": 0
-}
+
+def metricas_vacias():
+	return {
+		"tiempos_respuesta": HistogramaLatencias(),
+		"servicios_exitosos": 0,
+		"servicios_rechazados": 0,
+		"distancia_recogida_total": 0.0,
+		"primera_solicitud": None,
+		"ultima_solicitud": None,
+		# Solo en modo "lotes": distancia que habría logrado la asignación voraz
+		"distancia_recogida_voraz_total": 0.0,
+		"asignaciones_en_lotes": 0,
+		"lotes_procesados": 0
+	}
+
+metricas = metricas_vacias()
+
+def registrar_despacho(llegada, distancia=None):
+	"""Acumula una solicitud despachada y, si se asignó taxi, su distancia de recogida.
+
+	El throughput se mide sobre el tiempo de reloj de la corrida: desde la
+	llegada de la primera solicitud hasta el despacho de la última. En modo
+	"lotes" todas las solicitudes de un lote se despachan en el mismo instante,
+	así que contar desde el primer despacho dejaría afuera la espera de las ventanas.
+	"""
+	ahora = time.time()
+	if metricas["primera_solicitud"] is None or llegada < metricas["primera_solicitud"]:
+		metricas["primera_solicitud"] = llegada
+	metricas["ultima_solicitud"] = ahora
+	if distancia is not None:
+		metricas["distancia_recogida_total"] += distancia
+
+def resumen_despacho():
+	"""Throughput y distancia media de recogida del modo de despacho actual."""
+	solicitudes = metricas["servicios_exitosos"] + metricas["servicios_rechazados"]
+	duracion = 0
+	if metricas["primera_solicitud"] is not None:
+		duracion = metricas["ultima_solicitud"] - metricas["primera_solicitud"]
+	resumen = {
+		"modo": MODO_DESPACHO,
+		"solicitudes": solicitudes,
+		"solicitudes_por_segundo": solicitudes / duracion if duracion > 0 else 0,
+		"distancia_media_recogida": metricas["distancia_recogida_total"] / metricas["servicios_exitosos"] if metricas["servicios_exitosos"] else 0
+	}
+	if metricas["asignaciones_en_lotes"]:
+		resumen["distancia_media_voraz"] = metricas["distancia_recogida_voraz_total"] / metricas["asignaciones_en_lotes"]
+	return resumen
 
 def guardar_metricas():
-	"""Guarda las métricas en un archivo JSON."""
-	print("Guardando métricas actuales...", flush=True)
-	try:
-		with open(METRICAS_ARCHIVO, "w") as archivo:
-			json.dump(metricas, archivo, indent=4)
-		print("Métricas actualizadas en metricas_servidor.json", flush=True)
-	except IOError as e:
-		print(f"Error al guardar métricas: {e}", flush=True)
+	"""Encola una copia de las métricas para el hilo de persistencia (se llama con el lock tomado)."""
+	copia = dict(metricas)
+	copia["tiempos_respuesta"] = metricas["tiempos_respuesta"].a_dict()
+	copia["resumen_despacho"] = resumen_despacho()
+	if FRENTE_SOLICITUDES == "broker":
+		copia["broker"] = estadisticas_broker()
+	copia["persistencia"] = persistencia.resumen()
+	copia["posiciones"] = coalescedor_posiciones.resumen()
+	return persistencia.encolar("metricas", copia)
+
+def escribir_metricas(copias, sincronizar):
+	"""Escritor del hilo de persistencia: solo la copia más reciente llega a disco."""
+	log.debug("Guardando métricas actuales...")
+	datos = copias[-1]
+	# Los percentiles por etapa se calculan aquí, una vez por volcado y fuera del lock
+	datos["tramos"] = tramos.resumen()
+	datos["lock"] = lock.resumen()
+	datos["utilizacion"] = utilizacion_flota.resumen()
+	datos["replicacion"] = dict(replicacion)
+	datos["promocion"] = dict(promocion)
+	datos["cluster"] = {
+		"nodo": nodo_propio.id,
+		"nodos": len(NODOS),
+		"lider": lider.id if lider is not None else None,
+		"termino": termino,
+		"puertos_no_disponibles": list(puertos_no_disponibles)
+	}
+	datos["consultas"] = dict(metricas_consultas)
+	datos["replicacion"]["seguidores"] = {
+		seguidor: {"retraso_cambios": cambios, "retraso_ms": segundos * 1000}
+		for seguidor, (cambios, segundos) in retraso_seguidores(time.time()).items()
+	}
+	escribir_json(METRICAS_ARCHIVO, datos, sincronizar)
+	log.debug("Métricas actualizadas en metricas_servidor.json")
+
+def iniciar_persistencia():
+	"""Crea e inicia el hilo que escribe estado, historial y métricas en disco."""
+	global persistencia
+	persistencia = HiloPersistencia(
+		{"wal": escribir_wal, "historial": escribir_historial, "metricas": escribir_metricas},
+		intervalo=INTERVALO_PERSISTENCIA,
+		durabilidad=DURABILIDAD,
+		capacidad=TAMANO_COLA_PERSISTENCIA
+	)
+	persistencia.iniciar()
 
 def cargar_metricas():
 	"""Carga las métricas de un archivo JSON si existe."""
 	global metricas
-	print("Cargando métricas del servidor...", flush=True)
+	log.info("Cargando métricas del servidor...")
 	if os.path.exists(METRICAS_ARCHIVO):
 		try:
 			with open(METRICAS_ARCHIVO, "r") as archivo:
 				metricas = json.load(archivo)
-			print("Métricas cargadas desde metricas_servidor.json", flush=True)
-			print(f"Métricas actuales: {metricas}", flush=True)
+			# Las versiones anteriores guardaban la lista completa de tiempos
+			metricas["tiempos_respuesta"] = HistogramaLatencias.cargar(metricas.get("tiempos_respuesta"))
+			# Completar campos que no existían en archivos de versiones anteriores
+			for clave, valor in metricas_vacias().items():
+				metricas.setdefault(clave, valor)
+			log.info("Métricas cargadas desde metricas_servidor.json")
+			log.info("Métricas actuales: %s, latencias %s", resumen_despacho(), metricas['tiempos_respuesta'].resumen())
 		except (IOError, json.JSONDecodeError) as e:
-			print(f"Error al cargar métricas: {e}. Iniciando métricas vacías.", flush=True)
-			metricas = {
-				"tiempos_respuesta": [],
-				"servicios_exitosos": 0,
-				"servicios_rechazados": 0
-			}
+			log.error("Error al cargar métricas: %s. Iniciando métricas vacías.", e)
+			metricas = metricas_vacias()
+	else:
+		log.info("No existen métricas previas. Iniciando métricas vacías.")
+
+def recolectar_metricas():
+	"""Familias de métricas para el endpoint HTTP; solo copia contadores con el lock tomado."""
+	with lock:
+		exitosos = metricas["servicios_exitosos"]
+		rechazados = metricas["servicios_rechazados"]
+		latencias = metricas["tiempos_respuesta"].copiar()
+		taxis_libres = len(taxis_registrados)
+		posiciones = coalescedor_posiciones.estadisticas["actualizaciones_totales"] + coalescedor_posiciones.actualizaciones
+		secuencia = secuencia_wal
+	por_etapa = tramos.copiar()
+	por_sitio = lock.copiar()
+	taxis_reportando, ocupado_total, libre_total = utilizacion_flota.totales()
+	ahora = time.time()
+	por_seguidor = retraso_seguidores(ahora)
+	if ROL == "respaldo":
+		secuencia_replicada = replicacion["secuencia_recibida"]
+		retraso_cambios = max(replicacion["secuencia_principal"] - secuencia_replicada, 0)
+		enviado = replicacion["enviado_recibido"]
+		retraso_segundos = ahora - enviado if enviado is not None else 0
 	else:
-		print("No existen métricas previas. Iniciando métricas vacías.", flush=True)
+		secuencia_replicada = replicacion["secuencia_enviada"]
+		# Con respaldos activos, el retraso es el del más atrasado según sus confirmaciones
+		retraso_cambios = secuencia - secuencia_replicada
+		ultimo_envio = replicacion["ultimo_envio"]
+		retraso_segundos = ahora - ultimo_envio if retraso_cambios > 0 else 0
+		for cambios, segundos in por_seguidor.values():
+			retraso_cambios = max(retraso_cambios, secuencia - secuencia_replicada + cambios)
+			retraso_segundos = max(retraso_segundos, segundos)
+	profundidad = persistencia.cola.qsize() if persistencia is not None else 0
+	return [
+		("my_uber_solicitudes", "counter", "Solicitudes de usuarios atendidas.",
+			[("_total", None, exitosos + rechazados)]),
+		("my_uber_servicios", "counter", "Solicitudes por resultado.",
+			[("_total", {"resultado": "exitoso"}, exitosos), ("_total", {"resultado": "rechazado"}, rechazados)]),
+		("my_uber_latencia_respuesta_segundos", "histogram", "Tiempo de respuesta a las solicitudes de usuarios.",
+			muestras_histograma(latencias)),
+		("my_uber_etapa_segundos", "histogram", "Duración de cada etapa de solicitudes y posiciones.",
+			[muestra for (tipo, etapa), histograma in sorted(por_etapa.items())
+				for muestra in muestras_histograma(histograma, etiquetas={"tipo": tipo, "etapa": etapa})]),
+		("my_uber_lock_espera_segundos", "histogram", "Espera para tomar el lock global, por función.",
+			[muestra for sitio, histogramas in sorted(por_sitio.items())
+				for muestra in muestras_histograma(histogramas["espera"], etiquetas={"sitio": sitio})]),
+		("my_uber_lock_retencion_segundos", "histogram", "Tiempo con el lock global tomado, por función.",
+			[muestra for sitio, histogramas in sorted(por_sitio.items())
+				for muestra in muestras_histograma(histogramas["retencion"], etiquetas={"sitio": sitio})]),
+		("my_uber_taxis_libres", "gauge", "Taxis registrados disponibles para asignar.",
+			[("", None, taxis_libres)]),
+		("my_uber_flota_taxis_reportando", "gauge", "Taxis que han informado su tiempo ocupado y libre.",
+			[("", None, taxis_reportando)]),
+		("my_uber_flota_tiempo_segundos", "gauge", "Tiempo acumulado de la flota por estado, según lo informado por los taxis.",
+			[("", {"estado": "ocupado"}, ocupado_total), ("", {"estado": "libre"}, libre_total)]),
+		("my_uber_posiciones_recibidas", "counter", "Actualizaciones de posición recibidas de los taxis.",
+			[("_total", None, posiciones)]),
+		("my_uber_cola_persistencia", "gauge", "Escrituras pendientes en la cola del hilo de persistencia.",
+			[("", None, profundidad)]),
+		("my_uber_wal_secuencia", "gauge", "Secuencia del último cambio registrado en el WAL.",
+			[("", None, secuencia)]),
+		("my_uber_replicacion_secuencia", "gauge", "Secuencia del último cambio publicado (principal) o aplicado (respaldo).",
+			[("", None, secuencia_replicada)]),
+		("my_uber_replicacion_retraso_cambios", "gauge", "Cambios del WAL aún no publicados (principal) o no aplicados (respaldo).",
+			[("", None, retraso_cambios)]),
+		("my_uber_replicacion_retraso_segundos", "gauge", "Antigüedad del estado replicado más reciente.",
+			[("", None, retraso_segundos)]),
+		("my_uber_replicacion_seguidor_retraso_cambios", "gauge", "Cambios publicados que cada respaldo aún no confirma.",
+			[("", {"seguidor": seguidor}, cambios) for seguidor, (cambios, _) in sorted(por_seguidor.items())]),
+		("my_uber_replicacion_seguidor_retraso_segundos", "gauge", "Antigüedad del cambio más viejo que cada respaldo aún no confirma.",
+			[("", {"seguidor": seguidor}, segundos) for seguidor, (_, segundos) in sorted(por_seguidor.items())]),
+		("my_uber_replicacion_puestas_al_dia", "counter", "Veces que el respaldo se puso al día con cambios retenidos por el principal.",
+			[("_total", None, replicacion["puestas_al_dia"])]),
+		("my_uber_replicacion_resincronizaciones", "counter", "Veces que el respaldo recibió el estado completo del principal.",
+			[("_total", None, replicacion["resincronizaciones"])]),
+		("my_uber_latido_antiguedad_segundos", "gauge", "Tiempo desde el último latido recibido del principal (respaldo).",
+			[("", None, ahora - promocion["ultimo_latido"])] if promocion["ultimo_latido"] and ROL == "respaldo" else []),
+		("my_uber_failover_segundos", "gauge", "Duración del último failover, desde el último latido del principal hasta asumir.",
+			[("", None, promocion["failover_ms"] / 1000)] if promocion["failover_ms"] is not None else []),
+		("my_uber_promocion_segundos", "gauge", "Duración de la última promoción, desde que se detecta la falla hasta atender como principal.",
+			[("", None, promocion["promocion_ms"] / 1000)] if promocion["promocion_ms"] is not None else []),
+		("my_uber_cluster_termino", "gauge", "Término de la elección de líder más reciente conocida.",
+			[("", None, termino)]),
+		("my_uber_cluster_lider", "gauge", "Id del nodo que este servidor reconoce como líder (-1 si ninguno).",
+			[("", None, lider.id if lider is not None else -1)]),
+		("my_uber_consultas", "counter", "Consultas de solo lectura por resultado (desactualizada: el estado era más viejo que lo admitido).",
+			[("_total", {"resultado": "respondida"}, metricas_consultas["respondidas"]),
+				("_total", {"resultado": "desactualizada"}, metricas_consultas["desactualizadas"])]),
+		("my_uber_rol_principal", "gauge", "1 si este servidor es el principal.",
+			[("", None, 1 if ROL == "principal" else 0)])
+	]
+
+def iniciar_metricas_http():
+	global servidor_metricas
+	if not PUERTO_METRICAS:
+		return
+	try:
+		servidor_metricas = ServidorMetricas(PUERTO_METRICAS, recolectar_metricas)
+		servidor_metricas.iniciar()
+	except OSError as e:
+		log.error("No se pudo abrir el puerto de métricas %s: %s", PUERTO_METRICAS, e)
+		servidor_metricas = None
 
 # Inicialización de Roles
-def iniciar_como_principal():
-	print("Iniciando funciones del servidor como PRINCIPAL.", flush=True)
+def validar_puertos():
+	"""Puertos del principal que ya están ocupados en esta máquina (se comprueba al arrancar, no al asumir)."""
+	ocupados = []
+	for puerto in PUERTOS_PRINCIPAL:
+		prueba = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		prueba.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Igual que ZeroMQ al enlazar
+		try:
+			prueba.bind(("", puerto_local(puerto)))
+		except OSError:
+			ocupados.append(puerto_local(puerto))
+		finally:
+			prueba.close()
+	return ocupados
+
+def preparar_principal():
+	"""Respaldo en caliente: inicia los hilos del principal, que abren sus puertos y esperan a es_principal.
+
+	Así asumir no abre sockets ni crea hilos. Si algún puerto está ocupado no
+	se inicia nada y el nodo no se postula en las elecciones.
+	"""
+	puertos_no_disponibles.extend(validar_puertos())
+	if puertos_no_disponibles:
+		log.error("Puertos del principal ocupados: %s. Este nodo seguirá al líder pero no podrá asumir.", puertos_no_disponibles)
+		return
+	log.info("Preparando las funciones del PRINCIPAL en caliente.")
 	try:
-		threading.Thread(target=publicar_presencia, daemon=True).start()
-		print("Thread de publicar_presencia iniciado.", flush=True)
+		threading.Thread(target=sincronizar_estado_principal, daemon=True).start()
+		log.info("Thread de sincronizar_estado_principal iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de publicar_presencia: {e}", flush=True)
-	
+		log.error("Error al iniciar thread de sincronizar_estado_principal: %s", e)
+
 	try:
-		threading.Thread(target=sincronizar_estado_principal, daemon=True).start()
-		print("Thread de sincronizar_estado_principal iniciado.", flush=True)
+		threading.Thread(target=servir_seguidores, daemon=True).start()
+		log.info("Thread de servir_seguidores iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de sincronizar_estado_principal: {e}", flush=True)
+		log.error("Error al iniciar thread de servir_seguidores: %s", e)
 	
 	try:
-		threading.Thread(target=responder_health_check, daemon=True).start()
-		print("Thread de responder_health_check iniciado.", flush=True)
+		threading.Thread(target=publicar_latidos, daemon=True).start()
+		log.info("Thread de publicar_latidos iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de responder_health_check: {e}", flush=True)
+		log.error("Error al iniciar thread de publicar_latidos: %s", e)
 	
 	try:
 		threading.Thread(target=recibir_posiciones, daemon=True).start()
-		print("Thread de recibir_posiciones iniciado.", flush=True)
+		log.info("Thread de recibir_posiciones iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de recibir_posiciones: {e}", flush=True)
+		log.error("Error al iniciar thread de recibir_posiciones: %s", e)
 	
 	try:
-		threading.Thread(target=recibir_solicitudes, daemon=True).start()
-		print("Thread de recibir_solicitudes iniciado.", flush=True)
+		if MODO_DESPACHO == "lotes":
+			threading.Thread(target=recibir_solicitudes_por_lotes, daemon=True).start()
+			log.info("Thread de recibir_solicitudes_por_lotes iniciado.")
+		elif FRENTE_SOLICITUDES == "broker":
+			threading.Thread(target=broker_solicitudes, daemon=True).start()
+			log.info("Thread de broker_solicitudes iniciado.")
+		else:
+			threading.Thread(target=recibir_solicitudes, daemon=True).start()
+			log.info("Thread de recibir_solicitudes iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de recibir_solicitudes: {e}", flush=True)
+		log.error("Error al iniciar thread de recibir_solicitudes: %s", e)
 	
 	# Remover o comentar la siguiente línea
 	# try:
@@ -513,70 +1868,197 @@ def iniciar_como_principal():
 	#     print("Thread de asignar_servicio iniciado.", flush=True)
 	# except Exception as e:
 	#     print(f"Error al iniciar thread de asignar_servicio: {e}", flush=True)
-	
+
+	try:
+		threading.Thread(target=volcar_posiciones_periodicamente, daemon=True).start()
+		log.info("Thread de volcar_posiciones_periodicamente iniciado.")
+	except Exception as e:
+		log.error("Error al iniciar thread de volcar_posiciones_periodicamente: %s", e)
+
 	try:
 		threading.Thread(target=guardar_estado_periodicamente, daemon=True).start()
-		print("Thread de guardar_estado_periodicamente iniciado.", flush=True)
+		log.info("Thread de guardar_estado_periodicamente iniciado.")
+	except Exception as e:
+		log.error("Error al iniciar thread de guardar_estado_periodicamente: %s", e)
+
+def iniciar_como_principal(traza=None):
+	"""Activa las funciones del principal, ya preparadas. Con 'traza' (una promoción) mide cada paso."""
+	log.info("Iniciando funciones del servidor como PRINCIPAL.")
+	# Los latidos de replicación parten de la secuencia propia: sin esto anunciarían 0 hasta el
+	# primer cambio nuevo y los seguidores, que ya la tienen, se verían desactualizados
+	with lock_replicacion:
+		replicacion["secuencia_enviada"] = secuencia_wal
+		replicacion["ultimo_envio"] = time.time()
+	es_principal.set()  # Los hilos del principal empiezan a atender
+	if traza is not None:
+		traza.tramo("activar")
+
+	# El WAL del respaldo ya está al día; la instantánea solo acorta lo que habría que reaplicar
+	with lock:
+		tomar_instantanea()
+	if traza is not None:
+		traza.tramo("instantanea")
+
+	try:
+		threading.Thread(target=anunciar_principal, daemon=True).start()
+		log.info("Thread de anunciar_principal iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de guardar_estado_periodicamente: {e}", flush=True)
+		log.error("Error al iniciar thread de anunciar_principal: %s", e)
+	if traza is not None:
+		traza.tramo("anuncio")
 
 def iniciar_como_respaldo():
 	"""Inicia las funciones del respaldo."""
-	print("Iniciando funciones del servidor como RESPALDO.", flush=True)
+	log.info("Iniciando funciones del servidor como RESPALDO.")
+	global hilo_replicacion
 	try:
-		threading.Thread(target=recibir_estado_respaldo, daemon=True).start()
-		print("Thread de recibir_estado_respaldo iniciado.", flush=True)
+		hilo_replicacion = threading.Thread(target=recibir_estado_respaldo, daemon=True)
+		hilo_replicacion.start()
+		log.info("Thread de recibir_estado_respaldo iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de recibir_estado_respaldo: {e}", flush=True)
+		log.error("Error al iniciar thread de recibir_estado_respaldo: %s", e)
 	
 	try:
-		threading.Thread(target=health_check_respaldo, daemon=True).start()
-		print("Thread de health_check_respaldo iniciado.", flush=True)
+		threading.Thread(target=vigilar_lider, daemon=True).start()
+		log.info("Thread de vigilar_lider iniciado.")
 	except Exception as e:
-		print(f"Error al iniciar thread de health_check_respaldo: {e}", flush=True)
+		log.error("Error al iniciar thread de vigilar_lider: %s", e)
 
-def guardar_estado_periodicamente(intervalo=5):
-	"""Guarda el estado en un archivo JSON cada 'intervalo' segundos."""
-	print(f"Iniciando guardado periódico del estado cada {intervalo} segundos.", flush=True)
+def guardar_estado_periodicamente(intervalo=1):
+	"""Toma una instantánea cada INTERVALO_INSTANTANEA segundos o cada CAMBIOS_POR_INSTANTANEA cambios.
+
+	Así el WAL que hay que reaplicar al reiniciar siempre es corto.
+	"""
+	es_principal.wait()
+	log.info("Iniciando instantáneas del estado cada %s segundos o %s cambios.", INTERVALO_INSTANTANEA, CAMBIOS_POR_INSTANTANEA)
 	while True:
 		try:
-			with lock:
-				print("Guardando estado de manera periódica...", flush=True)
-				guardar_estado()
 			time.sleep(intervalo)
+			es_principal.wait()
+			with lock:
+				vencida = time.time() - ultima_instantanea >= INTERVALO_INSTANTANEA
+				if cambios_desde_instantanea >= CAMBIOS_POR_INSTANTANEA or (vencida and cambios_desde_instantanea > 0):
+					log.debug("Guardando estado de manera periódica...")
+					tomar_instantanea()
 		except Exception as e:
-			print(f"Error en guardar_estado_periodicamente: {e}", flush=True)
+			log.error("Error en guardar_estado_periodicamente: %s", e)
 			break
 
 if __name__ == "__main__":
-	print("=== INICIANDO SERVIDOR ===", flush=True)
+	parser = argparse.ArgumentParser(description="Servidor central de My-Uber")
+	parser.add_argument("--motor", choices=list(MOTORES), default=MOTOR_EMPAREJAMIENTO,
+		help="Motor de emparejamiento para buscar el taxi más cercano")
+	parser.add_argument("--modo", choices=["voraz", "lotes"], default=MODO_DESPACHO,
+		help="Despacho voraz por solicitud o asignación óptima por lotes")
+	parser.add_argument("--ventana-ms", type=int, default=VENTANA_LOTE_MS,
+		help="Duración de la ventana de agrupación en modo lotes (ms)")
+	parser.add_argument("--max-lote", type=int, default=MAX_SOLICITUDES_LOTE,
+		help="Solicitudes máximas por lote; un lote lleno se despacha sin esperar el fin de la ventana")
+	parser.add_argument("--fragmentos", type=int, default=FRAGMENTOS,
+		help="Número de procesos que se reparten las regiones de la cuadrícula")
+	parser.add_argument("--cuadricula", type=int, nargs=2, metavar=("N", "M"), default=[CUADRICULA_N, CUADRICULA_M],
+		help="Tamaño de la cuadrícula para dividir las regiones")
+	parser.add_argument("--frente", choices=["router", "broker"], default=FRENTE_SOLICITUDES,
+		help="Frente de solicitudes en modo voraz: ROUTER con cola interna o broker zmq.proxy")
+	parser.add_argument("--hilos", type=int, default=HILOS_SOLICITUDES,
+		help="Hilos trabajadores que atienden solicitudes en modo voraz")
+	parser.add_argument("--intervalo-persistencia", type=float, default=INTERVALO_PERSISTENCIA,
+		help="Segundos máximos entre escrituras a disco en modo diferido")
+	parser.add_argument("--durabilidad", choices=list(DURABILIDADES), default=DURABILIDAD,
+		help="diferida: responde sin esperar al disco; estricta: fsync antes de responder")
+	parser.add_argument("--intervalo-posiciones", type=float, default=INTERVALO_VOLCADO_POSICIONES,
+		help="Segundos máximos que una posición de taxi espera antes de ir al WAL")
+	parser.add_argument("--duracion-perfil", type=float, default=DURACION_PERFIL,
+		help="Segundos que dura el perfil por muestreo que se inicia con SIGUSR1")
+	parser.add_argument("--archivo-trazas", default=ARCHIVO_TRAZAS,
+		help="Archivo donde agregar cada traza por etapas como una línea JSON")
+	parser.add_argument("--puerto-metricas", type=int, default=PUERTO_METRICAS,
+		help="Puerto HTTP local para las métricas en formato Prometheus (0 lo desactiva)")
+	parser.add_argument("--intervalo-latido", type=float, default=INTERVALO_LATIDO,
+		help="Segundos entre latidos del principal")
+	parser.add_argument("--latidos-perdidos", type=int, default=LATIDOS_PERDIDOS,
+		help="Latidos seguidos sin recibir tras los que el respaldo asume como principal")
+	parser.add_argument("--cluster", default=None,
+		help="Nodos del clúster: host[:desplazamiento],... (por defecto MY_UBER_CLUSTER o los dos servidores)")
+	parser.add_argument("--id-nodo", type=int, default=None,
+		help="Posición de este servidor en --cluster (por defecto, el nodo con la IP local)")
+	parser.add_argument("--max-retraso-lectura-ms", type=int, default=MAX_RETRASO_LECTURA_MS,
+		help="Antigüedad máxima del estado con la que un respaldo responde consultas de solo lectura")
+	parser.add_argument("--retencion-replicacion", type=int, default=RETENCION_REPLICACION,
+		help="Cambios publicados que el principal retiene para poner al día a un respaldo")
+	args = parser.parse_args()
+	MODO_DESPACHO = args.modo
+	INTERVALO_VOLCADO_POSICIONES = coalescedor_posiciones.intervalo = args.intervalo_posiciones
+	INTERVALO_PERSISTENCIA = args.intervalo_persistencia
+	DURABILIDAD = args.durabilidad
+	FRENTE_SOLICITUDES = args.frente
+	HILOS_SOLICITUDES = args.hilos
+	VENTANA_LOTE_MS = args.ventana_ms
+	MAX_SOLICITUDES_LOTE = args.max_lote
+	FRAGMENTOS = args.fragmentos
+	CUADRICULA_N, CUADRICULA_M = args.cuadricula
+	NODOS = cluster.nodos_configurados(args.cluster)
+	nodo_propio = ubicar_nodo_propio(args.id_nodo)
+	if nodo_propio is None:
+		log.warning("%s no figura en el clúster %s: se ejecuta como nodo único.", SERVER_IP, NODOS)
+		NODOS = [cluster.Nodo(0, SERVER_IP)]
+		nodo_propio = NODOS[0]
+	PUERTO_METRICAS = args.puerto_metricas and args.puerto_metricas + nodo_propio.desplazamiento
+	ARCHIVO_TRAZAS = args.archivo_trazas
+	tramos = RegistroTramos(ARCHIVO_TRAZAS)
+	DURACION_PERFIL = args.duracion_perfil
+	RETENCION_REPLICACION = args.retencion_replicacion
+	MAX_RETRASO_LECTURA_MS = args.max_retraso_lectura_ms
+	INTERVALO_LATIDO = args.intervalo_latido
+	LATIDOS_PERDIDOS = args.latidos_perdidos
+	cambios_retenidos = deque(maxlen=RETENCION_REPLICACION)
+	envios_publicados = deque(maxlen=RETENCION_REPLICACION)
+
+	log.info("=== INICIANDO SERVIDOR ===")
+	iniciar_motor(args.motor)  # Select the nearest-taxi matching backend
+	iniciar_persistencia()   # Start the disk writer thread
 	cargar_estado()          # Load the state of taxis and requests
 	cargar_historial()       # Load the assignment history
 	cargar_metricas()        # Load performance metrics
-	iniciar_negociacion()    # Perform role negotiation
+	iniciar_metricas_http()  # Expose live metrics on localhost
+	instalar_senal(PerfiladorMuestreo(INTERVALO_MUESTREO_PERFIL), DURACION_PERFIL)  # Profile on SIGUSR1
+	iniciar_anuncios()       # Let taxis subscribe before any promotion
+	threading.Thread(target=atender_cluster, daemon=True).start()  # Discovery and votes
+	threading.Thread(target=atender_consultas, daemon=True).start()  # Read-only queries in any role
 
-	if ROL == "principal":
-		iniciar_como_principal()
-	elif ROL == "respaldo":
-		iniciar_como_respaldo()
-	else:
-		print("Rol no asignado correctamente. Verifica la negociación de roles.", flush=True)
+	# Every node starts as a follower: it follows the leader's heartbeats or wins an election
+	log.info("Este servidor es el %s de %s en el clúster.", nodo_propio, len(NODOS))
+	ROL = "respaldo"
+	preparar_principal()     # Hot standby: principal threads bound and waiting
+	iniciar_como_respaldo()
 
 	# Keep the program running
-	print(f"Rol actual del servidor: {ROL}", flush=True)
-	print(f"Taxis registrados: {taxis_registrados}", flush=True)
-	print(f"Solicitudes de usuarios: {solicitudes_usuarios}", flush=True)
+	log.info("Rol actual del servidor: %s", ROL)
+	log.debug("Taxis registrados: %s", taxis_registrados)
+	log.debug("Solicitudes de usuarios: %s", solicitudes_usuarios)
 	try:
 		while True:
 			time.sleep(1)  # Evita el uso intensivo de CPU
 	except KeyboardInterrupt:
-		print("Servidor detenido por el usuario.", flush=True)
+		log.info("Servidor detenido por el usuario.")
 	except Exception as e:
-		print(f"Error inesperado en el ciclo principal: {e}", flush=True)
+		log.error("Error inesperado en el ciclo principal: %s", e)
 	finally:
-		print("Cerrando servidor de manera segura.", flush=True)
+		log.info("Cerrando servidor de manera segura.")
+		if servidor_metricas is not None:
+			servidor_metricas.detener()
+		if motor_taxis is not None:
+			motor_taxis.cerrar()
+		if persistencia is not None:
+			with lock:
+				volcar_posiciones()
+			persistencia.detener()
+		bitacora_historial.cerrar()
+		bitacora_estado.cerrar()
+		tramos.cerrar()
 		try:
 			context.term()
-			print("Contexto global terminado exitosamente.", flush=True)
+			log.info("Contexto global terminado exitosamente.")
 		except Exception as e:
-			print(f"Error al terminar el contexto global: {e}", flush=True)
\ No newline at end of file
+			log.error("Error al terminar el contexto global: %s", e)
+		registro.cerrar()
\ No newline at end of file
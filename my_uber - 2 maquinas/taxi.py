@@ -9,6 +9,11 @@ import json
 import os
 from threading import Lock
 
+import registro
+import cluster
+
+log = registro.obtener("taxi")
+
 # Configuración del archivo para registro histórico
 MOVIMIENTO_ARCHIVO = "movimiento_taxi.json"
 movimiento_historial = []
@@ -18,43 +23,36 @@ tiempo_ocupado = 0  # Tiempo total ocupado (en segundos)
 tiempo_libre = 0    # Tiempo total libre (en segundos)
 ultimo_cambio_estado = time.time()  # Marca de tiempo del último cambio de estado
 
-METRICAS_ARCHIVO = "metricas_taxi.json"
-metricas = {"tiempo_ocupado": 0, "tiempo_libre": 0}
-HEALTH_CHECK_PORT = 5562  # Puerto para health-check
+DISCOVERY_PORT = 5560  # Puerto donde el principal confirma que lo es
+ANUNCIO_PORT = 5564  # Puerto donde un servidor anuncia que asumió como principal
+TIMEOUT_DESCUBRIMIENTO_MS = 2000
+TIMEOUT_CONEXION_MS = 1000  # Espera máxima para conectar con el principal antes de darlo por caído
+HWM_POSICIONES = 10  # Posiciones encoladas como máximo en el PUSH; más viejas no le sirven al servidor
 
-def guardar_metricas():
-	"""Guarda las métricas de tiempo en un archivo JSON."""
-	global tiempo_ocupado, tiempo_libre
-	try:
-		metricas["tiempo_ocupado"] = tiempo_ocupado
-		metricas["tiempo_libre"] = tiempo_libre
-		with open(METRICAS_ARCHIVO, "w") as archivo:
-			json.dump(metricas, archivo, indent=4)
-		print("Métricas actualizadas.", flush=True)
-	except IOError as e:
-		print(f"Error al guardar métricas: {e}", flush=True)
+# Principal descubierto, compartido por los hilos del proceso. Se descarta solo si un envío
+# falla y se reemplaza cuando un servidor anuncia que asumió como principal.
+context = zmq.Context()  # Único contexto del proceso: lo usan todos los hilos
+servidor_principal = None
+servidor_principal_lock = Lock()
 
-def cargar_metricas():
-	"""Carga las métricas de tiempo del archivo JSON si existe."""
-	global tiempo_ocupado, tiempo_libre
-	if os.path.exists(METRICAS_ARCHIVO):
-		try:
-			with open(METRICAS_ARCHIVO, "r") as archivo:
-				datos = json.load(archivo)
-				tiempo_ocupado = datos.get("tiempo_ocupado", 0)
-				tiempo_libre = datos.get("tiempo_libre", 0)
-				print("Métricas cargadas.", flush=True)
-		except (IOError, json.JSONDecodeError) as e:
-			print(f"Error al cargar métricas: {e}. Iniciando métricas desde cero.", flush=True)
+def tiempos_actuales():
+	"""(tiempo_ocupado, tiempo_libre) incluyendo el tramo en curso desde el último cambio de estado.
+
+	Se envían junto con cada posición; el servidor agrega la utilización de toda la flota.
+	"""
+	en_curso = time.time() - ultimo_cambio_estado
+	if ocupado:
+		return tiempo_ocupado + en_curso, tiempo_libre
+	return tiempo_ocupado, tiempo_libre + en_curso
 
 def guardar_movimiento_historial():
 	"""Guarda el historial de movimiento en un archivo JSON."""
 	try:
 		with open(MOVIMIENTO_ARCHIVO, "w") as archivo:
 			json.dump(movimiento_historial, archivo, indent=4)
-		print("Historial de movimiento actualizado.", flush=True)
+		log.debug("Historial de movimiento actualizado.")
 	except IOError as e:
-		print(f"Error al guardar el historial de movimiento: {e}", flush=True)
+		log.error("Error al guardar el historial de movimiento: %s", e)
 
 def cargar_movimiento_historial():
 	"""Carga el historial de movimiento del archivo JSON si existe."""
@@ -63,9 +61,9 @@ def cargar_movimiento_historial():
 		try:
 			with open(MOVIMIENTO_ARCHIVO, "r") as archivo:
 				movimiento_historial = json.load(archivo)
-				print("Historial de movimiento cargado.", flush=True)
+				log.info("Historial de movimiento cargado.")
 		except (IOError, json.JSONDecodeError) as e:
-			print(f"Error al cargar el historial de movimiento: {e}. Iniciando desde cero.", flush=True)
+			log.error("Error al cargar el historial de movimiento: %s. Iniciando desde cero.", e)
 
 # Validar argumentos
 if len(sys.argv) != 7:
@@ -81,12 +79,12 @@ velocidad = int(sys.argv[6])  # Velocidad del taxi
 
 # Validar posición inicial
 if not (0 <= x <= N and 0 <= y <= M):
-	print("Posición inicial fuera de los límites de la cuadrícula.", flush=True)
+	log.error("Posición inicial fuera de los límites de la cuadrícula.")
 	sys.exit(1)
 
 # Dirección IP y puerto del servidor central
-# Dirección IP de los servidores
-SERVERS = ["10.43.100.133", "10.43.101.2"]
+# Servidores del clúster (MY_UBER_CLUSTER, igual que en servidor_central.py)
+NODOS = cluster.nodos_configurados()
 TAXI_POSITION_PORT = 5555
 TAXI_ASSIGN_PORT = 5556
 
@@ -123,153 +121,203 @@ def mover_taxi():
 				else:
 					y = max(y - desplazamiento, 0)  # Mover abajo
 
-			print(f"Taxi {id_taxi} se movió a la posición ({x}, {y})", flush=True)
+			log.debug("Taxi %s se movió a la posición (%s, %s)", id_taxi, x, y)
 			movimiento_historial.append({"id_taxi": id_taxi, "posicion": (x, y), "timestamp": time.time()})
 			guardar_movimiento_historial()
 		else:
-			print(f"Taxi {id_taxi} está detenido o ocupado.", flush=True)
+			log.debug("Taxi %s está detenido o ocupado.", id_taxi)
 
 		time.sleep(intervalo_movimiento)
 		
 def detectar_servidor_principal():
-	"""Determina cuál servidor está activo realizando un health-check."""
-	for server_ip in SERVERS:
-		print(f"Detectando servidor activo en {server_ip}...", flush=True)
+	"""Pregunta a cada servidor si es el principal (solo el principal responde en DISCOVERY_PORT)."""
+	for nodo in NODOS:
+		log.debug("Detectando servidor activo en %s...", nodo)
+		socket = context.socket(zmq.REQ)
+		socket.setsockopt(zmq.RCVTIMEO, TIMEOUT_DESCUBRIMIENTO_MS)
+		socket.setsockopt(zmq.LINGER, 0)
 		try:
-			context = zmq.Context()
-			socket = context.socket(zmq.REQ)
-			socket.setsockopt(zmq.RCVTIMEO, 2000)  # Timeout de 2 segundos
-			socket.connect(f"tcp://{server_ip}:{HEALTH_CHECK_PORT}")
-			socket.send_string("ping")
+			socket.connect(cluster.direccion(nodo, DISCOVERY_PORT))
+			socket.send_string("¿Hay un principal?")
 			respuesta = socket.recv_string()
-			if respuesta.strip().lower() == "pong":
-				print(f"Servidor activo detectado: {server_ip}", flush=True)
-				socket.close()
-				return server_ip
-			socket.close()
+			if respuesta.strip().lower() == "sí":
+				log.info("Servidor principal detectado: %s", nodo)
+				return nodo
 		except zmq.error.Again:
-			print(f"Servidor {server_ip} no respondió al health-check.", flush=True)
+			log.warning("Servidor %s no respondió al descubrimiento.", nodo)
 		except Exception as e:
-			print(f"Error al verificar servidor {server_ip}: {e}", flush=True)
-	print("No se pudo detectar un servidor activo.", flush=True)
+			log.error("Error al verificar servidor %s: %s", nodo, e)
+		finally:
+			socket.close()
+	log.warning("No se pudo detectar un servidor activo.")
 	return None
 
-def enviar_posiciones():
-	context = zmq.Context()
-	"""Envía la posición del taxi al servidor central periódicamente."""
+def obtener_servidor_principal():
+	"""Principal guardado o, si no hay, uno recién descubierto."""
+	global servidor_principal
+	with servidor_principal_lock:
+		if servidor_principal is None:
+			servidor_principal = detectar_servidor_principal()
+		return servidor_principal
+
+def invalidar_servidor_principal(nodo, motivo):
+	"""Descarta el principal guardado si sigue siendo 'nodo'; el próximo envío vuelve a descubrirlo.
+
+	Si mientras tanto se adoptó otro principal anunciado, el fallo de 'nodo' ya no importa.
+	"""
+	global servidor_principal
+	with servidor_principal_lock:
+		if servidor_principal is nodo:
+			log.info("Taxi %s descarta el principal %s: %s", id_taxi, nodo, motivo)
+			servidor_principal = None
+
+def adoptar_servidor_principal(nodo):
+	"""Guarda 'nodo' como principal sin preguntarle: lo anunció él mismo."""
+	global servidor_principal
+	with servidor_principal_lock:
+		if servidor_principal is not nodo:
+			log.info("Taxi %s adopta el principal anunciado: %s", id_taxi, nodo)
+		servidor_principal = nodo
+
+def escuchar_cambios_principal():
+	"""Adopta el principal anunciado si gana al último visto: término mayor o, con el mismo término, id mayor.
+
+	Es el mismo desempate que usan los servidores: si dos ganan el mismo
+	término, cede el de menor id y los taxis siguen al otro.
+	"""
+	socket = context.socket(zmq.SUB)
+	socket.setsockopt_string(zmq.SUBSCRIBE, "")
+	for nodo in NODOS:
+		socket.connect(cluster.direccion(nodo, ANUNCIO_PORT))
+	ultimo = (-1, -1)  # (término, nodo) del último anuncio adoptado
 	while servicios_completados < servicios_diarios:
-		servidor_activo = detectar_servidor_principal()
-		if not servidor_activo:
-			print("No hay servidores disponibles. Reintentando en 5 segundos...", flush=True)
-			time.sleep(5)
-			continue
-
 		try:
-			# Cerrar conexión previa si existe
-			if socket:
-				socket.close()
-			context = zmq.Context()
-			socket = context.socket(zmq.PUSH)
-			socket.connect(f"tcp://{servidor_activo}:{TAXI_POSITION_PORT}")
-			posicion = f"({x},{y})"
-			mensaje = f"{id_taxi}:{posicion}"
-			socket.send_string(mensaje)
-			print(f"Taxi {id_taxi} envió su posición: {posicion} a {servidor_activo}", flush=True)
-			socket.disconnect(f"tcp://{servidor_activo}:{TAXI_POSITION_PORT}")
-		except zmq.error.ZMQError as e:
-			print(f"Error al enviar posición al servidor {servidor_activo}: {e}", flush=True)
+			if socket.poll(1000):
+				anuncio = socket.recv_json()
+				# Cada anuncio se repite varias veces; uno de un término viejo viene de un líder destituido
+				if (anuncio["termino"], anuncio["nodo"]) > ultimo:
+					ultimo = (anuncio["termino"], anuncio["nodo"])
+					adoptar_servidor_principal(NODOS[anuncio["nodo"]])
 		except Exception as e:
-			print(f"Error inesperado al enviar posición: {e}", flush=True)
-		time.sleep(intervalo_movimiento)
+			log.error("Error en escuchar_cambios_principal: %s", e)
+	socket.close()
+
+def crear_socket_posiciones():
+	"""PUSH de posiciones que dura todo el proceso; ZeroMQ lo reconecta solo si se corta la conexión."""
+	socket = context.socket(zmq.PUSH)
+	# IMMEDIATE: solo se puede enviar por una conexión establecida, así un principal caído se nota
+	socket.setsockopt(zmq.IMMEDIATE, 1)
+	socket.setsockopt(zmq.SNDHWM, HWM_POSICIONES)
+	socket.setsockopt(zmq.LINGER, 0)  # Al cerrar, las posiciones pendientes ya no importan
+	return socket
+
+def enviar_mensaje(socket, mensaje):
+	"""Envía por la conexión ya abierta; devuelve False si el principal no la aceptó a tiempo."""
+	if not socket.poll(TIMEOUT_CONEXION_MS, zmq.POLLOUT):
+		return False
+	socket.send_string(mensaje, zmq.NOBLOCK)
+	return True
 
 def enviar_posiciones():
-	"""Envía la posición del taxi al servidor central periódicamente."""
-	context = zmq.Context()
+	"""Envía la posición del taxi al servidor central periódicamente.
+
+	El PUSH se conecta una vez al principal guardado y solo cambia de conexión
+	si cambia el principal: cada posición cuesta un envío, no una conexión TCP.
+	"""
+	socket = crear_socket_posiciones()
+	conectado = None  # Dirección a la que está conectado el PUSH
 	intentos = 0
 	max_reintentos = 5
 	intervalos_espera = 5  # Espera de 5 segundos entre intentos
 
 	while servicios_completados < servicios_diarios:
-		# Detectar cuál servidor está activo
-		servidor_activo = detectar_servidor_principal()
+		# Servidor principal guardado (se descubre solo la primera vez o tras un fallo)
+		servidor_activo = obtener_servidor_principal()
 		if not servidor_activo:
-			print(f"Taxi {id_taxi}: No hay servidores disponibles. Reintentando en {intervalos_espera} segundos...", flush=True)
+			log.warning("Taxi %s: No hay servidores disponibles. Reintentando en %s segundos...", id_taxi, intervalos_espera)
 			time.sleep(intervalos_espera)
 			intentos += 1
 			if intentos > max_reintentos:
-				print("Error persistente al detectar servidor activo. Terminando la ejecución.", flush=True)
+				log.error("Error persistente al detectar servidor activo. Terminando la ejecución.")
 				break
 			continue
 
 		try:
-			# Conectarse al servidor activo y enviar la posición
-			socket = context.socket(zmq.PUSH)
-			socket.connect(f"tcp://{servidor_activo}:{TAXI_POSITION_PORT}")
-			print(f"Taxi {id_taxi} enviando posiciones a tcp://{servidor_activo}:{TAXI_POSITION_PORT}", flush=True)
+			# Cambiar de conexión solo si cambió el principal
+			direccion = cluster.direccion(servidor_activo, TAXI_POSITION_PORT)
+			if direccion != conectado:
+				if conectado is not None:
+					socket.disconnect(conectado)
+				socket.connect(direccion)
+				conectado = direccion
+				log.debug("Taxi %s enviando posiciones a %s", id_taxi, direccion)
 			posicion = f"({x},{y})"
-			mensaje = f"{id_taxi}:{posicion}"
-			socket.send_string(mensaje)
-			print(f"Taxi {id_taxi} envió su posición: {posicion} a {servidor_activo}", flush=True)
-			socket.disconnect(f"tcp://{servidor_activo}:{TAXI_POSITION_PORT}")
-			intentos = 0  # Resetear el contador de intentos tras un envío exitoso
+			ocupado_segundos, libre_segundos = tiempos_actuales()
+			mensaje = f"{id_taxi}:{posicion}:({ocupado_segundos:.1f},{libre_segundos:.1f})"
+			if enviar_mensaje(socket, mensaje):
+				log.debug("Taxi %s envió su posición: %s a %s", id_taxi, posicion, servidor_activo)
+				intentos = 0  # Resetear el contador de intentos tras un envío exitoso
+			else:
+				# Reintentar de inmediato con el principal que se descubra ahora
+				invalidar_servidor_principal(servidor_activo, "no aceptó la conexión")
+				continue
 		except zmq.error.ZMQError as e:
-			print(f"Error al enviar posición al servidor {servidor_activo}: {e}", flush=True)
+			log.error("Error al enviar posición al servidor %s: %s", servidor_activo, e)
 		except Exception as e:
-			print(f"Error inesperado al enviar posición: {e}", flush=True)
-		finally:
-			socket.close()
+			log.error("Error inesperado al enviar posición: %s", e)
 
 		# Esperar antes de enviar la próxima posición
 		time.sleep(intervalo_movimiento)
 
-	print(f"Taxi {id_taxi} ha completado todos sus servicios diarios.", flush=True)
+	socket.close()
+	log.info("Taxi %s ha completado todos sus servicios diarios.", id_taxi)
 
 
 
 def recibir_asignaciones():
 	"""Recibe asignaciones de servicios del servidor central."""
-	context = zmq.Context()
 	socket = context.socket(zmq.SUB)
 	socket.setsockopt_string(zmq.SUBSCRIBE, "")
-	global servicios_completados
+	global servicios_completados, tiempo_libre, tiempo_ocupado, ultimo_cambio_estado, ocupado, x, y
 	
+	conectado = False  # La suscripción se hace una vez; reconectar en cada vuelta duplicaría conexiones
 	while servicios_completados < servicios_diarios:
-		conectado = False
-		for server_ip in SERVERS:
-			try:
-				socket.connect(f"tcp://{server_ip}:{TAXI_ASSIGN_PORT}")
-				print(f"Taxi {id_taxi} suscrito a asignaciones en tcp://{server_ip}:{TAXI_ASSIGN_PORT}", flush=True)
-				conectado = True
-				break  # Salir del loop si se conecta exitosamente
-			except zmq.error.ZMQError as e:
-				print(f"Error conectando a {server_ip}:{TAXI_ASSIGN_PORT} para recibir asignaciones: {e}", flush=True)
-				socket.disconnect(f"tcp://{server_ip}:{TAXI_ASSIGN_PORT}")
-				continue  # Intentar con el siguiente servidor
-			except Exception as e:
-				print(f"Error en recibir_asignaciones: {e}", flush=True)
-				socket.disconnect(f"tcp://{server_ip}:{TAXI_ASSIGN_PORT}")
-				continue  # Intentar con el siguiente servidor
+		if not conectado:
+			for nodo in NODOS:
+				try:
+					socket.connect(cluster.direccion(nodo, TAXI_ASSIGN_PORT))
+					log.info("Taxi %s suscrito a asignaciones en %s", id_taxi, cluster.direccion(nodo, TAXI_ASSIGN_PORT))
+					conectado = True
+					break  # Salir del loop si se conecta exitosamente
+				except zmq.error.ZMQError as e:
+					log.error("Error conectando a %s para recibir asignaciones: %s", cluster.direccion(nodo, TAXI_ASSIGN_PORT), e)
+					socket.disconnect(cluster.direccion(nodo, TAXI_ASSIGN_PORT))
+					continue  # Intentar con el siguiente servidor
+				except Exception as e:
+					log.error("Error en recibir_asignaciones: %s", e)
+					socket.disconnect(cluster.direccion(nodo, TAXI_ASSIGN_PORT))
+					continue  # Intentar con el siguiente servidor
 		
 		if conectado:
 			try:
 				mensaje = socket.recv_string()
-				print(f"Taxi {id_taxi} recibió mensaje: {mensaje}", flush=True)
+				log.debug("Taxi %s recibió mensaje: %s", id_taxi, mensaje)
 				id_taxi_asignado, comando = mensaje.split(":")
 				if id_taxi_asignado == id_taxi and comando.strip().lower() == "asignado":
-					print(f"Taxi {id_taxi} recibió asignación de servicio.", flush=True)
+					log.info("Taxi %s recibió asignación de servicio.", id_taxi)
 					with ocupado_lock:
 						tiempo_libre += time.time() - ultimo_cambio_estado
 						ultimo_cambio_estado = time.time()
 						ocupado = True
 
 					# Simular servicio
-					print(f"Taxi {id_taxi} iniciando servicio...", flush=True)
+					log.info("Taxi %s iniciando servicio...", id_taxi)
 					time.sleep(30)  # Simular servicio (30 segundos para pruebas)
 					tiempo_ocupado += time.time() - ultimo_cambio_estado
 					ultimo_cambio_estado = time.time()
 					with ocupado_lock:
 						servicios_completados += 1
-					print(f"Taxi {id_taxi} finalizó el servicio {servicios_completados}. Regresando a la posición inicial {posicion_inicial}...", flush=True)
+					log.info("Taxi %s finalizó el servicio %s. Regresando a la posición inicial %s...", id_taxi, servicios_completados, posicion_inicial)
 					x, y = posicion_inicial
 					movimiento_historial.append({"id_taxi": id_taxi, "posicion": posicion_inicial, "timestamp": time.time()})
 					guardar_movimiento_historial()
@@ -277,35 +325,34 @@ def recibir_asignaciones():
 					with ocupado_lock:
 						ocupado = False
 				else:
-					print(f"Taxi {id_taxi} ignoró mensaje para Taxi {id_taxi_asignado}.", flush=True)
+					log.debug("Taxi %s ignoró mensaje para Taxi %s.", id_taxi, id_taxi_asignado)
 			except zmq.error.Again:
-				print(f"Taxi {id_taxi}: Timeout esperando asignaciones.", flush=True)
+				log.debug("Taxi %s: Timeout esperando asignaciones.", id_taxi)
 			except Exception as e:
-				print(f"Error en recibir_asignaciones: {e}", flush=True)
+				log.error("Error en recibir_asignaciones: %s", e)
 		else:
 			intentos += 1
 			if intentos > max_reintentos:
-				print("Error persistente al recibir asignaciones. Terminando la ejecución.", flush=True)
+				log.error("Error persistente al recibir asignaciones. Terminando la ejecución.")
 				break
-			print(f"Taxi {id_taxi}: No pudo conectar a ningún servidor para asignaciones. Reintentando en {intervalos_espera} segundos.", flush=True)
+			log.warning("Taxi %s: No pudo conectar a ningún servidor para asignaciones. Reintentando en %s segundos.", id_taxi, intervalos_espera)
 			time.sleep(intervalos_espera)
 
-	print(f"Taxi {id_taxi} completó todos sus servicios diarios.", flush=True)
-	guardar_metricas()  # Guardar métricas al finalizar
-	print(f"Métricas finales para Taxi {id_taxi}:", flush=True)
-	print(f"Tiempo total ocupado: {tiempo_ocupado:.2f} segundos", flush=True)
-	print(f"Tiempo total libre: {tiempo_libre:.2f} segundos", flush=True)
+	log.info("Taxi %s completó todos sus servicios diarios.", id_taxi)
+	log.info("Métricas finales para Taxi %s:", id_taxi)
+	log.info("Tiempo total ocupado: %.2f segundos", tiempo_ocupado)
+	log.info("Tiempo total libre: %.2f segundos", tiempo_libre)
 	socket.close()
 
 
 if __name__ == "__main__":
 	cargar_movimiento_historial()
-	cargar_metricas()
 	try:
 		# Iniciar hilos sin ser daemon
 		enviar_thread = threading.Thread(target=enviar_posiciones)
 		recibir_thread = threading.Thread(target=recibir_asignaciones)
 		mover_thread = threading.Thread(target=mover_taxi)
+		threading.Thread(target=escuchar_cambios_principal, daemon=True).start()
 		
 		enviar_thread.start()
 		recibir_thread.start()
@@ -316,8 +363,7 @@ if __name__ == "__main__":
 		recibir_thread.join()
 		mover_thread.join()
 	except KeyboardInterrupt:
-		guardar_metricas()  # Guardar métricas en caso de interrupción
-		print(f"Métricas finales para Taxi {id_taxi}:", flush=True)
-		print(f"Tiempo total ocupado: {tiempo_ocupado:.2f} segundos", flush=True)
-		print(f"Tiempo total libre: {tiempo_libre:.2f} segundos", flush=True)
+		log.info("Métricas finales para Taxi %s:", id_taxi)
+		log.info("Tiempo total ocupado: %.2f segundos", tiempo_ocupado)
+		log.info("Tiempo total libre: %.2f segundos", tiempo_libre)
 		sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,93 @@
+# trazas.py
+
+import json
+import time
+import threading
+
+from histograma import HistogramaLatencias
+
+class Traza:
+	"""Duración de cada etapa de una solicitud o actualización de posición.
+
+	Cada llamada a tramo(etapa) cierra la etapa en curso: su duración es el
+	tiempo desde el tramo anterior (o desde que se creó la traza).
+	"""
+
+	__slots__ = ("tipo", "inicio", "marca", "tramos")
+
+	def __init__(self, tipo):
+		self.tipo = tipo
+		self.inicio = self.marca = time.perf_counter()
+		self.tramos = []
+
+	def tramo(self, etapa):
+		ahora = time.perf_counter()
+		self.tramos.append((etapa, ahora - self.marca))
+		self.marca = ahora
+
+	def total(self):
+		return self.marca - self.inicio
+
+class RegistroTramos:
+	"""Agrega las trazas en un histograma por tipo y etapa y, opcionalmente, las escribe en un archivo.
+
+	El archivo de trazas tiene una línea JSON por traza y se escribe por bloques
+	(cada 'bloque' trazas o cada 'intervalo' segundos) para no tocar el disco en
+	cada solicitud.
+	"""
+
+	def __init__(self, archivo=None, bloque=256, intervalo=1.0):
+		self.histogramas = {}  # (tipo, etapa) -> HistogramaLatencias; la etapa "total" es la traza completa
+		self.lock = threading.Lock()
+		self.archivo = open(archivo, "a") if archivo else None
+		self.bloque = bloque
+		self.intervalo = intervalo
+		self.ultima_escritura = time.time()
+		self.pendientes = []
+
+	def registrar(self, traza):
+		with self.lock:
+			for etapa, duracion in traza.tramos:
+				self._histograma(traza.tipo, etapa).registrar(duracion)
+			self._histograma(traza.tipo, "total").registrar(traza.total())
+			if self.archivo is not None:
+				self.pendientes.append({
+					"tipo": traza.tipo,
+					"inicio": time.time() - (time.perf_counter() - traza.inicio),
+					"tramos": dict(traza.tramos),
+					"total": traza.total()
+				})
+				if len(self.pendientes) >= self.bloque or time.time() - self.ultima_escritura >= self.intervalo:
+					self._escribir()
+
+	def _histograma(self, tipo, etapa):
+		histograma = self.histogramas.get((tipo, etapa))
+		if histograma is None:
+			histograma = self.histogramas[(tipo, etapa)] = HistogramaLatencias()
+		return histograma
+
+	def _escribir(self):
+		self.archivo.write("".join(json.dumps(traza) + "\n" for traza in self.pendientes))
+		self.archivo.flush()
+		self.pendientes = []
+		self.ultima_escritura = time.time()
+
+	def copiar(self):
+		"""Copia de los histogramas {(tipo, etapa): histograma} para leerlos sin el lock."""
+		with self.lock:
+			return {clave: histograma.copiar() for clave, histograma in self.histogramas.items()}
+
+	def resumen(self):
+		"""{tipo: {etapa: resumen del histograma}} para el archivo de métricas."""
+		resumen = {}
+		for (tipo, etapa), histograma in sorted(self.copiar().items()):
+			resumen.setdefault(tipo, {})[etapa] = histograma.resumen()
+		return resumen
+
+	def cerrar(self):
+		with self.lock:
+			if self.archivo is not None:
+				if self.pendientes:
+					self._escribir()
+				self.archivo.close()
+				self.archivo = None
@@ -6,12 +6,18 @@ import random
 import json
 import os
 
+from histograma import HistogramaLatencias
+import registro
+import cluster
+
+log = registro.obtener("usuario")
+
 # Archivo para estadísticas
 ESTADISTICAS_ARCHIVO = "estadisticas_usuario.json"
 estadisticas = {
 	"solicitudes_exitosas": 0,
 	"solicitudes_fallidas": 0,
-	"tiempos_respuesta": [],
+	"tiempos_respuesta": HistogramaLatencias(),
 	"razones_fallo": []  # Para registrar los motivos de fallos
 }
 
@@ -19,12 +25,16 @@ lock = threading.Lock()
 
 def guardar_estadisticas():
 	"""Guarda las estadísticas en un archivo JSON."""
+	with lock:
+		copia = dict(estadisticas)
+		copia["tiempos_respuesta"] = estadisticas["tiempos_respuesta"].a_dict()
+		copia["razones_fallo"] = list(estadisticas["razones_fallo"])
 	try:
 		with open(ESTADISTICAS_ARCHIVO, "w") as archivo:
-			json.dump(estadisticas, archivo, indent=4)
-		print("Estadísticas actualizadas en estadisticas_usuario.json")
+			json.dump(copia, archivo, indent=4)
+		log.debug("Estadísticas actualizadas en estadisticas_usuario.json")
 	except IOError as e:
-		print(f"Error al guardar estadísticas: {e}")
+		log.error("Error al guardar estadísticas: %s", e)
 
 def cargar_estadisticas():
 	"""Carga estadísticas de un archivo JSON si existe."""
@@ -33,28 +43,29 @@ def cargar_estadisticas():
 		try:
 			with open(ESTADISTICAS_ARCHIVO, "r") as archivo:
 				estadisticas = json.load(archivo)
-			print("Estadísticas cargadas desde estadisticas_usuario.json")
+			estadisticas["tiempos_respuesta"] = HistogramaLatencias.cargar(estadisticas.get("tiempos_respuesta"))
+			log.info("Estadísticas cargadas desde estadisticas_usuario.json")
 		except (IOError, json.JSONDecodeError) as e:
-			print(f"Error al cargar estadísticas: {e}. Iniciando desde cero.")
+			log.error("Error al cargar estadísticas: %s. Iniciando desde cero.", e)
 
 def hilo_usuario(id_usuario, posicion, tiempo_espera, context, SERVERS, SERVER_PORT, max_reintentos=3):
 	"""Función que representa el comportamiento de un usuario."""
 	x, y = posicion
-	print(f"Usuario {id_usuario} inicializado en posición ({x}, {y}). Esperará {tiempo_espera} segundos para pedir un taxi.")
+	log.debug("Usuario %s inicializado en posición (%s, %s). Esperará %s segundos para pedir un taxi.", id_usuario, x, y, tiempo_espera)
 
 	# Dormir hasta que el usuario necesite un taxi
 	time.sleep(tiempo_espera)
 
-	print(f"Usuario {id_usuario} solicita un taxi desde posición ({x}, {y}).")
+	log.debug("Usuario %s solicita un taxi desde posición (%s, %s).", id_usuario, x, y)
 
 	timeout = 5000  # Tiempo inicial en ms
 	mensaje_solicitud = json.dumps({"id_usuario": id_usuario, "x": x, "y": y})
 	
 	for intento in range(max_reintentos):
-		for server_ip in SERVERS:
+		for nodo in SERVERS:
 			try:
 				socket = context.socket(zmq.REQ)
-				socket.connect(f"tcp://{server_ip}:{SERVER_PORT}")
+				socket.connect(cluster.direccion(nodo, SERVER_PORT))
 				socket.RCVTIMEO = timeout
 				tiempo_inicio = time.time()
 				
@@ -63,47 +74,52 @@ def hilo_usuario(id_usuario, posicion, tiempo_espera, context, SERVERS, SERVER_P
 				respuesta = json.loads(socket.recv_string())
 				tiempo_respuesta = time.time() - tiempo_inicio
 
+				if respuesta.get("status") == "no_principal":
+					# Un respaldo responde de inmediato: se prueba el siguiente servidor sin esperar el timeout
+					log.debug("Usuario %s: %s no es el principal.", id_usuario, nodo)
+					socket.close()
+					continue
 				if respuesta.get("status") == "asignado":
-					print(f"Usuario {id_usuario} recibió un taxi {respuesta['taxi_id']}. Tiempo de respuesta: {tiempo_respuesta:.2f} segundos.")
+					log.info("Usuario %s recibió un taxi %s. Tiempo de respuesta: %.2f segundos.", id_usuario, respuesta['taxi_id'], tiempo_respuesta)
 					with lock:
 						estadisticas["solicitudes_exitosas"] += 1
-						estadisticas["tiempos_respuesta"].append(tiempo_respuesta)
+						estadisticas["tiempos_respuesta"].registrar(tiempo_respuesta)
 					socket.close()
 					return  # Salir si la solicitud fue exitosa
 				else:
-					print(f"Usuario {id_usuario} no recibió un taxi. Respuesta: {respuesta.get('mensaje', 'Sin mensaje.')}.")
+					log.info("Usuario %s no recibió un taxi. Respuesta: %s.", id_usuario, respuesta.get('mensaje', 'Sin mensaje.'))
 					
 					# Decidir si reintentar en caso de rechazo
 					if respuesta.get("mensaje") == "No hay taxis disponibles." and intento < max_reintentos - 1:
 						timeout += 2000  # Incrementar el tiempo de espera antes de reintentar
-						print(f"Usuario {id_usuario}: Reintentando debido a que no hay taxis disponibles. Intento {intento + 2}/{max_reintentos}")
+						log.info("Usuario %s: Reintentando debido a que no hay taxis disponibles. Intento %s/%s", id_usuario, intento + 2, max_reintentos)
 						time.sleep(16)  # Esperar antes de reintentar
 					else:
 						with lock:
 							estadisticas["solicitudes_fallidas"] += 1
 							estadisticas["razones_fallo"].append(respuesta.get("mensaje", "Sin mensaje."))
-							estadisticas["tiempos_respuesta"].append(tiempo_respuesta)
+							estadisticas["tiempos_respuesta"].registrar(tiempo_respuesta)
 						socket.close()
 						return  # Salir si no se desea reintentar
 			except zmq.error.Again:
-				print(f"Usuario {id_usuario}: Timeout al intentar conectar con {server_ip} en el intento {intento + 1}", flush=True)
+				log.warning("Usuario %s: Timeout al intentar conectar con %s en el intento %s", id_usuario, nodo, intento + 1)
 				socket.close()
 				continue  # Intentar con el siguiente servidor
 			except Exception as e:
-				print(f"Usuario {id_usuario}: Error al intentar conectar con {server_ip}: {e}", flush=True)
+				log.error("Usuario %s: Error al intentar conectar con %s: %s", id_usuario, nodo, e)
 				socket.close()
 				continue  # Intentar con el siguiente servidor
 		
 		# Si no se pudo conectar a ningún servidor, reintentar después
 		if intento < max_reintentos - 1:
-			print(f"Usuario {id_usuario}: Reintentando todos los servidores. Intento {intento + 2}/{max_reintentos}", flush=True)
+			log.warning("Usuario %s: Reintentando todos los servidores. Intento %s/%s", id_usuario, intento + 2, max_reintentos)
 			timeout += 2000  # Incrementar el tiempo de espera antes de reintentar
 			time.sleep(5)  # Esperar antes de reintentar
 		else:
 			with lock:
 				estadisticas["solicitudes_fallidas"] += 1
 				estadisticas["razones_fallo"].append("timeout")
-				estadisticas["tiempos_respuesta"].append(timeout / 1000)
+				estadisticas["tiempos_respuesta"].registrar(timeout / 1000)
 
 	guardar_estadisticas()
 
@@ -126,12 +142,12 @@ def generador_usuarios(Y, archivo_coordenadas, context, SERVERS, SERVER_PORT):
 					hilos.append(hilo)
 					hilo.start()
 				except ValueError as e:
-					print(f"Error procesando línea '{linea}': {e}")
+					log.error("Error procesando línea '%s': %s", linea, e)
 	except FileNotFoundError:
-		print(f"Error: El archivo '{archivo_coordenadas}' no existe.")
+		log.error("Error: El archivo '%s' no existe.", archivo_coordenadas)
 		sys.exit(1)
 	except ValueError:
-		print("Error: El archivo debe contener coordenadas en formato X,Y.")
+		log.error("Error: El archivo debe contener coordenadas en formato X,Y.")
 		sys.exit(1)
 
 	# Esperar a que todos los hilos terminen
@@ -139,15 +155,17 @@ def generador_usuarios(Y, archivo_coordenadas, context, SERVERS, SERVER_PORT):
 		hilo.join()
 
 	# Mostrar estadísticas finales
-	tiempo_promedio = sum(estadisticas["tiempos_respuesta"]) / len(estadisticas["tiempos_respuesta"]) if estadisticas["tiempos_respuesta"] else 0
+	latencias = estadisticas["tiempos_respuesta"].resumen()
+	tiempo_promedio = latencias["media"]
 	porcentaje_fallos = (estadisticas["solicitudes_fallidas"] / max(1, (estadisticas["solicitudes_exitosas"] + estadisticas["solicitudes_fallidas"]))) * 100
 
-	print("Resultados finales:")
-	print(f"Solicitudes exitosas: {estadisticas['solicitudes_exitosas']}")
-	print(f"Solicitudes fallidas: {estadisticas['solicitudes_fallidas']}")
-	print(f"Razones de fallo: {estadisticas['razones_fallo']}")
-	print(f"Tiempo promedio de respuesta: {tiempo_promedio:.2f} segundos")
-	print(f"Porcentaje de solicitudes fallidas: {porcentaje_fallos:.2f}%")
+	log.info("Resultados finales:")
+	log.info("Solicitudes exitosas: %s", estadisticas['solicitudes_exitosas'])
+	log.info("Solicitudes fallidas: %s", estadisticas['solicitudes_fallidas'])
+	log.info("Razones de fallo: %s", estadisticas['razones_fallo'])
+	log.info("Tiempo promedio de respuesta: %.2f segundos", tiempo_promedio)
+	log.info("Percentiles de respuesta: p50 %.2fs, p90 %.2fs, p99 %.2fs, p99.9 %.2fs", latencias['p50'], latencias['p90'], latencias['p99'], latencias['p999'])
+	log.info("Porcentaje de solicitudes fallidas: %.2f%%", porcentaje_fallos)
 
 
 # Parámetros iniciales
@@ -160,8 +178,8 @@ M = int(sys.argv[2])  # Tamaño de la cuadrícula (columnas)
 Y = int(sys.argv[3])  # Número de usuarios a generar
 archivo_coordenadas = sys.argv[4]  # Archivo con coordenadas
 
-# Dirección de los servidores
-SERVERS = ["10.43.100.133", "10.43.101.2"]
+# Servidores del clúster (MY_UBER_CLUSTER, igual que en servidor_central.py)
+SERVERS = cluster.nodos_configurados()
 SERVER_PORT = 5557  # Puerto para solicitudes de taxis
 
 